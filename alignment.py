@@ -0,0 +1,283 @@
+"""
+Alignment Module for theSmallComparator
+Handles part alignment: locates fiducials and edges with the camera and solves the rigid transform between part and machine coordinates
+"""
+
+import logging
+import math
+
+import cv2 as cv
+import numpy as np
+
+from measurement_program import Datum
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.alignment')
+
+FEATURE_TYPES = ('point', 'edge')
+# Blobs smaller than this (in pixels) are dust, not fiducials
+MIN_FIDUCIAL_AREA = 30
+# Edge points within this many pixels of the one nearest the reticle are fitted with a line
+EDGE_FIT_RADIUS = 40
+
+
+def find_fiducial(frame, min_area=MIN_FIDUCIAL_AREA):
+    """
+    Centre of the round mark or hole closest to the frame centre
+
+    The frame is split into light and dark with Otsu's threshold and the
+    centroid of each closed outline (image moments, sub-pixel) is a
+    candidate; outlines cut by the frame border are skipped.
+
+    Args:
+        frame (numpy.ndarray): BGR or grayscale frame
+        min_area (float): Smallest accepted area in pixels
+
+    Returns:
+        tuple: (x, y) pixel coordinates, or None if there is no mark
+    """
+    gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    smooth = cv.GaussianBlur(gray, (0, 0), 1.0)
+    _, binary = cv.threshold(smooth, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+    contours, _ = cv.findContours(binary, cv.RETR_LIST, cv.CHAIN_APPROX_NONE)
+    height, width = gray.shape
+    centre = ((width - 1) / 2.0, (height - 1) / 2.0)
+    best = None
+    for contour in contours:
+        x, y, w, h = cv.boundingRect(contour)
+        if x <= 1 or y <= 1 or x + w >= width - 1 or y + h >= height - 1:
+            continue
+        moments = cv.moments(contour)
+        if moments['m00'] < min_area:
+            continue
+        point = (moments['m10'] / moments['m00'], moments['m01'] / moments['m00'])
+        distance = math.hypot(point[0] - centre[0], point[1] - centre[1])
+        if best is None or distance < best[0]:
+            best = (distance, point)
+    return best[1] if best else None
+
+
+def guess_datum(position, feature, angle=0.0):
+    """
+    Rough datum with a nominal feature at the current stage position
+
+    Args:
+        position (dict): Machine position with the feature under the reticle
+        feature (dict): Nominal feature ('x', 'y' in part coordinates)
+        angle (float): Expected part rotation in radians
+
+    Returns:
+        Datum: Starting point for align_part()
+    """
+    datum = Datum(0.0, 0.0, position.get('z', 0.0), angle)
+    x, y, _ = datum.to_machine(float(feature['x']), float(feature['y']))
+    datum.x, datum.y = position['x'] - x, position['y'] - y
+    return datum
+
+
+def solve_rigid(part_points, machine_points):
+    """
+    Least-squares rotation and translation taking part points onto machine points (Kabsch)
+
+    Args:
+        part_points (array): (N, 2) nominal positions in part coordinates, N >= 2
+        machine_points (array): (N, 2) measured machine positions
+
+    Returns:
+        Datum: The part coordinate system (z left at 0)
+    """
+    part = np.asarray(part_points, dtype=np.float64).reshape(-1, 2)
+    machine = np.asarray(machine_points, dtype=np.float64).reshape(-1, 2)
+    if len(part) < 2:
+        raise ValueError("Two points are needed to fix the rotation")
+    part_mean, machine_mean = part.mean(axis=0), machine.mean(axis=0)
+    covariance = (part - part_mean).T @ (machine - machine_mean)
+    # In 2D the optimal (proper) rotation angle has a closed form
+    angle = math.atan2(covariance[0, 1] - covariance[1, 0], covariance[0, 0] + covariance[1, 1])
+    cos, sin = math.cos(angle), math.sin(angle)
+    origin = machine_mean - np.array([[cos, -sin], [sin, cos]]) @ part_mean
+    return Datum(origin[0], origin[1], 0.0, angle)
+
+
+def solve_datum(features, guess):
+    """
+    Rigid transform from any mix of point and edge measurements (Gauss-Newton)
+
+    A point feature pins a nominal part point to a measured machine point
+    (two equations); an edge feature only requires the measured machine
+    point to lie on the nominal part edge (one equation), so three edges,
+    not all parallel, fix the part as well as two points do.
+
+    Args:
+        features (list): Dicts with 'type' ('point' or 'edge'), nominal part 'x', 'y',
+            edge normal 'nx', 'ny' (part coordinates) for edges, and the measured
+            'machine' (x, y)
+        guess (Datum): Starting transform
+
+    Returns:
+        tuple: (Datum, list of per-feature residuals in mm)
+
+    Raises:
+        ValueError: If the features cannot fix the rotation and both translations
+    """
+    angle, tx, ty = guess.angle, guess.x, guess.y
+    for _ in range(20):
+        residuals, rows = [], []
+        cos, sin = math.cos(angle), math.sin(angle)
+        for feature in features:
+            px, py = feature['x'], feature['y']
+            mx, my = feature['machine']
+            if feature['type'] == 'point':
+                residuals += [cos * px - sin * py + tx - mx, sin * px + cos * py + ty - my]
+                rows += [[-sin * px - cos * py, 1.0, 0.0], [cos * px - sin * py, 0.0, 1.0]]
+            else:
+                # Edge normal in machine axes; residual is the signed distance to the edge line
+                nx, ny = cos * feature['nx'] - sin * feature['ny'], sin * feature['nx'] + cos * feature['ny']
+                residuals.append(feature['nx'] * px + feature['ny'] * py + nx * (tx - mx) + ny * (ty - my))
+                rows.append([-ny * (tx - mx) + nx * (ty - my), nx, ny])
+        jacobian = np.array(rows)
+        if np.linalg.matrix_rank(jacobian, tol=1e-6) < 3:
+            raise ValueError("The features do not fix the part: use two points, or three edges not all parallel")
+        delta = np.linalg.lstsq(jacobian, -np.array(residuals), rcond=None)[0]
+        angle, tx, ty = angle + delta[0], tx + delta[1], ty + delta[2]
+        if np.max(np.abs(delta)) < 1e-9:
+            break
+    datum = Datum(tx, ty, guess.z, angle)
+    errors = []
+    for feature in features:
+        x, y, _ = datum.to_part(*feature['machine'])
+        if feature['type'] == 'point':
+            errors.append(math.hypot(x - feature['x'], y - feature['y']))
+        else:
+            errors.append(abs((x - feature['x']) * feature['nx'] + (y - feature['y']) * feature['ny']))
+    return datum, errors
+
+
+def validate_features(features):
+    """
+    Normalise alignment features (unit edge normals, float coordinates)
+
+    Raises:
+        ValueError: If a feature is malformed
+    """
+    cleaned = []
+    for index, feature in enumerate(features):
+        kind = feature.get('type', 'point')
+        if kind not in FEATURE_TYPES:
+            raise ValueError(f"Feature {index + 1}: unknown type {kind!r}")
+        item = {'type': kind, 'x': float(feature['x']), 'y': float(feature['y'])}
+        if kind == 'edge':
+            length = math.hypot(float(feature['nx']), float(feature['ny']))
+            if length == 0:
+                raise ValueError(f"Feature {index + 1}: an edge needs a normal (nx, ny)")
+            item['nx'], item['ny'] = float(feature['nx']) / length, float(feature['ny']) / length
+        cleaned.append(item)
+    return cleaned
+
+
+def align_part(controller, frames, mapping, features, guess, feed=None, max_residual=0.05):
+    """
+    Visit each feature at its expected position, locate it in a frame taken
+    at rest and solve the part's datum. Once two features are known the
+    estimate is refined before moving to the next, so a part placed a few
+    degrees off still brings later features into the field.
+
+    Args:
+        controller (MachineController): Machine to move
+        frames (FrameRing): Ring the capture thread publishes frames to
+        mapping (PixelMapping): Camera calibration for the ring's frames
+        features (list): Nominal features, see validate_features()
+        guess (Datum): Rough part position, e.g. the first feature under the reticle
+        feed (float): Feed rate between features in mm/min, defaults to the controller's fastest
+        max_residual (float): Largest accepted misfit of one feature in mm
+
+    Returns:
+        dict: 'datum', per-feature 'features' with their measured machine positions
+            and residuals, and 'rms' misfit
+
+    Raises:
+        ValueError: For malformed or insufficient features
+        RuntimeError: If a feature is not found or the features do not fit the drawing
+    """
+    features = validate_features(features)
+    feed = feed or controller.feed_rates['faster']
+    datum = guess
+    measured = []
+    for index, feature in enumerate(features):
+        x, y, z = datum.to_machine(feature['x'], feature['y'])
+        controller.move_to(x=x, y=y, feed=feed)
+        position = controller.wait_for_idle(x=x, y=y)
+        if position is None:
+            raise RuntimeError(f"Machine did not reach feature {index + 1}")
+        view = frames.wait_newer(frames.seq, timeout=2.0)
+        if view is None:
+            raise RuntimeError("No camera frame during alignment")
+        with view:
+            machine = _locate(view.array, feature, datum, mapping, position)
+        if machine is None:
+            raise RuntimeError(f"Feature {index + 1} not found near X{x:.3f} Y{y:.3f}")
+        measured.append(dict(feature, machine=(float(machine[0]), float(machine[1]))))
+        if sum(2 if item['type'] == 'point' else 1 for item in measured) >= 3:
+            try:
+                datum = _solve(measured, datum)[0]
+            except ValueError:
+                pass  # Not enough independent features yet
+    datum, errors = _solve(measured, datum)
+    datum.z = guess.z
+    rms = math.sqrt(sum(error ** 2 for error in errors) / len(errors))
+    result = {'datum': datum.to_dict(), 'rms': rms,
+              'features': [dict(feature, machine=[round(v, 4) for v in feature['machine']],
+                                residual=round(error, 4)) for feature, error in zip(measured, errors)]}
+    logger.info(f"Part aligned at X{datum.x:.3f} Y{datum.y:.3f}, {math.degrees(datum.angle):.3f} deg, "
+                f"RMS {rms * 1000:.1f} um")
+    if max(errors) > max_residual:
+        raise RuntimeError(f"The features do not match the drawing (misfit {max(errors):.3f} mm)")
+    return result
+
+
+def _solve(measured, guess):
+    """Closed form for points only, iterative as soon as edges are involved"""
+    if all(feature['type'] == 'point' for feature in measured):
+        datum = solve_rigid([(f['x'], f['y']) for f in measured], [f['machine'] for f in measured])
+        datum.z = guess.z
+        return solve_datum(measured, datum)
+    return solve_datum(measured, guess)
+
+
+def _locate(frame, feature, datum, mapping, position):
+    """Machine position of a feature in a frame taken at `position`"""
+    if feature['type'] == 'point':
+        pixel = find_fiducial(frame)
+        return None if pixel is None else mapping.to_stage([pixel], position['x'], position['y'])[0]
+    from edge_tracer import find_edges, _tangent
+    edges = find_edges(frame)
+    if not edges:
+        return None
+    width, height = mapping.frame_size
+    centre = np.array([(width - 1) / 2.0, (height - 1) / 2.0])
+    points = np.concatenate(edges)
+    distances = np.hypot(*(points - centre).T)
+    # Line through the edge run around the point nearest the reticle, to average out pixel noise
+    nearest = points[np.argmin(distances)]
+    local = points[np.hypot(*(points - nearest).T) <= EDGE_FIT_RADIUS]
+    if len(local) >= 3:
+        tangent = _tangent(local)
+        mean = local.mean(axis=0)
+        nearest = mean + np.dot(centre - mean, tangent) * tangent
+    return mapping.to_stage(nearest[np.newaxis], position['x'], position['y'])[0]
+
+
+if __name__ == "__main__":
+    # A part rotated by 2 degrees at (40, 25): two fiducials and three edges give the same datum
+    true = Datum(40.0, 25.0, angle=math.radians(2.0))
+    holes = [(0.0, 0.0), (60.0, 10.0)]
+    print(solve_rigid(holes, [true.to_machine(x, y)[:2] for x, y in holes]).to_dict())
+    edges = [{'type': 'edge', 'x': 10.0, 'y': 0.0, 'nx': 0.0, 'ny': -1.0},
+             {'type': 'edge', 'x': 50.0, 'y': 0.0, 'nx': 0.0, 'ny': -1.0},
+             {'type': 'edge', 'x': 0.0, 'y': 15.0, 'nx': -1.0, 'ny': 0.0}]
+    for edge in edges:
+        # Measured a little along the edge from the nominal point, as a real probe would be
+        edge['machine'] = true.to_machine(edge['x'] + 0.3 * edge['ny'], edge['y'] - 0.3 * edge['nx'])[:2]
+    datum, errors = solve_datum(edges, Datum())
+    print(datum.to_dict(), max(errors))
@@ -0,0 +1,277 @@
+"""
+Logging Module for theSmallComparator
+Queue-based, rate-limited logging with per-subsystem levels and an in-memory ring buffer for the UI console
+"""
+
+import atexit
+import collections
+import itertools
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+# Every application module logs to 'comparator.<subsystem>'
+LOGGER_PREFIX = 'comparator'
+SUBSYSTEMS = ('serial', 'machine', 'klipper', 'camera', 'web', 'session', 'state', 'export', 'startup')
+
+# Per-subsystem levels from the environment, e.g. "serial=DEBUG,camera=WARNING"
+LEVELS_ENV = 'COMPARATOR_LOG_LEVELS'
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+DEFAULT_RING_SIZE = 2000
+
+_listener = None
+_ring_buffer = None
+_setup_lock = threading.Lock()
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Filter that lets through at most `burst` records per message template
+    every `period` seconds. Suppressed records are counted and the count is
+    appended to the next record of that template that gets through.
+
+    Records at ERROR and above are never dropped.
+    """
+
+    def __init__(self, burst=5, period=10.0, max_keys=1000):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._windows = collections.OrderedDict()  # key -> [window start, count, suppressed]
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        # The unformatted template, so "Jogging X+ by 1mm" and "by 2mm" share a budget
+        key = (record.name, record.levelno, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window else 0
+                self._windows[key] = window = [now, 0, 0]
+                self._windows.move_to_end(key)
+                while len(self._windows) > self.max_keys:
+                    self._windows.popitem(last=False)
+            else:
+                suppressed = 0
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    Handler keeping the most recent records as dictionaries in memory, each
+    with a sequence number so clients can fetch only what they haven't seen
+    """
+
+    def __init__(self, capacity=DEFAULT_RING_SIZE):
+        super().__init__()
+        self._records = collections.deque(maxlen=capacity)
+        self._seq = itertools.count(1)
+        self._records_lock = threading.Lock()
+
+    def emit(self, record):
+        try:
+            message = record.getMessage()
+            if getattr(record, 'suppressed', 0):
+                message += f" ({record.suppressed} similar messages suppressed)"
+            entry = {
+                'time': record.created,
+                'level': record.levelname,
+                'subsystem': _subsystem(record.name),
+                'message': message,
+            }
+            fields = getattr(record, 'fields', None)
+            if fields:
+                entry['fields'] = fields
+            with self._records_lock:
+                entry['seq'] = next(self._seq)
+                self._records.append(entry)
+        except Exception:
+            self.handleError(record)
+
+    def get_records(self, since=0, limit=None, level=None, subsystem=None):
+        """
+        Get buffered records
+
+        Args:
+            since (int): Only records with a sequence number above this
+            limit (int): Maximum number of (most recent) records
+            level (str): Minimum level name, e.g. 'WARNING'
+            subsystem (str): Only records from this subsystem
+
+        Returns:
+            list: Record dictionaries, oldest first
+        """
+        min_level = logging.getLevelName(level.upper()) if level else logging.NOTSET
+        if not isinstance(min_level, int):
+            min_level = logging.NOTSET
+        with self._records_lock:
+            records = [entry for entry in self._records if entry['seq'] > since]
+        records = [entry for entry in records
+                   if logging.getLevelName(entry['level']) >= min_level
+                   and (subsystem is None or entry['subsystem'] == subsystem)]
+        if limit is not None:
+            records = records[-limit:]
+        return records
+
+
+class _SuppressedCountFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            text += f" ({record.suppressed} similar messages suppressed)"
+        return text
+
+
+def _subsystem(logger_name):
+    prefix = LOGGER_PREFIX + '.'
+    return logger_name[len(prefix):] if logger_name.startswith(prefix) else logger_name
+
+
+def get_logger(subsystem):
+    """Get the logger of an application subsystem"""
+    return logging.getLogger(f'{LOGGER_PREFIX}.{subsystem}')
+
+
+def set_level(subsystem, level):
+    """
+    Change the level of one subsystem at runtime
+
+    Args:
+        subsystem (str): Subsystem name ('serial', 'camera'...) or 'root'
+        level (str or int): Level name or number
+
+    Returns:
+        str: The level name now in effect
+    """
+    if isinstance(level, str):
+        level = level.upper()
+        if not isinstance(logging.getLevelName(level), int):
+            raise ValueError(f"Unknown log level: {level}")
+    logger = logging.getLogger() if subsystem == 'root' else get_logger(subsystem)
+    logger.setLevel(level)
+    return logging.getLevelName(logger.getEffectiveLevel())
+
+
+def get_levels():
+    """Get the effective level of every subsystem"""
+    levels = {'root': logging.getLevelName(logging.getLogger().level)}
+    for subsystem in SUBSYSTEMS:
+        levels[subsystem] = logging.getLevelName(get_logger(subsystem).getEffectiveLevel())
+    return levels
+
+
+def parse_levels(spec):
+    """
+    Parse a "subsystem=LEVEL,..." string
+
+    Returns:
+        dict: Subsystem to level name
+    """
+    levels = {}
+    for item in (spec or '').split(','):
+        if '=' in item:
+            subsystem, level = item.split('=', 1)
+            levels[subsystem.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level='INFO', subsystem_levels=None, ring_size=DEFAULT_RING_SIZE,
+                  burst=5, period=10.0, stream=None):
+    """
+    Route all logging through a queue so callers never block on stream I/O.
+
+    The calling thread only filters (level, rate limit) and enqueues the
+    record; a listener thread formats it, writes it to the stream (journald
+    when run as a service) and stores it in the ring buffer. Calling again
+    only updates the levels.
+
+    Args:
+        level (str): Root level
+        subsystem_levels (dict): Subsystem to level overrides; merged with $COMPARATOR_LOG_LEVELS
+        ring_size (int): Number of records kept for the UI console
+        burst (int): Records allowed per message template and period
+        period (float): Rate limit window in seconds
+        stream: Output stream, defaults to stderr
+
+    Returns:
+        RingBufferHandler: The in-memory handler
+    """
+    global _listener, _ring_buffer
+    with _setup_lock:
+        root = logging.getLogger()
+        root.setLevel(level)
+        levels = parse_levels(os.environ.get(LEVELS_ENV))
+        levels.update(subsystem_levels or {})
+        for subsystem, subsystem_level in levels.items():
+            try:
+                set_level(subsystem, subsystem_level)
+            except ValueError as e:
+                print(f"Ignoring log level for {subsystem}: {e}", file=sys.stderr)
+
+        if _listener is not None:
+            return _ring_buffer
+
+        stream_handler = logging.StreamHandler(stream or sys.stderr)
+        stream_handler.setFormatter(_SuppressedCountFormatter(LOG_FORMAT))
+        _ring_buffer = RingBufferHandler(ring_size)
+
+        log_queue = queue.SimpleQueue()
+        queue_handler = logging.handlers.QueueHandler(log_queue)
+        queue_handler.addFilter(RateLimitFilter(burst=burst, period=period))
+
+        # Replace the handlers installed by the modules' basicConfig calls
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, _ring_buffer,
+                                                   respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+        return _ring_buffer
+
+
+def shutdown_logging():
+    """Write out queued records and stop the listener thread"""
+    global _listener
+    with _setup_lock:
+        listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+
+
+def get_ring_buffer():
+    """Get the in-memory handler, or None if setup_logging() was not called"""
+    return _ring_buffer
+
+
+if __name__ == "__main__":
+    # Test rate limiting and the ring buffer
+    ring = setup_logging(subsystem_levels={'serial': 'DEBUG'}, burst=3, period=60)
+    log = get_logger('serial')
+    for i in range(10):
+        log.debug(f"Received status response: <Idle|MPos:{i}.000,0.000,0.000>")
+    log.info("Connected", extra={'fields': {'port': '/dev/ttyUSB0'}})
+    shutdown_logging()
+    for entry in ring.get_records():
+        print(entry)
+    print(get_levels())
@@ -0,0 +1,320 @@
+"""
+Application State Module for theSmallComparator
+Thread-safe state shared by the Flask request handlers and background threads
+"""
+
+import threading
+import logging
+import time
+
+from dxf_handler import DXFHandler
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.state')
+
+
+class MeasurementState:
+    """
+    Recorded points, the running point-to-point differences and the session
+    they belong to. Every method holds the lock only for the in-memory update,
+    so a slow reader (an export, a JSON dump) never blocks point recording.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._points = []
+        self._polylines = []
+        self._dxf_handler = DXFHandler()
+        self.prev_point_x = 0.0
+        self.prev_point_y = 0.0
+        self.difference_x = 0.0
+        self.difference_y = 0.0
+        self.difference_distance = 0.0
+        self.session_id = None
+        self.session_point_count = 0
+
+    def record_point(self, x, y):
+        """
+        Append a point and update the differences to the previous one
+
+        Args:
+            x (float): X coordinate
+            y (float): Y coordinate
+
+        Returns:
+            tuple: (differences dict, session_id, sequence number of the point in the session)
+        """
+        with self._lock:
+            if self.prev_point_x != 0.0 or self.prev_point_y != 0.0:
+                self.difference_x = x - self.prev_point_x
+                self.difference_y = y - self.prev_point_y
+                self.difference_distance = ((self.difference_x ** 2) + (self.difference_y ** 2)) ** 0.5
+            else:
+                self.difference_x = 0.0
+                self.difference_y = 0.0
+                self.difference_distance = 0.0
+
+            self.prev_point_x = x
+            self.prev_point_y = y
+            self._points.append({'x': x, 'y': y})
+            self._dxf_handler.add_point(x, y)
+
+            seq = self.session_point_count
+            self.session_point_count += 1
+            return self._differences(), self.session_id, seq
+
+    def add_polyline(self, points, closed=False):
+        """
+        Add a traced contour to the drawing
+
+        Args:
+            points (list): List of (x, y) tuples
+            closed (bool): The contour is closed
+
+        Returns:
+            bool: True if the polyline was added
+        """
+        with self._lock:
+            if not self._dxf_handler.add_polyline(points, closed=closed):
+                return False
+            self._polylines.append({'points': [(float(x), float(y)) for x, y in points], 'closed': closed})
+            return True
+
+    def get_polylines(self):
+        """Get the contours added since the last reset"""
+        with self._lock:
+            return self._polylines[:]
+
+    def _differences(self):
+        return {'x': self.difference_x, 'y': self.difference_y, 'distance': self.difference_distance}
+
+    def get_differences(self):
+        """Get the differences between the last two recorded points"""
+        with self._lock:
+            return self._differences()
+
+    def get_points(self):
+        """
+        Get a snapshot of the recorded points. Only the list of references is
+        copied under the lock; point dictionaries are never mutated in place.
+
+        Returns:
+            list: List of point dictionaries
+        """
+        with self._lock:
+            return self._points[:]
+
+    def get_point_count(self):
+        with self._lock:
+            return len(self._points)
+
+    @property
+    def dxf_handler(self):
+        """DXF handler holding the recorded points (replaced on reset)"""
+        with self._lock:
+            return self._dxf_handler
+
+    def export_dxf(self, filename):
+        """
+        Export the recorded points and contours as a DXF. The drawing is
+        rebuilt from a snapshot, so points can be recorded during the export.
+        """
+        with self._lock:
+            points = self._points[:]
+            polylines = self._polylines[:]
+        drawing = DXFHandler()
+        drawing.add_points_from_list([(point['x'], point['y']) for point in points])
+        for polyline in polylines:
+            drawing.add_polyline(polyline['points'], closed=polyline['closed'])
+        return drawing.export_dxf(filename)
+
+    def reset(self, session_id=None, point_count=0, state=None):
+        """
+        Clear the recorded points and switch to another session
+
+        Args:
+            session_id (int): Session now being recorded
+            point_count (int): Number of points already stored in that session
+            state (dict): Saved prev_point_* / difference_* values to restore
+        """
+        state = state or {}
+        with self._lock:
+            self._points = []
+            self._polylines = []
+            self._dxf_handler = DXFHandler()
+            self.prev_point_x = state.get('prev_point_x', 0.0)
+            self.prev_point_y = state.get('prev_point_y', 0.0)
+            self.difference_x = state.get('difference_x', 0.0)
+            self.difference_y = state.get('difference_y', 0.0)
+            self.difference_distance = state.get('difference_distance', 0.0)
+            self.session_id = session_id
+            self.session_point_count = point_count
+
+    def prepend_loaded_points(self, session_id, points, dxf_handler):
+        """
+        Install points loaded from storage in front of those recorded since the load started
+
+        Args:
+            session_id (int): Session the points were loaded for
+            points (list): Loaded point dictionaries, in order
+            dxf_handler (DXFHandler): Drawing already holding the loaded points
+
+        Returns:
+            bool: False if another session became current while loading
+        """
+        with self._lock:
+            if self.session_id != session_id:
+                return False
+            for point in self._points:
+                dxf_handler.add_point(point['x'], point['y'])
+            for polyline in self._polylines:
+                dxf_handler.add_polyline(polyline['points'], closed=polyline['closed'])
+            self._points = points + self._points
+            self._dxf_handler = dxf_handler
+            return True
+
+    def get_state(self):
+        """Get the JSON-serializable measurement state saved with a session"""
+        with self._lock:
+            return {
+                'prev_point_x': self.prev_point_x,
+                'prev_point_y': self.prev_point_y,
+                'difference_x': self.difference_x,
+                'difference_y': self.difference_y,
+                'difference_distance': self.difference_distance,
+            }
+
+
+class CameraState:
+    """
+    The active camera and its capture thread. Swapping cameras releases the
+    previous one; readers get the handle without waiting on a frame read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.camera = None
+        self.camera_index = None
+        self.capture_thread = None
+
+    def get(self):
+        """
+        Returns:
+            tuple: (camera, camera_index)
+        """
+        with self._lock:
+            return self.camera, self.camera_index
+
+    def set(self, camera, camera_index):
+        """
+        Make a newly opened camera the active one
+
+        Args:
+            camera: Opened capture object
+            camera_index (int): Camera index
+        """
+        with self._lock:
+            previous = self.camera
+            self.camera = camera
+            self.camera_index = camera_index
+        if previous is not None and previous is not camera:
+            try:
+                previous.release()
+            except Exception as e:
+                logger.debug(f"Error releasing previous camera: {e}")
+
+    def start_capture(self, target):
+        """
+        Start the capture thread unless it is already running
+
+        Args:
+            target (callable): Capture loop
+
+        Returns:
+            bool: True if a new thread was started
+        """
+        with self._lock:
+            if self.capture_thread is not None and self.capture_thread.is_alive():
+                return False
+            self.capture_thread = threading.Thread(target=target, name="CameraCapture", daemon=True)
+            self.capture_thread.start()
+            return True
+
+
+class StartupState:
+    """
+    Progress of the background startup phases (backend detection, camera
+    cache, deferred imports), reported by the startup status endpoint
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started_at = time.monotonic()
+        self._phases = {}
+
+    def _phase(self, name):
+        return self._phases.setdefault(name, {'status': self.PENDING, 'detail': None, 'duration': None, '_start': None})
+
+    def add_phase(self, name):
+        with self._lock:
+            self._phase(name)
+
+    def start_phase(self, name):
+        with self._lock:
+            phase = self._phase(name)
+            phase['status'] = self.RUNNING
+            phase['_start'] = time.monotonic()
+
+    def finish_phase(self, name, detail=None, failed=False):
+        """
+        Mark a phase as finished
+
+        Args:
+            name (str): Phase name
+            detail: JSON-serializable result summary
+            failed (bool): True if the phase failed
+        """
+        with self._lock:
+            phase = self._phase(name)
+            phase['status'] = self.FAILED if failed else self.DONE
+            phase['detail'] = detail
+            if phase['_start'] is not None:
+                phase['duration'] = round(time.monotonic() - phase['_start'], 3)
+
+    def is_done(self, name):
+        """Check if a phase has finished, successfully or not"""
+        with self._lock:
+            phase = self._phases.get(name)
+            return phase is not None and phase['status'] in (self.DONE, self.FAILED)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: Overall readiness, elapsed time and per-phase status
+        """
+        with self._lock:
+            phases = {name: {key: value for key, value in phase.items() if not key.startswith('_')}
+                      for name, phase in self._phases.items()}
+        return {
+            'ready': all(phase['status'] in (self.DONE, self.FAILED) for phase in phases.values()),
+            'elapsed': round(time.monotonic() - self._started_at, 3),
+            'phases': phases,
+        }
+
+
+class AppState:
+    """
+    Container for the state shared between request handlers. Each part has
+    its own lock so unrelated requests never serialize on each other.
+    """
+
+    def __init__(self):
+        self.measurement = MeasurementState()
+        self.camera = CameraState()
+        self.startup = StartupState()
@@ -0,0 +1,452 @@
+"""
+GRBL Simulator Module for theSmallComparator benchmarks
+Emulates a GRBL 1.1 controller on a pseudo-terminal: 127-byte RX buffer, planner, realtime commands and status reports
+"""
+
+import collections
+import logging
+import math
+import os
+import re
+import select
+import termios
+import threading
+import time
+import tty
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.benchmark')
+
+
+RX_BUFFER_SIZE = 127        # GRBL serial receive buffer (bytes)
+PLANNER_BLOCKS = 15         # GRBL planner buffer on an ATmega328p
+LINE_PARSE_TIME = 0.0005    # Time to parse and plan one line (s)
+BANNER = "Grbl 1.1h ['$' for help]"
+
+# Defaults of a typical small plotter build
+DEFAULT_SETTINGS = {
+    0: 10, 1: 25, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0, 10: 1, 11: 0.010, 12: 0.002, 13: 0,
+    20: 0, 21: 0, 22: 0, 23: 0, 24: 25.0, 25: 500.0, 26: 250, 27: 1.0, 30: 1000, 31: 0, 32: 0,
+    100: 80.0, 101: 80.0, 102: 80.0, 110: 3000.0, 111: 3000.0, 112: 500.0,
+    120: 100.0, 121: 100.0, 122: 50.0, 130: 200.0, 131: 200.0, 132: 50.0,
+}
+
+REALTIME_STATUS = 0x3F      # '?'
+REALTIME_HOLD = 0x21        # '!'
+REALTIME_RESUME = 0x7E      # '~'
+REALTIME_RESET = 0x18       # Ctrl-X
+REALTIME_JOG_CANCEL = 0x85
+
+_WORD_PATTERN = re.compile(r'([A-Z])(-?\d*\.?\d+)')
+
+
+def trapezoid_time(distance, feed, accel):
+    """
+    Duration of a move that starts and ends at rest
+
+    Args:
+        distance (float): Path length in mm
+        feed (float): Cruise speed in mm/s
+        accel (float): Acceleration in mm/s^2
+
+    Returns:
+        float: Move time in seconds
+    """
+    if distance <= 0:
+        return 0.0
+    if distance >= feed * feed / accel:
+        return distance / feed + feed / accel
+    return 2.0 * math.sqrt(distance / accel)
+
+
+def trapezoid_distance(distance, feed, accel, elapsed):
+    """Distance covered after `elapsed` seconds of the same move"""
+    total = trapezoid_time(distance, feed, accel)
+    if elapsed >= total:
+        return distance
+    if distance >= feed * feed / accel:
+        ramp = feed / accel
+        if elapsed <= ramp:
+            return 0.5 * accel * elapsed ** 2
+        if elapsed <= total - ramp:
+            return 0.5 * accel * ramp ** 2 + feed * (elapsed - ramp)
+        remaining = total - elapsed
+        return distance - 0.5 * accel * remaining ** 2
+    half = total / 2.0
+    if elapsed <= half:
+        return 0.5 * accel * elapsed ** 2
+    remaining = total - elapsed
+    return distance - 0.5 * accel * remaining ** 2
+
+
+class _Block:
+    """One planned linear move"""
+
+    def __init__(self, start, target, feed, accel, jog):
+        self.start = start
+        self.target = target
+        self.distance = math.dist(start, target)
+        self.feed = feed
+        self.accel = accel
+        self.jog = jog
+        self.duration = trapezoid_time(self.distance, feed, accel)
+
+    def position_at(self, elapsed):
+        if self.distance == 0:
+            return self.target
+        fraction = trapezoid_distance(self.distance, self.feed, self.accel, elapsed) / self.distance
+        return tuple(s + (t - s) * fraction for s, t in zip(self.start, self.target))
+
+
+class GrblSimulator:
+    """
+    Class emulating a GRBL controller behind a pseudo-terminal.
+
+    The application connects to `port` like a real serial device. Bytes land
+    in a 127-byte RX buffer (overflowing bytes are dropped and counted),
+    realtime commands are picked out as they arrive, and each line is parsed
+    and planned into a 15-block planner. 'ok' is sent when the line is
+    planned, so a full planner delays it just like on the real controller.
+    Moves run with trapezoidal profiles from the $110-$122 settings.
+    """
+
+    def __init__(self, baudrate=115200, line_parse_time=LINE_PARSE_TIME):
+        """
+        Args:
+            baudrate (int): Simulated link speed, used to pace outgoing bytes (0 disables pacing)
+            line_parse_time (float): Time spent parsing each line in seconds
+        """
+        self.baudrate = baudrate
+        self.line_parse_time = line_parse_time
+        self.settings = dict(DEFAULT_SETTINGS)
+        self.stats = collections.Counter()
+
+        self._master_fd = None
+        self._slave_fd = None
+        self.port = None
+
+        self._lock = threading.Condition()
+        self._rx = collections.deque()
+        self._write_lock = threading.Lock()
+        self._planner = collections.deque()
+        self._current = None          # (block, start time, time already spent before a hold)
+        self._hold = False
+        self._position = (0.0, 0.0, 0.0)
+        self._relative = False
+        self._feed = 500.0
+        self._alarm = False
+        self._running = False
+        self._threads = []
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self):
+        """Open the pseudo-terminal and start the controller threads"""
+        self._master_fd, self._slave_fd = os.openpty()
+        for fd in (self._master_fd, self._slave_fd):
+            tty.setraw(fd, termios.TCSANOW)
+        self.port = os.ttyname(self._slave_fd)
+        self._running = True
+        for target in (self._reader_loop, self._protocol_loop, self._motion_loop):
+            thread = threading.Thread(target=target, name=f"grbl-sim-{target.__name__}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self._write_line(BANNER)
+        logger.info(f"GRBL simulator on {self.port}")
+        return self
+
+    def stop(self):
+        self._running = False
+        with self._lock:
+            self._lock.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        for fd in (self._master_fd, self._slave_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._master_fd = self._slave_fd = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # -- serial side -------------------------------------------------------
+
+    def _write(self, data):
+        if self.baudrate:
+            # 10 bits per byte on an 8N1 link
+            time.sleep(len(data) * 10.0 / self.baudrate)
+        with self._write_lock:
+            try:
+                os.write(self._master_fd, data)
+                self.stats['bytes_sent'] += len(data)
+            except (OSError, TypeError):
+                pass
+
+    def _write_line(self, text):
+        self._write(text.encode() + b'\r\n')
+
+    def _reader_loop(self):
+        """Receive bytes like GRBL's serial ISR: realtime commands immediately, the rest into the RX buffer"""
+        while self._running:
+            try:
+                ready, _, _ = select.select([self._master_fd], [], [], 0.05)
+                if not ready:
+                    continue
+                data = os.read(self._master_fd, 256)
+            except (OSError, ValueError):
+                break
+            self.stats['bytes_received'] += len(data)
+            for byte in data:
+                if byte in (REALTIME_STATUS, REALTIME_HOLD, REALTIME_RESUME, REALTIME_RESET, REALTIME_JOG_CANCEL):
+                    self._realtime(byte)
+                    continue
+                with self._lock:
+                    if len(self._rx) >= RX_BUFFER_SIZE:
+                        self.stats['rx_overflow_bytes'] += 1
+                        continue
+                    self._rx.append(byte)
+                    self.stats['rx_peak'] = max(self.stats['rx_peak'], len(self._rx))
+                    self._lock.notify_all()
+
+    def _realtime(self, byte):
+        self.stats['realtime_commands'] += 1
+        if byte == REALTIME_STATUS:
+            self._write_line(self.status_report())
+            self.stats['status_reports'] += 1
+            return
+        with self._lock:
+            if byte == REALTIME_HOLD and self._current is not None and not self._hold:
+                block, started, spent = self._current
+                self._current = (block, None, spent + time.monotonic() - started)
+                self._hold = True
+            elif byte == REALTIME_RESUME and self._hold:
+                block, _, spent = self._current if self._current else (None, None, 0.0)
+                if block is not None:
+                    self._current = (block, time.monotonic(), spent)
+                self._hold = False
+            elif byte == REALTIME_JOG_CANCEL:
+                if self._current is not None and self._current[0].jog:
+                    self._position = self._current_position()
+                    self._current = None
+                self._planner = collections.deque(block for block in self._planner if not block.jog)
+            elif byte == REALTIME_RESET:
+                if self._current is not None:
+                    self._position = self._current_position()
+                self._current = None
+                self._planner.clear()
+                self._rx.clear()
+                self._hold = False
+            self._lock.notify_all()
+        if byte == REALTIME_RESET:
+            self._write_line(BANNER)
+
+    # -- protocol ----------------------------------------------------------
+
+    def _protocol_loop(self):
+        """Pull lines out of the RX buffer, parse them and reply"""
+        line = bytearray()
+        while self._running:
+            with self._lock:
+                while self._running and not self._rx:
+                    self._lock.wait(0.1)
+                if not self._running:
+                    return
+                byte = self._rx.popleft()
+            if byte not in (0x0A, 0x0D):
+                line.append(byte)
+                continue
+            text = line.decode('ascii', errors='ignore').strip().upper().replace(' ', '')
+            line.clear()
+            time.sleep(self.line_parse_time)
+            self._execute(text)
+
+    def _execute(self, text):
+        self.stats['lines'] += 1
+        if not text:
+            self._write_line('ok')
+            return
+        if text == '$$':
+            for key in sorted(self.settings):
+                self._write_line(f'${key}={self.settings[key]:g}' if isinstance(self.settings[key], float)
+                                 else f'${key}={self.settings[key]}')
+            self._write_line('ok')
+            return
+        if text == '$#':
+            for name in ('G54', 'G55', 'G56', 'G57', 'G58', 'G59', 'G28', 'G30', 'G92'):
+                self._write_line(f'[{name}:0.000,0.000,0.000]')
+            self._write_line('[TLO:0.000]')
+            self._write_line('[PRB:0.000,0.000,0.000:0]')
+            self._write_line('ok')
+            return
+        if text == '$G':
+            self._write_line(f"[GC:G0 G54 G17 G21 {'G91' if self._relative else 'G90'} G94 M5 M9 T0 F{self._feed:g} S0]")
+            self._write_line('ok')
+            return
+        if text == '$I':
+            self._write_line('[VER:1.1h.20190825:]')
+            self._write_line('[OPT:V,15,128]')
+            self._write_line('ok')
+            return
+        if text == '$X':
+            self._alarm = False
+            self._write_line('[MSG:Caution: Unlocked]')
+            self._write_line('ok')
+            return
+        if text == '$H':
+            self._home()
+            self._write_line('ok')
+            return
+        match = re.fullmatch(r'\$(\d+)=(-?\d*\.?\d+)', text)
+        if match:
+            key, value = int(match.group(1)), float(match.group(2))
+            self.settings[key] = int(value) if value.is_integer() and key < 100 else value
+            self._write_line('ok')
+            return
+        if text.startswith('$J='):
+            self._plan_motion(text[3:], jog=True)
+            return
+        if text.startswith('$'):
+            self._write_line('error:3')
+            return
+        self._plan_motion(text, jog=False)
+
+    def _plan_motion(self, text, jog):
+        if self._alarm:
+            self._write_line('error:9')
+            return
+        words = _WORD_PATTERN.findall(text)
+        relative = self._relative
+        axes = {}
+        motion = jog
+        for letter, value in words:
+            number = float(value)
+            if letter == 'G':
+                if number == 90:
+                    relative = False
+                elif number == 91:
+                    relative = True
+                elif number in (0, 1):
+                    motion = True
+                elif number == 92:
+                    # Work offset only; machine position is unchanged
+                    self._write_line('ok')
+                    return
+            elif letter == 'F':
+                self._feed = number
+            elif letter in 'XYZ':
+                axes[letter] = number
+        if not jog:
+            self._relative = relative
+
+        if not motion or not axes:
+            self._write_line('ok')
+            return
+
+        with self._lock:
+            start = self._planned_end()
+            target = list(start)
+            for index, letter in enumerate('XYZ'):
+                if letter in axes:
+                    target[index] = start[index] + axes[letter] if relative else axes[letter]
+            block = self._make_block(start, tuple(target), jog)
+            # GRBL only answers once the block fits in the planner
+            while self._running and len(self._planner) >= PLANNER_BLOCKS:
+                self.stats['planner_full_waits'] += 1
+                self._lock.wait(0.05)
+            self._planner.append(block)
+            self._lock.notify_all()
+        self._write_line('ok')
+
+    def _make_block(self, start, target, jog):
+        deltas = [abs(t - s) for s, t in zip(start, target)]
+        distance = math.dist(start, target)
+        feed = self._feed / 60.0
+        accel = 1e9
+        if distance > 0:
+            # Limit speed and acceleration so no axis exceeds its own maximum
+            for index, delta in enumerate(deltas):
+                if delta > 0:
+                    share = delta / distance
+                    feed = min(feed, self.settings[110 + index] / 60.0 / share)
+                    accel = min(accel, self.settings[120 + index] / share)
+        return _Block(start, target, max(feed, 1e-3), accel, jog)
+
+    def _planned_end(self):
+        if self._planner:
+            return self._planner[-1].target
+        if self._current is not None:
+            return self._current[0].target
+        return self._position
+
+    def _home(self):
+        with self._lock:
+            while self._running and (self._planner or self._current):
+                self._lock.wait(0.05)
+        time.sleep(0.2)  # Seek and pull-off
+        with self._lock:
+            self._position = (0.0, 0.0, 0.0)
+
+    # -- motion ------------------------------------------------------------
+
+    def _motion_loop(self):
+        while self._running:
+            with self._lock:
+                if self._current is None and self._planner and not self._hold:
+                    self._current = (self._planner.popleft(), time.monotonic(), 0.0)
+                    self._lock.notify_all()
+                if self._current is not None and not self._hold:
+                    block, started, spent = self._current
+                    if spent + time.monotonic() - started >= block.duration:
+                        self._position = block.target
+                        self._current = None
+                        self.stats['blocks_completed'] += 1
+                        self._lock.notify_all()
+                        continue
+                self._lock.wait(0.002)
+
+    def _current_position(self):
+        if self._current is None:
+            return self._position
+        block, started, spent = self._current
+        elapsed = spent if started is None else spent + time.monotonic() - started
+        return block.position_at(elapsed)
+
+    def status_report(self):
+        """
+        Returns:
+            str: GRBL 1.1 status report for the current state
+        """
+        with self._lock:
+            position = self._current_position()
+            if self._alarm:
+                state = 'Alarm'
+            elif self._hold:
+                state = 'Hold:0'
+            elif self._current is not None or self._planner:
+                block = self._current[0] if self._current else self._planner[0]
+                state = 'Jog' if block.jog else 'Run'
+            else:
+                state = 'Idle'
+            planner_free = PLANNER_BLOCKS - len(self._planner)
+            rx_free = RX_BUFFER_SIZE - len(self._rx)
+            feed = self._current[0].feed * 60.0 if self._current else 0
+        x, y, z = position
+        return f"<{state}|MPos:{x:.3f},{y:.3f},{z:.3f}|Bf:{planner_free},{rx_free}|FS:{feed:.0f},0>"
+
+
+if __name__ == "__main__":
+    # Run a simulator until interrupted, e.g. to connect the GUI to it
+    with GrblSimulator() as simulator:
+        print(f"GRBL simulator listening on {simulator.port} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            print(dict(simulator.stats))
@@ -0,0 +1,148 @@
+"""
+Moonraker Stand-in Module for theSmallComparator benchmarks
+Local HTTP server answering the Moonraker endpoints KlipperManager uses, with configurable latency
+"""
+
+import json
+import logging
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.benchmark')
+
+
+_AXIS_PATTERN = re.compile(r'([XYZF])(-?\d*\.?\d+)')
+
+
+class MoonrakerStub:
+    """
+    Class serving /printer/info, /printer/gcode/script and
+    /printer/objects/query (toolhead, configfile) on a local port.
+
+    G1/G0 moves update the toolhead position immediately; every request
+    waits `latency` seconds first to model Moonraker's round trip.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.002):
+        """
+        Args:
+            host (str): Interface to bind
+            port (int): Port to bind (0 picks a free one)
+            latency (float): Delay added to every request in seconds
+        """
+        self.latency = latency
+        self.position = [0.0, 0.0, 0.0, 0.0]
+        self.relative = False
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="moonraker-stub", daemon=True)
+        self._thread.start()
+        logger.info(f"Moonraker stand-in on http://{self.host}:{self.port}")
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def run_gcode(self, script):
+        """Apply the moves of a G-code script to the toolhead position"""
+        with self._lock:
+            for line in script.upper().splitlines():
+                line = line.replace(' ', '')
+                if 'G91' in line:
+                    self.relative = True
+                if 'G90' in line:
+                    self.relative = False
+                if re.match(r'^G0*[01](?!\d)', line):
+                    for letter, value in _AXIS_PATTERN.findall(line):
+                        if letter == 'F':
+                            continue
+                        index = 'XYZ'.index(letter)
+                        value = float(value)
+                        self.position[index] = self.position[index] + value if self.relative else value
+
+    def _toolhead(self):
+        with self._lock:
+            return {'position': list(self.position), 'status': 'Ready', 'homed_axes': 'xyz'}
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, payload, status=200):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                time.sleep(stub.latency)
+                stub.requests += 1
+                url = urlparse(self.path)
+                if url.path == '/printer/info':
+                    self._reply({'result': {'state': 'ready', 'hostname': 'benchmark',
+                                            'software_version': 'v0.12.0-stub'}})
+                elif url.path == '/printer/objects/query':
+                    objects = parse_qs(url.query, keep_blank_values=True)
+                    status = {}
+                    if 'toolhead' in objects:
+                        status['toolhead'] = stub._toolhead()
+                    if 'configfile' in objects:
+                        status['configfile'] = {'settings': {
+                            f'stepper_{axis}': {'rotation_distance': 40.0} for axis in 'xyz'}}
+                    self._reply({'result': {'eventtime': time.monotonic(), 'status': status}})
+                else:
+                    self._reply({'error': {'code': 404, 'message': 'Not Found'}}, status=404)
+
+            def do_POST(self):
+                time.sleep(stub.latency)
+                stub.requests += 1
+                length = int(self.headers.get('Content-Length') or 0)
+                data = json.loads(self.rfile.read(length) or b'{}')
+                if urlparse(self.path).path == '/printer/gcode/script':
+                    stub.run_gcode(data.get('script', ''))
+                    self._reply({'result': 'ok'})
+                else:
+                    self._reply({'error': {'code': 404, 'message': 'Not Found'}}, status=404)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    # Serve until interrupted, e.g. to run the GUI in Klipper mode without a printer
+    with MoonrakerStub(port=7125) as stub:
+        print(f"Moonraker stand-in on http://{stub.host}:{stub.port} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
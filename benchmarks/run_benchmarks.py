@@ -0,0 +1,407 @@
+"""
+Benchmark Runner for theSmallComparator
+Runs scripted scenarios against simulated GRBL, Moonraker and camera backends and writes the results as JSON
+
+Usage: python benchmarks/run_benchmarks.py [--scenarios a,b] [--output FILE] [--quick]
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+from grbl_simulator import GrblSimulator
+from moonraker_stub import MoonrakerStub
+
+# Set up logging
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.benchmark')
+
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+
+
+def summarize(samples):
+    """
+    Latency statistics in milliseconds
+
+    Args:
+        samples (list): Durations in seconds
+
+    Returns:
+        dict: count, mean, p50, p95, p99 and max
+    """
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] * 1000.0
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000.0, 3),
+        'p50_ms': round(percentile(0.50), 3),
+        'p95_ms': round(percentile(0.95), 3),
+        'p99_ms': round(percentile(0.99), 3),
+        'max_ms': round(ordered[-1] * 1000.0, 3),
+    }
+
+
+def _connect_grbl(simulator):
+    from serial_comm import SerialCommunicator
+    comm = SerialCommunicator()
+    if not comm.connect_to_com(simulator.port):
+        raise RuntimeError(f"Could not connect to the simulator on {simulator.port}")
+    return comm
+
+
+def scenario_jog_latency(quick=False):
+    """Time from sending a jog to its 'ok', including planner back-pressure"""
+    from machine_control import MachineController
+    count = 30 if quick else 150
+    with GrblSimulator() as simulator:
+        comm = _connect_grbl(simulator)
+        controller = MachineController(comm)
+        controller.set_feed_rate('faster')
+        controller.set_jog_distance(0.5)
+        samples = []
+        for index in range(count):
+            jog = controller.jog_x_positive if index % 2 == 0 else controller.jog_x_negative
+            start = time.perf_counter()
+            jog()
+            samples.append(time.perf_counter() - start)
+        comm.disconnect()
+        return {'latency': summarize(samples), 'simulator': dict(simulator.stats)}
+
+
+def scenario_status_throughput(quick=False):
+    """Status polls per second with 1 and 4 concurrent pollers (e.g. browsers)"""
+    duration = 1.0 if quick else 3.0
+    results = {}
+    with GrblSimulator() as simulator:
+        comm = _connect_grbl(simulator)
+        for pollers in (1, 4):
+            samples = []
+            samples_lock = threading.Lock()
+            deadline = time.perf_counter() + duration
+
+            def poll():
+                local = []
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    if comm.get_machine_status():
+                        local.append(time.perf_counter() - start)
+                with samples_lock:
+                    samples.extend(local)
+
+            threads = [threading.Thread(target=poll) for _ in range(pollers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            results[f'pollers_{pollers}'] = {'polls_per_second': round(len(samples) / duration, 1),
+                                              'latency': summarize(samples)}
+        comm.disconnect()
+    return results
+
+
+def scenario_klipper_status(quick=False):
+    """Moonraker status query latency through KlipperManager"""
+    from klipper_manager import KlipperManager
+    count = 100 if quick else 500
+    with MoonrakerStub() as stub:
+        klipper = KlipperManager(host=stub.host, port=stub.port)
+        if not klipper.connect():
+            raise RuntimeError("Could not connect to the Moonraker stand-in")
+        samples = []
+        for index in range(count):
+            if index % 10 == 0:
+                klipper.send_command("G91\nG1 X0.1 F3000\nG90")
+            start = time.perf_counter()
+            klipper.get_machine_status()
+            samples.append(time.perf_counter() - start)
+        return {'latency': summarize(samples), 'stub_latency_ms': stub.latency * 1000.0}
+
+
+def scenario_mjpeg_fanout(quick=False, pipeline=False):
+    """Frames per second delivered to 1, 2 and 4 concurrent /video_feed clients"""
+    import gui_flask
+    import metrics
+    from wsgi_server import PooledWSGIServer
+
+    duration = 2.0 if quick else 5.0
+    client_counts = (1, 2, 4)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # Keep the benchmark's session away from the real database
+        gui_flask.SESSION_DB_PATH = os.path.join(temp_dir, 'sessions.db')
+        gui = gui_flask.TheSmallComparatorFlaskGUI(pipeline=pipeline)
+        gui.open_camera('test:1280x720@30')
+        server = PooledWSGIServer('127.0.0.1', 0, gui.app, stream_threads=max(client_counts))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_port
+
+        results = {}
+        try:
+            for clients in client_counts:
+                counts = [0] * clients
+                sizes = [0] * clients
+                deadline = time.perf_counter() + duration
+
+                def watch(index):
+                    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+                    connection.request('GET', '/video_feed')
+                    response = connection.getresponse()
+                    tail = b''
+                    while time.perf_counter() < deadline:
+                        chunk = response.read1(65536)
+                        if not chunk:
+                            break
+                        sizes[index] += len(chunk)
+                        counts[index] += (tail + chunk).count(b'--frame\r\n')
+                        tail = chunk[-10:]
+                    connection.close()
+
+                encode = metrics.FRAME_ENCODE_SECONDS.labels()
+                encode_before = encode.snapshot()
+                threads = [threading.Thread(target=watch, args=(index,)) for index in range(clients)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                encode_after = encode.snapshot()
+                # Let the server notice the closed connections before the next round needs their stream slots
+                settle = time.perf_counter() + 5.0
+                while metrics.STREAM_CLIENTS.labels().value > 0 and time.perf_counter() < settle:
+                    time.sleep(0.05)
+                encoded = encode_after[0][-1] - encode_before[0][-1]
+                if not encoded and any(counts):
+                    raise RuntimeError("Frames were streamed but comparator_frame_encode_seconds was not observed")
+                results[f'clients_{clients}'] = {
+                    'fps_per_client': [round(count / duration, 1) for count in counts],
+                    'megabits_per_second': round(sum(sizes) * 8 / duration / 1e6, 2),
+                    'mean_encode_ms': round((encode_after[1] - encode_before[1]) / encoded * 1000.0, 3)
+                                      if encoded else None,
+                }
+        finally:
+            gui.shutdown()
+            server.shutdown()
+            server.server_close()
+        results['capture_fps'] = round(metrics.CAPTURE_FPS.labels().value, 1)
+        return results
+
+
+def scenario_mjpeg_fanout_pipeline(quick=False):
+    """The MJPEG fan-out with capture and encoding in the frame pipeline's processes"""
+    return scenario_mjpeg_fanout(quick=quick, pipeline=True)
+
+
+def scenario_fly_scan(quick=False):
+    """Images per second from a fly scan versus stop-settle-shoot over the same rows"""
+    import gui_flask
+    from fly_scan import FlyScan
+
+    length = 10.0 if quick else 30.0
+    rows = 2 if quick else 4
+    spacing = 0.5  # Stop-and-shoot image spacing along a row, in mm
+    with tempfile.TemporaryDirectory() as temp_dir, GrblSimulator() as simulator:
+        gui_flask.SESSION_DB_PATH = os.path.join(temp_dir, 'sessions.db')
+        gui = gui_flask.TheSmallComparatorFlaskGUI()
+        try:
+            gui.controller.comm = _connect_grbl(simulator)
+            controller = gui.controller
+            gui.open_camera('test:640x480@30')
+            results = {}
+
+            scan = FlyScan(controller, gui.frames, 0.0, 0.0, length, rows - 1.0, 1.0, feed=600.0)
+            status = scan.run()
+            results['fly'] = {'images': status['frames'], 'seconds': round(status['duration'], 3),
+                              'images_per_second': round(status['frames'] / status['duration'], 2)}
+
+            start = time.perf_counter()
+            images = 0
+            for row in range(rows):
+                for step in range(int(length / spacing) + 1):
+                    x = step * spacing if row % 2 == 0 else length - step * spacing
+                    controller.move_to(x=x, y=float(row), feed=controller.feed_rates['faster'])
+                    controller.wait_for_idle(x=x, y=float(row), interval=0.02)
+                    view = gui.frames.wait_newer(gui.frames.seq, timeout=2.0)
+                    if view is not None:
+                        view.release()
+                        images += 1
+            elapsed = time.perf_counter() - start
+            results['stop_and_shoot'] = {'images': images, 'seconds': round(elapsed, 3),
+                                         'images_per_second': round(images / elapsed, 2)}
+            results['speedup'] = round(results['fly']['images_per_second'] /
+                                       results['stop_and_shoot']['images_per_second'], 2)
+            return results
+        finally:
+            gui.shutdown()
+
+
+def scenario_path_plan(quick=False):
+    """Measured travel time over random waypoints, in listed order and as planned"""
+    import random
+    from machine_control import MachineController
+    from path_planner import plan_path, path_time
+
+    count = 15 if quick else 40
+    rng = random.Random(7)
+    points = [(round(rng.uniform(0, 60), 3), round(rng.uniform(0, 40), 3)) for _ in range(count)]
+    with GrblSimulator() as simulator:
+        controller = MachineController(_connect_grbl(simulator))
+        model = controller.get_motion_model()
+        feed = controller.feed_rates['faster']
+        start = time.perf_counter()
+        order = plan_path(points, model, start=(0.0, 0.0), feed=feed)
+        results = {'waypoints': count, 'planning_s': round(time.perf_counter() - start, 4)}
+        for name, sequence in (('listed', list(range(count))), ('planned', order)):
+            controller.move_to(x=0.0, y=0.0, feed=feed)
+            controller.wait_for_idle(x=0.0, y=0.0, timeout=60.0, interval=0.02)
+            reports = simulator.stats['status_reports']
+            start = time.perf_counter()
+            for index in sequence:
+                x, y = points[index]
+                controller.move_to(x=x, y=y, feed=feed)
+                controller.wait_for_idle(x=x, y=y, timeout=60.0, interval=0.02)
+            results[name] = {'seconds': round(time.perf_counter() - start, 3),
+                             'estimated_s': round(path_time(points, sequence, model, (0.0, 0.0), feed), 3),
+                             'status_reports': simulator.stats['status_reports'] - reports}
+        results['speedup'] = round(results['listed']['seconds'] / results['planned']['seconds'], 2)
+        return results
+
+
+def scenario_camera_scan(quick=False):
+    """Full camera scan duration on this machine (probes real /dev/video* devices)"""
+    from camera_manager import CameraManager
+    runs = 1 if quick else 3
+    samples = []
+    cameras = []
+    for _ in range(runs):
+        manager = CameraManager()
+        start = time.perf_counter()
+        cameras = manager.force_full_scan()
+        samples.append(time.perf_counter() - start)
+    return {'duration': summarize(samples), 'cameras_found': cameras}
+
+
+def scenario_dxf_export(quick=False):
+    """Recording and exporting a large point set (DXF and the streaming exporters)"""
+    from dxf_handler import DXFHandler
+    from exporters import PointExporter, EXPORT_FORMATS
+    count = 2000 if quick else 20000
+    points = [{'x': i * 0.01, 'y': (i % 100) * 0.02} for i in range(count)]
+    results = {'points': count}
+
+    handler = DXFHandler()
+    start = time.perf_counter()
+    for point in points:
+        handler.add_point(point['x'], point['y'])
+    results['dxf_add_points_s'] = round(time.perf_counter() - start, 4)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        start = time.perf_counter()
+        handler.export_dxf(os.path.join(temp_dir, 'benchmark.dxf'))
+        results['dxf_export_s'] = round(time.perf_counter() - start, 4)
+
+    exporter = PointExporter(points, metadata={'source': 'benchmark'})
+    for export_format in EXPORT_FORMATS:
+        start = time.perf_counter()
+        size = sum(len(chunk) for chunk in exporter.stream(export_format))
+        results[f'{export_format}_export_s'] = round(time.perf_counter() - start, 4)
+        results[f'{export_format}_bytes'] = size
+    return results
+
+
+SCENARIOS = {
+    'jog_latency': scenario_jog_latency,
+    'status_throughput': scenario_status_throughput,
+    'klipper_status': scenario_klipper_status,
+    'mjpeg_fanout': scenario_mjpeg_fanout,
+    'mjpeg_fanout_pipeline': scenario_mjpeg_fanout_pipeline,
+    'fly_scan': scenario_fly_scan,
+    'path_plan': scenario_path_plan,
+    'camera_scan': scenario_camera_scan,
+    'dxf_export': scenario_dxf_export,
+}
+
+
+def _git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True, timeout=5)
+        return result.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(scenarios, quick=False):
+    """
+    Run scenarios in order
+
+    Args:
+        scenarios (list): Scenario names from SCENARIOS
+        quick (bool): Shorter runs for a smoke check
+
+    Returns:
+        dict: Environment description and per-scenario results
+    """
+    report = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'host': platform.node(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'python': platform.python_version(),
+        'quick': quick,
+        'scenarios': {},
+    }
+    for name in scenarios:
+        print(f"Running {name}...")
+        start = time.perf_counter()
+        try:
+            result = SCENARIOS[name](quick=quick)
+            result['wall_time_s'] = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            logger.error(f"Scenario {name} failed: {e}")
+            result = {'error': str(e)}
+        report['scenarios'][name] = result
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="theSmallComparator benchmark suite")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma-separated scenarios (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('--output', help="JSON results file (default: benchmarks/results/<timestamp>.json)")
+    parser.add_argument('--quick', action='store_true', help="Shorter runs")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    report = run(names, quick=args.quick)
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report['scenarios'], indent=2))
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Camera Calibration Module for theSmallComparator
+Handles the mapping between camera pixels and stage millimetres, measured by moving the stage and tracking the image shift
+"""
+
+import json
+import logging
+import os
+
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.camera')
+
+
+class PixelMapping:
+    """
+    Linear map from a pixel offset relative to the frame centre (the
+    reticle) to the stage offset that brings that pixel under the reticle.
+    The 2x2 matrix absorbs scale, camera rotation and mirroring, so the
+    stage position of any pixel is the current position plus
+    matrix @ (px - cx, py - cy).
+    """
+
+    def __init__(self, matrix, frame_size):
+        """
+        Args:
+            matrix (sequence): 2x2 matrix in mm per pixel
+            frame_size (tuple): (width, height) of the frames it was measured on
+        """
+        self.matrix = np.asarray(matrix, dtype=np.float64).reshape(2, 2)
+        self.frame_size = (int(frame_size[0]), int(frame_size[1]))
+
+    @property
+    def mm_per_pixel(self):
+        """Mean scale in mm per pixel"""
+        return float(np.sqrt(abs(np.linalg.det(self.matrix))))
+
+    def to_stage(self, pixels, stage_x, stage_y):
+        """
+        Args:
+            pixels (array): (N, 2) pixel coordinates (x, y)
+            stage_x (float): Stage X the frame was taken at
+            stage_y (float): Stage Y the frame was taken at
+
+        Returns:
+            numpy.ndarray: (N, 2) stage coordinates
+        """
+        width, height = self.frame_size
+        offsets = np.asarray(pixels, dtype=np.float64).reshape(-1, 2) - ((width - 1) / 2.0, (height - 1) / 2.0)
+        return offsets @ self.matrix.T + (stage_x, stage_y)
+
+    def to_stage_vector(self, vector):
+        """Stage direction of a pixel-space direction (no translation)"""
+        return self.matrix @ np.asarray(vector, dtype=np.float64)
+
+    def to_pixel_vector(self, vector):
+        """Pixel-space direction of a stage direction"""
+        return np.linalg.solve(self.matrix, np.asarray(vector, dtype=np.float64))
+
+    def to_dict(self):
+        return {'matrix': self.matrix.tolist(), 'frame_size': list(self.frame_size),
+                'mm_per_pixel': self.mm_per_pixel}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['matrix'], data['frame_size'])
+
+
+def save_mapping(mapping, path):
+    """Write a mapping to a JSON file"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(mapping.to_dict(), f, indent=2)
+
+
+def load_mapping(path):
+    """
+    Returns:
+        PixelMapping: The saved mapping, or None if there is none
+    """
+    try:
+        with open(path) as f:
+            return PixelMapping.from_dict(json.load(f))
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError) as e:
+        logger.error(f"Ignoring unreadable camera calibration {path}: {e}")
+        return None
+
+
+def _grab_gray(frames, after_seq):
+    import cv2 as cv
+    view = frames.wait_newer(after_seq, timeout=2.0)
+    if view is None:
+        raise RuntimeError("No camera frame during calibration")
+    with view:
+        gray = cv.cvtColor(view.array, cv.COLOR_BGR2GRAY).astype(np.float32)
+        return gray, view.seq
+
+
+def calibrate(controller, frames, distance=0.5):
+    """
+    Measure the pixel mapping: move X then Y by `distance` and find how far
+    the image shifted (phase correlation), then return to the start.
+    Needs a textured, flat target under the camera.
+
+    Args:
+        controller (MachineController): Machine to move
+        frames (FrameRing): Ring the capture thread publishes frames to
+        distance (float): Test move in mm; the image must shift by less than half a frame
+
+    Returns:
+        PixelMapping: The measured mapping
+
+    Raises:
+        RuntimeError: If the machine or camera does not respond or the shift cannot be measured
+    """
+    import cv2 as cv
+    start = controller.wait_for_idle()
+    if start is None:
+        raise RuntimeError("Machine is not idle")
+    reference, seq = _grab_gray(frames, frames.seq)
+    window = cv.createHanningWindow(reference.shape[::-1], cv.CV_32F)
+    shifts = []
+    try:
+        for axis in ('x', 'y'):
+            target = dict(x=start['x'], y=start['y'])
+            target[axis] += distance
+            controller.move_to(**target)
+            if controller.wait_for_idle(**target) is None:
+                raise RuntimeError(f"Machine did not reach the {axis.upper()} test position")
+            moved, seq = _grab_gray(frames, frames.seq)
+            (dx, dy), response = cv.phaseCorrelate(reference, moved, window)
+            if response < 0.1:
+                raise RuntimeError(f"Could not track the image during the {axis.upper()} move "
+                                   f"(correlation {response:.2f}); use a textured target")
+            shifts.append((dx / distance, dy / distance))
+    finally:
+        controller.move_to(x=start['x'], y=start['y'])
+        controller.wait_for_idle(x=start['x'], y=start['y'])
+    # Columns: pixel shift per mm of stage X and Y. A feature p pixels from the centre is
+    # brought under the reticle by the stage move that shifts the image by -p.
+    shift_per_mm = np.array(shifts).T
+    if abs(np.linalg.det(shift_per_mm)) < 1e-9:
+        raise RuntimeError("The X and Y moves shifted the image in the same direction")
+    height, width = reference.shape
+    mapping = PixelMapping(-np.linalg.inv(shift_per_mm), (width, height))
+    logger.info(f"Camera calibration: {mapping.mm_per_pixel * 1000:.2f} um/pixel")
+    return mapping
+
+
+if __name__ == "__main__":
+    # A camera rotated 90 degrees and mirrored at 10 um/pixel
+    mapping = PixelMapping([[0.0, 0.01], [0.01, 0.0]], (640, 480))
+    print(f"{mapping.mm_per_pixel * 1000:.1f} um/pixel")
+    print(mapping.to_stage([(319.5, 239.5), (419.5, 239.5)], 10.0, 20.0))
@@ -25,9 +25,12 @@ import glob
 import subprocess
 import re
 import time
+from metrics import CAMERA_SCAN_SECONDS
+from camera_sources import V4L2Source, create_source, open_source
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.camera')
 
 class CameraManager:
     def __init__(self):
@@ -37,7 +40,7 @@ class CameraManager:
 
     def initialize_cache(self):
         """Run an initial full scan to populate cache"""
-        logging.info("Initializing camera cache...")
+        logger.info("Initializing camera cache...")
         self.force_full_scan()
 
     def get_cached_cameras(self):
@@ -61,15 +64,17 @@ class CameraManager:
         Smart scan: Only probe devices that are NEW since the last scan.
         Returns the updated list of working cameras.
         """
-        logging.info("Scanning for NEW cameras only...")
+        logger.info("Scanning for NEW cameras only...")
+        started = time.perf_counter()
         current_devices = self.get_all_video_devices()
         new_candidates = [d for d in current_devices if d not in self._all_video_devices]
         
         if not new_candidates:
-            logging.info("No new video devices detected.")
+            logger.info("No new video devices detected.")
+            CAMERA_SCAN_SECONDS.labels('new').observe(time.perf_counter() - started)
             return self._cached_cameras
 
-        logging.info(f"New video devices detected: {new_candidates}")
+        logger.info(f"New video devices detected: {new_candidates}")
         
         # Probe only the new candidates
         working_new_cameras = self._probe_candidates(new_candidates)
@@ -79,18 +84,20 @@ class CameraManager:
             # Add to cache, avoiding duplicates and keeping sorted
             updated_cache = sorted(list(set(self._cached_cameras + working_new_cameras)))
             self._cached_cameras = updated_cache
-            logging.info(f"Added {len(working_new_cameras)} new working cameras. Total: {len(self._cached_cameras)}")
+            logger.info(f"Added {len(working_new_cameras)} new working cameras. Total: {len(self._cached_cameras)}")
         
         # Update known devices list
         self._all_video_devices = sorted(list(set(self._all_video_devices + current_devices)))
         
+        CAMERA_SCAN_SECONDS.labels('new').observe(time.perf_counter() - started)
         return self._cached_cameras
 
     def force_full_scan(self, max_cameras=20):
         """
         Clear cache and perform a full robust scan of all potential devices.
         """
-        logging.info("Forcing FULL camera scan...")
+        logger.info("Forcing FULL camera scan...")
+        started = time.perf_counter()
         
         # 1. Discovery (Hybrid: v4l2-ctl + glob)
         candidates = []
@@ -103,9 +110,9 @@ class CameraManager:
                 output = result.stdout
                 paths = re.findall(r'/dev/video(\d+)', output)
                 v4l2_devices = sorted(list(set([int(p) for p in paths])))
-                logging.info(f"v4l2-ctl found: {v4l2_devices}")
+                logger.info(f"v4l2-ctl found: {v4l2_devices}")
         except Exception as e:
-            logging.warning(f"v4l2-ctl scan failed: {e}")
+            logger.warning(f"v4l2-ctl scan failed: {e}")
 
         if v4l2_devices:
             candidates = v4l2_devices
@@ -135,12 +142,13 @@ class CameraManager:
         self._all_video_devices = candidates # approximate
         self._last_scan_time = time.time()
         
+        CAMERA_SCAN_SECONDS.labels('full').observe(time.perf_counter() - started)
         return self._cached_cameras
 
     def _probe_candidates(self, candidates):
         """Internal method to probe a list of candidate indices"""
         working_cameras = []
-        logging.info(f"Probing candidates: {candidates}")
+        logger.info(f"Probing candidates: {candidates}")
         
         for i in candidates:
             # Capability Check (Optimization)
@@ -174,9 +182,7 @@ class CameraManager:
             # OpenCV Open Test
             try:
                 # fast open with V4L2
-                cap = cv.VideoCapture(i, cv.CAP_V4L2)
-                if not cap.isOpened():
-                    cap = cv.VideoCapture(i) # Fallback
+                cap = V4L2Source(i)
                 
                 if cap.isOpened():
                     cap.set(cv.CAP_PROP_BUFFERSIZE, 1)
@@ -185,10 +191,10 @@ class CameraManager:
                     if ret and frame is not None and frame.size > 0:
                          if i not in working_cameras:
                              working_cameras.append(i)
-                             logging.info(f"Confirmed working camera: video{i}")
+                             logger.info(f"Confirmed working camera: video{i}")
                     cap.release()
             except Exception as e:
-                logging.debug(f"Failed to probe video{i}: {e}")
+                logger.debug(f"Failed to probe video{i}: {e}")
                 
         return sorted(working_cameras)
 
@@ -225,17 +231,14 @@ def refresh_camera_detection(max_cameras=20, mode='full'):
         return manager.force_full_scan(max_cameras)
 
 def test_camera_connection(camera_index):
-    """Test specific camera (stateless)"""
+    """Test specific camera or camera source spec (stateless)"""
     try:
-        cap = cv.VideoCapture(camera_index, cv.CAP_V4L2)
-        if not cap.isOpened():
-             cap = cv.VideoCapture(camera_index)
-        
-        if cap.isOpened():
-            cap.set(cv.CAP_PROP_BUFFERSIZE, 1)
+        source = create_source(camera_index)
+        if source.isOpened():
+            source.set(cv.CAP_PROP_BUFFERSIZE, 1)
             time.sleep(0.1)
-            ret, frame = cap.read()
-            cap.release()
+            ret, frame = source.read()
+            source.release()
             if ret and frame is not None and frame.size > 0:
                 return True, f"Camera {camera_index} OK"
             return False, "No frames"
@@ -244,20 +247,16 @@ def test_camera_connection(camera_index):
         return False, str(e)
 
 def initialize_camera(camera_index):
-    """Initialize camera object (stateless)"""
-    try:
-        cap = cv.VideoCapture(camera_index, cv.CAP_V4L2)
-        if not cap.isOpened():
-            cap = cv.VideoCapture(camera_index)
-        
-        if cap.isOpened():
-            ret, _ = cap.read()
-            if ret:
-                return cap
-            cap.release()
-    except:
-        pass
-    return None
+    """
+    Initialize camera object (stateless)
+
+    Args:
+        camera_index (int or str): Camera index or source spec ("test", "replay:/path/video.mp4")
+
+    Returns:
+        CameraSource: Opened source, or None
+    """
+    return open_source(camera_index)
 
 if __name__ == "__main__":
     print("Testing CameraManager...")
@@ -0,0 +1,378 @@
+"""
+Camera Sources Module for theSmallComparator
+Handles frame sources behind one interface: V4L2 cameras, replay of recorded video or image sequences, and a generated test pattern
+"""
+
+import glob
+import logging
+import os
+import time
+
+import cv2 as cv
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.camera')
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+class CameraSource:
+    """
+    Frame source with the subset of the cv2.VideoCapture interface the
+    application uses: isOpened(), read(image=None), get(), set(), release().
+
+    read() blocks until the next frame like a real camera, and fills
+    `image` in place when it is given with the right shape so callers can
+    reuse one buffer.
+    """
+
+    kind = 'base'
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.frames = 0
+
+    def isOpened(self):
+        return False
+
+    def read(self, image=None):
+        return False, None
+
+    def get(self, prop_id):
+        return 0.0
+
+    def set(self, prop_id, value):
+        return False
+
+    def release(self):
+        pass
+
+    def describe(self):
+        """
+        Returns:
+            dict: Source kind, spec, frame size and rate for status reports
+        """
+        return {
+            'kind': self.kind,
+            'spec': self.spec,
+            'width': int(self.get(cv.CAP_PROP_FRAME_WIDTH)),
+            'height': int(self.get(cv.CAP_PROP_FRAME_HEIGHT)),
+            'fps': self.get(cv.CAP_PROP_FPS),
+            'frames': self.frames,
+        }
+
+
+class _Pacer:
+    """Sleeps so that successive frames are at most `fps` per second apart"""
+
+    def __init__(self, fps):
+        self.fps = fps
+        self._next_frame = time.perf_counter()
+
+    def wait(self):
+        if not self.fps:
+            return
+        now = time.perf_counter()
+        if now < self._next_frame:
+            time.sleep(self._next_frame - now)
+        self._next_frame = max(now, self._next_frame) + 1.0 / self.fps
+
+
+def _into(image, frame):
+    """Copy frame into the caller's buffer when the shapes match"""
+    if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+        np.copyto(image, frame)
+        return image
+    return frame
+
+
+class V4L2Source(CameraSource):
+    """Physical camera opened through OpenCV, V4L2 backend first"""
+
+    kind = 'v4l2'
+
+    def __init__(self, device):
+        """
+        Args:
+            device (int or str): Camera index or /dev/videoN path
+        """
+        super().__init__(f"v4l2:{device}")
+        self.device = device
+        self._capture = cv.VideoCapture(device, cv.CAP_V4L2)
+        if not self._capture.isOpened():
+            self._capture = cv.VideoCapture(device)  # Fallback
+
+    def isOpened(self):
+        return self._capture.isOpened()
+
+    def read(self, image=None):
+        ret, frame = self._capture.read() if image is None else self._capture.read(image)
+        if ret:
+            self.frames += 1
+        return ret, frame
+
+    def get(self, prop_id):
+        return self._capture.get(prop_id)
+
+    def set(self, prop_id, value):
+        return self._capture.set(prop_id, value)
+
+    def release(self):
+        self._capture.release()
+
+
+class ReplaySource(CameraSource):
+    """
+    Recorded footage played back at its original rate: a video file, a
+    directory of images or a glob pattern. Loops by default so a short
+    recording can drive the pipeline indefinitely.
+    """
+
+    kind = 'replay'
+
+    def __init__(self, path, fps=None, loop=True):
+        """
+        Args:
+            path (str): Video file, image directory or glob pattern ("frames/*.png")
+            fps (float): Playback rate; defaults to the file's rate (15 for images)
+            loop (bool): Restart at the end instead of reporting failed reads
+        """
+        super().__init__(f"replay:{path}")
+        self.path = path
+        self.loop = loop
+        self._capture = None
+        self._images = []
+        self._position = 0
+        self._shape = None
+
+        if os.path.isdir(path):
+            self._images = sorted(p for p in glob.glob(os.path.join(path, '*'))
+                                  if p.lower().endswith(IMAGE_EXTENSIONS))
+        elif glob.has_magic(path):
+            self._images = sorted(glob.glob(path))
+        else:
+            self._capture = cv.VideoCapture(path)
+
+        if self._images:
+            first = cv.imread(self._images[0])
+            self._shape = first.shape if first is not None else None
+            native_fps = 15.0
+        elif self._capture is not None and self._capture.isOpened():
+            native_fps = self._capture.get(cv.CAP_PROP_FPS) or 30.0
+        else:
+            native_fps = 0.0
+        self.fps = fps if fps is not None else native_fps
+        self._pacer = _Pacer(self.fps)
+
+    def isOpened(self):
+        if self._images:
+            return self._shape is not None
+        return self._capture is not None and self._capture.isOpened()
+
+    def _read_video(self, image):
+        ret, frame = self._capture.read() if image is None else self._capture.read(image)
+        if not ret and self.loop and self.frames:
+            self._capture.set(cv.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self._capture.read() if image is None else self._capture.read(image)
+        return ret, frame
+
+    def _read_image(self, image):
+        if self._position >= len(self._images):
+            if not self.loop:
+                return False, None
+            self._position = 0
+        frame = cv.imread(self._images[self._position])
+        self._position += 1
+        if frame is None:
+            return False, None
+        return True, _into(image, frame)
+
+    def read(self, image=None):
+        if not self.isOpened():
+            return False, None
+        self._pacer.wait()
+        ret, frame = self._read_image(image) if self._images else self._read_video(image)
+        if ret:
+            self.frames += 1
+        return ret, frame
+
+    def get(self, prop_id):
+        if prop_id == cv.CAP_PROP_FPS:
+            return float(self.fps)
+        if self._images:
+            if self._shape is None:
+                return 0.0
+            return {cv.CAP_PROP_FRAME_WIDTH: float(self._shape[1]), cv.CAP_PROP_FRAME_HEIGHT: float(self._shape[0]),
+                    cv.CAP_PROP_FRAME_COUNT: float(len(self._images)),
+                    cv.CAP_PROP_POS_FRAMES: float(self._position)}.get(prop_id, 0.0)
+        return self._capture.get(prop_id) if self._capture is not None else 0.0
+
+    def set(self, prop_id, value):
+        if prop_id == cv.CAP_PROP_POS_FRAMES:
+            if self._images:
+                self._position = int(value) % len(self._images)
+                return True
+            if self._capture is not None:
+                return self._capture.set(prop_id, value)
+        return False
+
+    def release(self):
+        if self._capture is not None:
+            self._capture.release()
+        self._images = []
+        self._shape = None
+
+
+class TestPatternSource(CameraSource):
+    """
+    Generated frames: a textured background (so JPEG sizes are realistic)
+    with a dark part edge moving across the field of view and a frame
+    counter. Needs no hardware and no recorded footage.
+    """
+
+    kind = 'test'
+
+    def __init__(self, width=1280, height=720, fps=30.0):
+        """
+        Args:
+            width (int): Frame width in pixels
+            height (int): Frame height in pixels
+            fps (float): Frame rate (0 returns frames as fast as possible)
+        """
+        super().__init__(f"test:{width}x{height}@{fps:g}")
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self._opened = True
+        self._pacer = _Pacer(fps)
+        rng = np.random.default_rng(0)
+        noise = rng.integers(0, 40, size=(height, width, 1), dtype=np.uint8)
+        gradient = np.linspace(60, 180, width, dtype=np.uint8)[np.newaxis, :, np.newaxis]
+        self._background = np.clip(noise + gradient, 0, 255).astype(np.uint8).repeat(3, axis=2)
+
+    def isOpened(self):
+        return self._opened
+
+    def read(self, image=None):
+        if not self._opened:
+            return False, None
+        self._pacer.wait()
+        image = _into(image, self._background)
+        if image is self._background:
+            image = self._background.copy()
+        # Dark part moving across the field of view, like a part edge under the microscope
+        edge = (self.frames * 8) % self.width
+        image[:, :edge] //= 3
+        cv.putText(image, f"{self.frames:06d}", (20, 60), cv.FONT_HERSHEY_SIMPLEX, 2, (0, 255, 0), 3)
+        self.frames += 1
+        return True, image
+
+    def get(self, prop_id):
+        return {cv.CAP_PROP_FRAME_WIDTH: float(self.width), cv.CAP_PROP_FRAME_HEIGHT: float(self.height),
+                cv.CAP_PROP_FPS: float(self.fps)}.get(prop_id, 0.0)
+
+    def release(self):
+        self._opened = False
+
+
+def _parse_test_spec(options):
+    """Parse "1280x720@30" (both parts optional) into TestPatternSource arguments"""
+    kwargs = {}
+    size, _, fps = options.partition('@')
+    if size:
+        width, _, height = size.lower().partition('x')
+        kwargs['width'], kwargs['height'] = int(width), int(height)
+    if fps:
+        kwargs['fps'] = float(fps)
+    return kwargs
+
+
+def create_source(spec):
+    """
+    Create a camera source from a spec
+
+    Specs:
+        0, "0", "v4l2:0", "/dev/video0"    physical camera
+        "replay:PATH" or an existing path  video file, image directory or glob
+        "test", "test:1280x720@30"         generated test pattern
+
+    Args:
+        spec (int or str): Source spec
+
+    Returns:
+        CameraSource: The source (check isOpened())
+
+    Raises:
+        ValueError: If the spec is not recognised
+    """
+    if isinstance(spec, int):
+        return V4L2Source(spec)
+    spec = str(spec).strip()
+    kind, _, options = spec.partition(':')
+    if spec.isdigit():
+        return V4L2Source(int(spec))
+    if kind == 'v4l2':
+        return V4L2Source(int(options) if options.isdigit() else options)
+    if spec.startswith('/dev/video'):
+        return V4L2Source(spec)
+    if kind == 'test':
+        return TestPatternSource(**_parse_test_spec(options))
+    if kind == 'replay':
+        return ReplaySource(options)
+    if os.path.exists(spec) or glob.has_magic(spec):
+        return ReplaySource(spec)
+    raise ValueError(f"Unknown camera source: {spec}")
+
+
+def open_source(spec):
+    """
+    Create a source and confirm it delivers a frame
+
+    Args:
+        spec (int or str): Source spec, see create_source()
+
+    Returns:
+        CameraSource: The opened source, or None if it could not be opened
+    """
+    try:
+        source = create_source(spec)
+    except (ValueError, cv.error) as e:
+        logger.error(f"Could not create camera source {spec}: {e}")
+        return None
+    if source.isOpened():
+        ret, _ = source.read()
+        if ret:
+            logger.info(f"Opened camera source {source.spec}")
+            return source
+    source.release()
+    logger.warning(f"Camera source {spec} delivered no frame")
+    return None
+
+
+def source_index(source):
+    """
+    The value reported as the camera index: the device number for physical
+    cameras, the spec for virtual ones
+    """
+    if isinstance(source, V4L2Source) and isinstance(source.device, int):
+        return source.device
+    return getattr(source, 'spec', None)
+
+
+if __name__ == "__main__":
+    # Open each kind of virtual source and measure its frame rate
+    import tempfile
+    with tempfile.TemporaryDirectory() as directory:
+        pattern = TestPatternSource(320, 240, fps=0)
+        for i in range(5):
+            cv.imwrite(os.path.join(directory, f"frame{i:03d}.png"), pattern.read()[1])
+        for spec in ("test:640x480@30", f"replay:{directory}", directory + "/*.png"):
+            source = open_source(spec)
+            start = time.perf_counter()
+            for _ in range(10):
+                source.read()
+            print(f"{source.describe()} -> {10 / (time.perf_counter() - start):.1f} fps")
+            source.release()
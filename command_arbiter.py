@@ -0,0 +1,190 @@
+"""
+Command Arbiter Module for theSmallComparator
+Serializes all access to the machine connection through a single worker thread
+"""
+
+import itertools
+import logging
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+from metrics import ARBITER_QUEUE_SECONDS
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.serial')
+
+
+# Lower value runs first
+PRIORITY_REALTIME = 0   # GRBL realtime bytes: status report, feed hold, cycle start, jog cancel, reset
+PRIORITY_STATUS = 1     # Status/settings queries ($$, $#, $G, $I...)
+PRIORITY_GCODE = 2      # Motion and every other G-code line
+
+# GRBL realtime commands that produce no response and may be injected at any time
+FIRE_AND_FORGET_COMMANDS = {
+    b'!',       # Feed hold
+    b'~',       # Cycle start / resume
+    b'\x18',    # Soft reset (Ctrl+X)
+    b'\x85',    # Jog cancel
+}
+
+STATUS_QUERY_COMMANDS = {'$', '$$', '$#', '$G', '$I', '$N', '$C'}
+
+# G0-G3: the motion commands whose round-trip time depends on the move
+_MOTION_PATTERN = re.compile(r'^G0*[0-3](?!\d)')
+
+
+def normalize_command(command):
+    """
+    Get the bare command without line terminators
+
+    Args:
+        command (str or bytes): Command as passed to send_command
+
+    Returns:
+        bytes: Command bytes without surrounding whitespace
+    """
+    if isinstance(command, str):
+        command = command.encode()
+    return command.strip(b' \r\n')
+
+
+def classify_command(command):
+    """
+    Get the arbiter priority of a command
+
+    Args:
+        command (str or bytes): Command as passed to send_command
+
+    Returns:
+        int: One of the PRIORITY_* constants
+    """
+    bare = normalize_command(command)
+    if bare == b'?' or bare in FIRE_AND_FORGET_COMMANDS:
+        return PRIORITY_REALTIME
+    if bare.decode('ascii', errors='ignore').upper() in STATUS_QUERY_COMMANDS:
+        return PRIORITY_STATUS
+    return PRIORITY_GCODE
+
+
+def command_type(command):
+    """
+    Get a short command category, used as a metrics label
+
+    Args:
+        command (str or bytes): Command as passed to send_command
+
+    Returns:
+        str: 'status_report', 'realtime', 'query', 'jog', 'system', 'motion' or 'gcode'
+    """
+    bare = normalize_command(command)
+    if bare == b'?':
+        return 'status_report'
+    if bare in FIRE_AND_FORGET_COMMANDS:
+        return 'realtime'
+    text = bare.decode('ascii', errors='ignore').upper()
+    if text in STATUS_QUERY_COMMANDS:
+        return 'query'
+    if text.startswith('$J='):
+        return 'jog'
+    if text.startswith('$'):
+        return 'system'
+    if _MOTION_PATTERN.match(text):
+        return 'motion'
+    return 'gcode'
+
+
+class CommandArbiter:
+    """
+    Class to run connection work on one worker thread, in priority order.
+
+    Callers submit a callable and get their own Future for its result, so two
+    requests can never interleave their writes or read each other's responses.
+    Jobs with the same priority run in submission order.
+    """
+
+    def __init__(self, name="CommandArbiter"):
+        self.name = name
+        self._queue = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._queue_wait = ARBITER_QUEUE_SECONDS.labels(name)
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker_loop, name=self.name, daemon=True)
+                self._thread.start()
+
+    def in_worker(self):
+        """Check if the calling thread is the arbiter worker"""
+        return threading.current_thread() is self._thread
+
+    @property
+    def pending(self):
+        """Number of jobs waiting to run"""
+        return self._queue.qsize()
+
+    def submit(self, func, *args, priority=PRIORITY_GCODE, **kwargs):
+        """
+        Queue a callable to run on the worker thread
+
+        Args:
+            func (callable): Work to run with exclusive access to the connection
+            priority (int): One of the PRIORITY_* constants
+
+        Returns:
+            Future: Resolved with the callable's return value or exception
+        """
+        future = Future()
+        self._ensure_started()
+        self._queue.put((priority, next(self._counter), time.perf_counter(), future, func, args, kwargs))
+        return future
+
+    def call(self, func, *args, priority=PRIORITY_GCODE, timeout=None, **kwargs):
+        """
+        Run a callable on the worker thread and wait for its result.
+        Calls made from the worker itself run inline instead of deadlocking.
+
+        Args:
+            func (callable): Work to run with exclusive access to the connection
+            priority (int): One of the PRIORITY_* constants
+            timeout (float): Maximum time to wait in seconds (None waits forever)
+
+        Returns:
+            The callable's return value
+        """
+        if self.in_worker():
+            return func(*args, **kwargs)
+        return self.submit(func, *args, priority=priority, **kwargs).result(timeout=timeout)
+
+    def _worker_loop(self):
+        while True:
+            _, _, queued_at, future, func, args, kwargs = self._queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            self._queue_wait.observe(time.perf_counter() - queued_at)
+            try:
+                future.set_result(func(*args, **kwargs))
+            except BaseException as e:
+                logger.error(f"{self.name} job {getattr(func, '__name__', func)} failed: {e}")
+                future.set_exception(e)
+
+
+if __name__ == "__main__":
+    # Test the CommandArbiter priority ordering
+    arbiter = CommandArbiter()
+    order = []
+    arbiter.submit(time.sleep, 0.2)  # Keep the worker busy while the others queue up
+    futures = [
+        arbiter.submit(order.append, "G1X10", priority=classify_command("G1X10")),
+        arbiter.submit(order.append, "$$", priority=classify_command("$$")),
+        arbiter.submit(order.append, "?", priority=classify_command("?")),
+    ]
+    for future in futures:
+        future.result()
+    print(f"Execution order: {order}")
@@ -3,8 +3,8 @@ DXF Handling Module for theSmallComparator
 Handles creation and export of DXF files
 """
 
-import ezdxf
 import logging
+from startup_profiler import profile_phase
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -17,15 +17,39 @@ class DXFHandler:
     
     def __init__(self, dxf_version="R2010"):
         """
-        Initialize DXF handler with a new drawing
+        Initialize DXF handler. The drawing itself is created on first use,
+        so importing ezdxf and building the document don't slow down startup.
         
         Args:
             dxf_version (str): DXF version to use
         """
-        self.doc = ezdxf.new(dxfversion=dxf_version)
-        self.doc.layers.new(name="COMPARATRON_OUTPUT", dxfattribs={"color": 2})
-        self.msp = self.doc.modelspace()
+        self.dxf_version = dxf_version
+        self._doc = None
+        self._msp = None
         self.points = []
+        self.polylines = []
+
+    def _create_document(self):
+        """Create the ezdxf drawing and output layer"""
+        with profile_phase('dxf_new_document'):
+            import ezdxf
+            self._doc = ezdxf.new(dxfversion=self.dxf_version)
+            self._doc.layers.new(name="COMPARATRON_OUTPUT", dxfattribs={"color": 2})
+            self._msp = self._doc.modelspace()
+
+    @property
+    def doc(self):
+        """The ezdxf drawing, created on first access"""
+        if self._doc is None:
+            self._create_document()
+        return self._doc
+
+    @property
+    def msp(self):
+        """Modelspace of the drawing, created on first access"""
+        if self._msp is None:
+            self._create_document()
+        return self._msp
     
     def add_point(self, x, y, layer="COMPARATRON_OUTPUT"):
         """
@@ -57,6 +81,30 @@ class DXFHandler:
                 success_count += 1
         return success_count
     
+    def add_polyline(self, points, closed=False, layer="COMPARATRON_OUTPUT"):
+        """
+        Add a polyline (e.g. a traced contour) to the DXF drawing
+
+        Args:
+            points (list): List of (x, y) tuples
+            closed (bool): Join the last vertex back to the first
+            layer (str): Layer name for the polyline
+
+        Returns:
+            bool: True if the polyline was added
+        """
+        if len(points) < 2:
+            print(f"Error adding polyline: {len(points)} vertices, at least 2 needed")
+            return False
+        try:
+            vertices = [(float(x), float(y)) for x, y in points]
+            polyline = self.msp.add_lwpolyline(vertices, close=closed, dxfattribs={"color": 7, "layer": layer})
+            self.polylines.append({"points": vertices, "closed": closed, "entity": polyline})
+            return True
+        except Exception as e:
+            print(f"Error adding polyline with {len(points)} vertices: {e}")
+            return False
+
     def get_point_count(self):
         """
         Get the number of points in the drawing
@@ -81,7 +129,7 @@ class DXFHandler:
         """
         # In ezdxf, we can't easily remove entities after they're added,
         # so we create a new document instead
-        self.__init__(dxf_version=self.doc.dxfversion)
+        self.__init__(dxf_version=self.dxf_version)
     
     def export_dxf(self, filename):
         """
@@ -0,0 +1,262 @@
+"""
+Edge Tracer Module for theSmallComparator
+Handles automatic contour capture: finds the part edge in the camera frame, records it in stage coordinates and steps the stage along it until the contour closes
+"""
+
+import logging
+import threading
+import time
+
+import cv2 as cv
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.tracer')
+
+# Contours shorter than this (in pixels) are dust or noise, not the part edge
+MIN_CONTOUR_PIXELS = 20
+# Sub-pixel search distance along the edge normal, in pixels
+NORMAL_SEARCH = np.arange(-3.0, 3.01, 0.25, dtype=np.float32)
+
+
+def find_edges(frame, min_contrast=8.0, blur=1.5, return_normals=False):
+    """
+    Part edges in a frame with sub-pixel accuracy
+
+    The frame is split into part and background with Otsu's threshold; each
+    boundary pixel is then moved along the intensity gradient to where the
+    smoothed intensity is halfway between the part and background levels
+    (all points at once with cv.remap).
+
+    Args:
+        frame (numpy.ndarray): BGR or grayscale frame
+        min_contrast (float): Weakest gradient (grey levels per pixel) accepted as an edge
+        blur (float): Gaussian smoothing before detection, in pixels
+        return_normals (bool): Also return the unit edge normals (pointing from dark to light)
+
+    Returns:
+        list: One (N, 2) float array of (x, y) edge points per contour, longest first,
+            or (points, normals) pairs with return_normals
+    """
+    gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    smooth = cv.GaussianBlur(gray, (0, 0), blur)
+    cut, binary = cv.threshold(smooth, 0, 255, cv.THRESH_BINARY + cv.THRESH_OTSU)
+    contours, _ = cv.findContours(binary, cv.RETR_LIST, cv.CHAIN_APPROX_NONE)
+    # Otsu's cut can sit anywhere in the gap between the two levels; the edge is where the
+    # intensity is halfway between them
+    light = binary > 0
+    threshold = cut if light.all() or not light.any() else \
+        (float(smooth[light].mean()) + float(smooth[~light].mean())) / 2.0
+    smooth = smooth.astype(np.float32)
+    gx = cv.Sobel(smooth, cv.CV_32F, 1, 0, ksize=3) / 8.0
+    gy = cv.Sobel(smooth, cv.CV_32F, 0, 1, ksize=3) / 8.0
+    height, width = gray.shape
+    edges = []
+    for contour in contours:
+        points = contour.reshape(-1, 2)
+        # The frame border closes contours of parts that leave the field; it is not an edge
+        inside = ((points[:, 0] > 3) & (points[:, 0] < width - 4) &
+                  (points[:, 1] > 3) & (points[:, 1] < height - 4))
+        points = points[inside]
+        if len(points) < MIN_CONTOUR_PIXELS:
+            continue
+        grad = np.stack([gx[points[:, 1], points[:, 0]], gy[points[:, 1], points[:, 0]]], axis=1)
+        magnitude = np.hypot(grad[:, 0], grad[:, 1])
+        strong = magnitude >= min_contrast
+        points, grad, magnitude = points[strong], grad[strong], magnitude[strong]
+        if len(points) < MIN_CONTOUR_PIXELS:
+            continue
+        normals = grad / magnitude[:, np.newaxis]
+        # Intensity profiles along the normal (dark to light) around every point
+        map_x = (points[:, 0:1] + NORMAL_SEARCH * normals[:, 0:1]).astype(np.float32)
+        map_y = (points[:, 1:2] + NORMAL_SEARCH * normals[:, 1:2]).astype(np.float32)
+        profiles = cv.remap(smooth, map_x, map_y, cv.INTER_LINEAR)
+        above = profiles >= threshold
+        crossing = np.argmax(above, axis=1)
+        valid = (crossing > 0) & above[np.arange(len(points)), crossing]
+        if valid.sum() < MIN_CONTOUR_PIXELS:
+            continue
+        rows = np.nonzero(valid)[0]
+        index = crossing[rows]
+        low, high = profiles[rows, index - 1], profiles[rows, index]
+        fraction = (threshold - low) / np.maximum(high - low, 1e-6)
+        offset = NORMAL_SEARCH[index - 1] + fraction * (NORMAL_SEARCH[1] - NORMAL_SEARCH[0])
+        edges.append((points[rows] + offset[:, np.newaxis] * normals[rows], normals[rows]))
+    edges.sort(key=lambda edge: len(edge[0]), reverse=True)
+    return edges if return_normals else [points for points, _ in edges]
+
+
+def _tangent(points, direction=None):
+    """Unit direction of a run of edge points (principal axis), oriented like `direction`"""
+    centred = points - points.mean(axis=0)
+    _, _, axes = np.linalg.svd(centred, full_matrices=False)
+    tangent = axes[0]
+    if direction is not None and np.dot(tangent, direction) < 0:
+        tangent = -tangent
+    return tangent
+
+
+class ContourTracer:
+    """
+    Closed-loop contour capture. Each step takes a frame with the stage at
+    rest, keeps the edge points near the reticle (converted to stage
+    coordinates with the camera calibration), and moves to the edge point a
+    step ahead along the contour, with the part on the right-hand side.
+    Tracing ends when the reticle comes back to where it started.
+    """
+
+    def __init__(self, controller, frames, mapping, step=None, spacing=0.02, feed=None, max_steps=2000):
+        """
+        Args:
+            controller (MachineController): Machine to move
+            frames (FrameRing): Ring the capture thread publishes frames to
+            mapping (PixelMapping): Camera calibration for the ring's frames
+            step (float): Distance moved along the edge per frame in mm, defaults to a third of the field
+            spacing (float): Minimum distance between recorded points in mm
+            feed (float): Feed rate in mm/min, defaults to the controller's
+            max_steps (int): Give up after this many frames
+        """
+        self.controller = controller
+        self.frames = frames
+        self.mapping = mapping
+        field = min(mapping.frame_size) * mapping.mm_per_pixel
+        self.step = float(step) if step else field / 3.0
+        self.spacing = float(spacing)
+        self.feed = feed
+        self.max_steps = max_steps
+        self.points = []
+        self.steps = 0
+        self.closed = False
+        self.running = False
+        self.error = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Ask a running trace to end after the current step"""
+        self._stop.set()
+
+    def status(self):
+        """
+        Returns:
+            dict: Progress, and the points once the trace has ended
+        """
+        status = {'running': self.running, 'steps': self.steps, 'point_count': len(self.points),
+                  'closed': self.closed, 'error': self.error, 'duration': round(self.duration, 3)}
+        if not self.running:
+            status['points'] = [{'x': round(x, 4), 'y': round(y, 4)} for x, y in self.points]
+        return status
+
+    def _edge_near_centre(self, position):
+        """
+        Edge of the contour closest to the reticle in the next frame
+
+        Returns:
+            tuple: (N, 2) stage coordinates of its points and their unit normals in stage
+                axes (dark to light), or (None, None) if the frame shows no edge
+        """
+        view = self.frames.wait_newer(self.frames.seq, timeout=2.0)
+        if view is None:
+            raise RuntimeError("No camera frame while tracing")
+        with view:
+            contours = find_edges(view.array, return_normals=True)
+        if not contours:
+            return None, None
+        width, height = self.mapping.frame_size
+        centre = ((width - 1) / 2.0, (height - 1) / 2.0)
+        points, normals = min(contours, key=lambda edge: np.min(np.hypot(*(edge[0] - centre).T)))
+        normals = normals @ self.mapping.matrix.T
+        normals /= np.maximum(np.hypot(*normals.T), 1e-12)[:, np.newaxis]
+        return self.mapping.to_stage(points, position['x'], position['y']), normals
+
+    def _record(self, edge, centre, direction, radius):
+        """Append the edge points within `radius` of the reticle, in travel order and `spacing` apart"""
+        relative = edge - centre
+        near = edge[np.hypot(*relative.T) <= radius]
+        if not len(near):
+            return
+        for point in near[np.argsort((near - centre) @ direction)]:
+            if not self.points or np.hypot(*(point - self.points[-1])) >= self.spacing:
+                self.points.append((float(point[0]), float(point[1])))
+
+    def trace(self):
+        """
+        Trace the contour under the reticle (the crosshair must be on the edge)
+
+        Returns:
+            dict: Final status with the recorded points
+        """
+        self.running = True
+        started = time.monotonic()
+        try:
+            self._trace()
+        except (RuntimeError, ValueError) as e:
+            self.error = str(e)
+            logger.error(f"Contour trace failed: {e}")
+        finally:
+            self.duration = time.monotonic() - started
+            self.running = False
+        logger.info(f"Contour trace: {len(self.points)} points in {self.steps} steps, "
+                    f"{'closed' if self.closed else 'open'}, {self.duration:.1f}s")
+        return self.status()
+
+    def _trace(self):
+        position = self.controller.wait_for_idle()
+        if position is None:
+            raise RuntimeError("Machine is not idle")
+        direction = start = None
+        travelled = 0.0
+        while self.steps < self.max_steps and not self._stop.is_set():
+            edge, normals = self._edge_near_centre(position)
+            if edge is None:
+                raise RuntimeError("Lost the edge" if self.steps else "No edge under the camera")
+            self.steps += 1
+            centre = np.array([position['x'], position['y']])
+            distances = np.hypot(*(edge - centre).T)
+            local = edge[distances <= self.step / 2]
+            if direction is None:
+                if len(local) < 3:
+                    raise RuntimeError("No edge under the reticle")
+                direction = _tangent(local)
+                nearest = np.argmin(distances)
+                start = edge[nearest]
+                # Travel with the part (the dark side, against the normal) on the right
+                right = np.array([direction[1], -direction[0]])
+                if np.dot(right, normals[nearest]) > 0:
+                    direction = -direction
+            elif len(local) >= 3:
+                direction = _tangent(local, direction)
+            self._record(edge, centre, direction, self.step * 0.6)
+
+            if travelled > 2 * self.step and np.hypot(*(centre - start)) < self.step * 0.75:
+                self.closed = True
+                while len(self.points) > 2 and np.hypot(*(np.array(self.points[-1]) - start)) < self.spacing:
+                    self.points.pop()
+                return
+
+            # Next stop: the edge point about one step ahead
+            relative = edge - centre
+            ahead = (relative @ direction) > 0.3 * distances
+            if not ahead.any():
+                raise RuntimeError("Lost the edge")
+            candidates = edge[ahead]
+            target = candidates[np.argmin(np.abs(distances[ahead] - self.step))]
+            direction = (target - centre) / np.hypot(*(target - centre))
+            self.controller.move_to(x=float(target[0]), y=float(target[1]), feed=self.feed)
+            position = self.controller.wait_for_idle(x=float(target[0]), y=float(target[1]))
+            if position is None:
+                raise RuntimeError("Machine did not reach the next edge position")
+            travelled += float(np.hypot(*(target - centre)))
+
+
+if __name__ == "__main__":
+    # Find the edge of a synthetic dark disc and check the sub-pixel radius
+    frame = np.full((480, 640), 200, dtype=np.uint8)
+    scale = 8
+    large = np.full((480 * scale, 640 * scale), 200, dtype=np.uint8)
+    cv.circle(large, (320 * scale, 240 * scale), int(150.3 * scale), 40, -1)
+    frame = cv.resize(large, (640, 480), interpolation=cv.INTER_AREA)
+    edges = find_edges(frame)
+    radii = np.hypot(*(edges[0] - (319.5, 239.5)).T)
+    print(f"{len(edges)} contour(s), {len(edges[0])} points, radius {radii.mean():.2f} +/- {radii.std():.2f} px (150.3)")
@@ -0,0 +1,257 @@
+"""
+Export Module for theSmallComparator
+Streams recorded points, fit results and scan metadata as CSV, JSON Lines, SVG and NumPy archives
+"""
+
+import csv
+import io
+import json
+import logging
+import math
+import zipfile
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.export')
+
+
+# Supported formats: name -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'jsonl': ('application/x-ndjson', 'jsonl'),
+    'svg': ('image/svg+xml', 'svg'),
+    'npz': ('application/octet-stream', 'npz'),
+}
+
+
+class _ChunkSink:
+    """
+    Write-only file object that collects written bytes until they are drained.
+    It has no tell()/seek(), so zipfile writes the archive in streaming mode.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class PointExporter:
+    """
+    Class to serialize measurement data chunk by chunk, so a download can be
+    streamed to the client without building the whole file in memory
+    """
+
+    def __init__(self, points, metadata=None, fits=None, chunk_size=500):
+        """
+        Initialize the exporter
+
+        Args:
+            points (list): Sequence of point dictionaries (at least 'x' and 'y')
+            metadata (dict): Scan metadata (machine mode, bounds, timestamps...)
+            fits (list): Optional list of fit result dictionaries
+            chunk_size (int): Number of points serialized per yielded chunk
+        """
+        self.points = points
+        self.metadata = metadata or {}
+        self.fits = fits or []
+        self.chunk_size = max(1, int(chunk_size))
+
+    def get_columns(self):
+        """
+        Get the point columns to export, 'x' and 'y' first, then any extra keys
+        found on the first point (e.g. 'z', 'timestamp')
+
+        Returns:
+            list: Column names
+        """
+        columns = ['x', 'y']
+        if self.points:
+            columns += [key for key in self.points[0] if key not in columns]
+        return columns
+
+    def get_bounds(self):
+        """
+        Get the bounding box of the exported points
+
+        Returns:
+            dict: Dictionary with min_x, min_y, max_x, max_y values
+        """
+        if not self.points:
+            return {"min_x": 0, "min_y": 0, "max_x": 0, "max_y": 0}
+
+        x_coords = [p['x'] for p in self.points]
+        y_coords = [p['y'] for p in self.points]
+        return {
+            "min_x": min(x_coords),
+            "min_y": min(y_coords),
+            "max_x": max(x_coords),
+            "max_y": max(y_coords)
+        }
+
+    def _iter_batches(self):
+        """Yield (start_index, batch) slices of the point list"""
+        for start in range(0, len(self.points), self.chunk_size):
+            yield start, self.points[start:start + self.chunk_size]
+
+    def iter_csv(self):
+        """
+        Stream points as CSV, one row per point with a leading index column
+
+        Yields:
+            bytes: Encoded CSV chunks
+        """
+        columns = self.get_columns()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(['index'] + columns)
+
+        for start, batch in self._iter_batches():
+            for offset, point in enumerate(batch):
+                writer.writerow([start + offset] + [point.get(column, '') for column in columns])
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+
+        if buffer.tell():
+            yield buffer.getvalue().encode('utf-8')
+
+    def iter_jsonl(self):
+        """
+        Stream a metadata record, the fit records and one record per point as JSON Lines
+
+        Yields:
+            bytes: Encoded JSONL chunks
+        """
+        header = [json.dumps({'type': 'metadata', **self.metadata})]
+        header += [json.dumps({'type': 'fit', **fit}) for fit in self.fits]
+        yield ('\n'.join(header) + '\n').encode('utf-8')
+
+        for start, batch in self._iter_batches():
+            lines = [json.dumps({'type': 'point', 'index': start + offset, **point})
+                     for offset, point in enumerate(batch)]
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+    def iter_svg(self, margin=5.0, point_radius=0.5):
+        """
+        Stream points as an SVG drawing in machine units (mm), Y axis pointing up
+
+        Args:
+            margin (float): Margin around the point bounds in mm
+            point_radius (float): Radius of the circle drawn for each point in mm
+
+        Yields:
+            bytes: Encoded SVG chunks
+        """
+        bounds = self.metadata.get('bounds') or self.get_bounds()
+        width = (bounds['max_x'] - bounds['min_x']) + 2 * margin
+        height = (bounds['max_y'] - bounds['min_y']) + 2 * margin
+        origin_x = bounds['min_x'] - margin
+        # SVG's Y axis points down, so the view box starts at the negated top edge
+        origin_y = -(bounds['max_y'] + margin)
+
+        description = json.dumps({'metadata': self.metadata, 'fits': self.fits})
+        yield (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{width:.3f}mm" height="{height:.3f}mm" '
+            f'viewBox="{origin_x:.3f} {origin_y:.3f} {width:.3f} {height:.3f}">\n'
+            f'<desc>{_xml_escape(description)}</desc>\n'
+            f'<g fill="red" stroke="none">\n'
+        ).encode('utf-8')
+
+        for start, batch in self._iter_batches():
+            circles = [
+                f'<circle id="p{start + offset}" cx="{p["x"]:.4f}" cy="{-p["y"]:.4f}" r="{point_radius}"/>'
+                for offset, p in enumerate(batch)
+            ]
+            yield ('\n'.join(circles) + '\n').encode('utf-8')
+
+        yield b'</g>\n</svg>\n'
+
+    def iter_npz(self):
+        """
+        Stream points as a compressed NumPy archive (same layout as numpy.savez_compressed).
+        Each column becomes a float64 array, metadata and fits are stored as a JSON string.
+
+        Yields:
+            bytes: Chunks of the zip archive
+        """
+        import numpy as np
+
+        count = len(self.points)
+        sink = _ChunkSink()
+        with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for column in self.get_columns():
+                with archive.open(f'{column}.npy', mode='w', force_zip64=True) as member:
+                    np.lib.format.write_array_header_1_0(member, {
+                        'descr': np.lib.format.dtype_to_descr(np.dtype('<f8')),
+                        'fortran_order': False,
+                        'shape': (count,),
+                    })
+                    for _, batch in self._iter_batches():
+                        values = [_to_float(point.get(column)) for point in batch]
+                        member.write(np.asarray(values, dtype='<f8').tobytes())
+                        data = sink.drain()
+                        if data:
+                            yield data
+
+            with archive.open('metadata.npy', mode='w') as member:
+                document = json.dumps({'metadata': self.metadata, 'fits': self.fits})
+                np.lib.format.write_array(member, np.array(document), allow_pickle=False)
+
+        yield sink.drain()
+
+    def stream(self, export_format):
+        """
+        Get the chunk generator for the requested format
+
+        Args:
+            export_format (str): One of EXPORT_FORMATS
+
+        Returns:
+            generator: Generator of bytes chunks
+        """
+        generators = {
+            'csv': self.iter_csv,
+            'jsonl': self.iter_jsonl,
+            'svg': self.iter_svg,
+            'npz': self.iter_npz,
+        }
+        if export_format not in generators:
+            raise ValueError(f"Unsupported export format: {export_format}")
+        logger.info(f"Streaming {len(self.points)} points as {export_format}")
+        return generators[export_format]()
+
+
+def _to_float(value):
+    """Convert a point value to float, missing or non-numeric values become NaN"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _xml_escape(text):
+    """Escape text for use inside an XML element"""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+if __name__ == "__main__":
+    # Test the PointExporter class
+    exporter = PointExporter(
+        [{'x': 0.0, 'y': 0.0}, {'x': 10.0, 'y': 10.0}, {'x': 20.0, 'y': 5.0}],
+        metadata={'source': 'test'}
+    )
+    for fmt in EXPORT_FORMATS:
+        size = sum(len(chunk) for chunk in exporter.stream(fmt))
+        print(f"{fmt}: {size} bytes")
@@ -0,0 +1,189 @@
+"""
+Fly Scan Module for theSmallComparator
+Handles image scanning on the fly: the stage moves at constant speed along each row while every captured frame is tagged with the stage position at its capture time
+"""
+
+import logging
+import threading
+import time
+
+import cv2 as cv
+
+from machine_control import StatusPoller
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.scan')
+
+# Most rows accepted for one scan
+MAX_SCAN_ROWS = 500
+
+
+def plan_feed(mm_per_pixel, field_width, fps, exposure=None, max_blur=1.0, overlap=0.2):
+    """
+    Fastest row feed rate that keeps frames overlapping and motion blur in budget
+
+    Args:
+        mm_per_pixel (float): Camera scale
+        field_width (float): Field of view along the row in mm
+        fps (float): Camera frame rate
+        exposure (float): Exposure time in seconds, if known
+        max_blur (float): Accepted blur in pixels during one exposure
+        overlap (float): Fraction of the field successive frames must share
+
+    Returns:
+        float: Feed rate in mm/min
+    """
+    speed = field_width * (1.0 - overlap) * fps
+    if exposure:
+        speed = min(speed, max_blur * mm_per_pixel / exposure)
+    return speed * 60.0
+
+
+class FlyScan:
+    """
+    Raster scan without stopping: each row is one constant-speed move
+    (serpentine order), frames are taken from the capture ring as they are
+    published and JPEG-encoded on the spot, and once the row ends each one
+    is given the stage position interpolated at its capture timestamp.
+    Only the row start is a stop-and-settle.
+    """
+
+    def __init__(self, controller, frames, x0, y0, x1, y1, row_pitch, feed, travel_feed=None,
+                 camera=None, exposure=None, on_frame=None):
+        """
+        Args:
+            controller (MachineController): Machine to move
+            frames (FrameRing): Ring the capture thread publishes frames to
+            x0, y0, x1, y1 (float): Opposite corners of the area (machine coordinates)
+            row_pitch (float): Distance between rows in mm
+            feed (float): Scan speed along the rows in mm/min
+            travel_feed (float): Feed rate between rows, defaults to the controller's fastest
+            camera: Active camera source, to shorten its exposure during the scan
+            exposure (float): Exposure to set for the scan (camera units, CAP_PROP_EXPOSURE)
+            on_frame (callable): Called as on_frame(jpeg_bytes, position) for every placed frame
+        """
+        if row_pitch <= 0 or feed <= 0:
+            raise ValueError("The row pitch and feed rate must be positive")
+        rows = int(abs(y1 - y0) / row_pitch + 1e-9) + 1
+        if rows > MAX_SCAN_ROWS:
+            raise ValueError(f"{rows} rows exceed the limit of {MAX_SCAN_ROWS}; use a larger row pitch")
+        step = row_pitch if y1 >= y0 else -row_pitch
+        self.rows = [y0 + index * step for index in range(rows)]
+        self.controller = controller
+        self.frames = frames
+        self.x0, self.x1 = x0, x1
+        self.feed = feed
+        self.travel_feed = travel_feed or controller.feed_rates['faster']
+        self.camera = camera
+        self.exposure = exposure
+        self.on_frame = on_frame
+        self.placed = []
+        self.dropped = 0
+        self.row = 0
+        self.running = False
+        self.error = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Ask a running scan to end after the current row"""
+        self._stop.set()
+
+    def status(self):
+        """
+        Returns:
+            dict: Progress, and the frame positions once the scan has ended
+        """
+        status = {'running': self.running, 'row': self.row, 'rows': len(self.rows),
+                  'frames': len(self.placed), 'dropped': self.dropped,
+                  'error': self.error, 'duration': round(self.duration, 3)}
+        if not self.running:
+            status['positions'] = self.placed
+        return status
+
+    def _set_exposure(self):
+        """Switch the camera to the scan exposure; returns the settings to restore"""
+        if self.exposure is None or not (hasattr(self.camera, 'get') and hasattr(self.camera, 'set')):
+            # No camera, or one without capture properties (e.g. a --pipeline camera)
+            return None
+        saved = (self.camera.get(cv.CAP_PROP_AUTO_EXPOSURE), self.camera.get(cv.CAP_PROP_EXPOSURE))
+        # V4L2 manual exposure mode is 1; other backends ignore the value
+        self.camera.set(cv.CAP_PROP_AUTO_EXPOSURE, 1)
+        if not self.camera.set(cv.CAP_PROP_EXPOSURE, self.exposure):
+            logger.warning("The camera does not accept an exposure setting; frames may blur")
+        return saved
+
+    def _restore_exposure(self, saved):
+        if saved is not None:
+            self.camera.set(cv.CAP_PROP_AUTO_EXPOSURE, saved[0])
+            self.camera.set(cv.CAP_PROP_EXPOSURE, saved[1])
+
+    def run(self):
+        """
+        Scan every row
+
+        Returns:
+            dict: Final status
+        """
+        self.running = True
+        started = time.monotonic()
+        saved = None
+        try:
+            saved = self._set_exposure()
+            for index, y in enumerate(self.rows):
+                if self._stop.is_set():
+                    break
+                self.row = index
+                start, end = (self.x0, self.x1) if index % 2 == 0 else (self.x1, self.x0)
+                self._scan_row(y, start, end)
+        except RuntimeError as e:
+            self.error = str(e)
+            logger.error(f"Fly scan failed: {e}")
+        finally:
+            self._restore_exposure(saved)
+            self.duration = time.monotonic() - started
+            self.running = False
+        logger.info(f"Fly scan: {len(self.placed)} frames in {self.row + 1} rows, {self.duration:.1f}s")
+        return self.status()
+
+    def _scan_row(self, y, start, end):
+        self.controller.move_to(x=start, y=y, feed=self.travel_feed)
+        if self.controller.wait_for_idle(x=start, y=y) is None:
+            raise RuntimeError(f"Machine did not reach the start of row {self.row + 1}")
+        captured = []
+        timeout = abs(end - start) / self.feed * 60.0 + 10.0
+        with StatusPoller(self.controller) as poller:
+            seq = self.frames.seq
+            self.controller.move_to(x=end, y=y, feed=self.feed)
+            moving_since = time.monotonic()
+            while not poller.at_rest(x=end, y=y):
+                if time.monotonic() - moving_since > timeout:
+                    raise RuntimeError(f"Machine did not finish row {self.row + 1}")
+                view = self.frames.wait_newer(seq, timeout=0.5)
+                if view is None:
+                    continue
+                with view:
+                    seq = view.seq
+                    if view.blank or view.timestamp < moving_since:
+                        continue
+                    ret, jpeg = cv.imencode('.jpg', view.array)
+                    if ret:
+                        captured.append((view.timestamp, jpeg))
+            # Place the frames once reports after the last one are in
+            if captured:
+                self.controller.position_history.wait_until(captured[-1][0], timeout=1.0)
+        for timestamp, jpeg in captured:
+            position = self.controller.position_at(timestamp)
+            if position is None:
+                self.dropped += 1
+                continue
+            if self.on_frame is not None:
+                self.on_frame(jpeg.tobytes(), position)
+            self.placed.append({key: round(position[key], 4) for key in ('x', 'y', 'z')})
+
+
+if __name__ == "__main__":
+    # Speeds for a 640 px wide field at 10 um/pixel and 15 fps
+    print(f"Overlap-limited: F{plan_feed(0.01, 6.4, 15):.0f}")
+    print(f"With a 2 ms exposure and 1 px blur: F{plan_feed(0.01, 6.4, 15, exposure=0.002):.0f}")
@@ -0,0 +1,528 @@
+"""
+Frame Pipeline Module for theSmallComparator
+Handles camera capture, JPEG encoding and vision analysis in separate processes sharing frames through shared memory
+"""
+
+import importlib
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.camera')
+
+
+# Header row per slot: version (odd while being written), byte count, timestamp (ns), tag, value
+HEADER_FIELDS = 5
+# Row 0: latest slot, latest sequence number, failed reads, unused, unused
+
+CAPTURE_FPS = 15
+FLAG_BLANK = 1
+
+
+class SharedSlots:
+    """
+    Fixed-size slots in one shared memory block, written by a single
+    process and read by any number of others.
+
+    Each slot carries a version counter (a seqlock): the writer makes it odd
+    while writing and even when done, and a reader that sees it change while
+    copying retries. The writer cycles through the slots, so a reader
+    copying the latest slot is only disturbed if it takes longer than
+    `slots - 1` frames.
+    """
+
+    def __init__(self, slots, slot_bytes, name=None):
+        """
+        Args:
+            slots (int): Number of slots
+            slot_bytes (int): Capacity of each slot
+            name (str): Attach to an existing block instead of creating one
+        """
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        header_bytes = (slots + 1) * HEADER_FIELDS * 8
+        self._owner = name is None
+        if self._owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=header_bytes + slots * slot_bytes)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self.name = self._shm.name
+        self.header = np.ndarray((slots + 1, HEADER_FIELDS), dtype=np.int64, buffer=self._shm.buf)
+        if self._owner:
+            self.header[:] = 0
+        self.data = [np.ndarray((slot_bytes,), dtype=np.uint8, buffer=self._shm.buf,
+                                offset=header_bytes + index * slot_bytes) for index in range(slots)]
+
+    @property
+    def seq(self):
+        """Sequence number of the latest committed slot (0 before the first)"""
+        return int(self.header[0, 1])
+
+    def begin(self):
+        """
+        Start writing the slot after the latest one
+
+        Returns:
+            int: Slot index; fill self.data[slot] then commit() or abort()
+        """
+        slot = (int(self.header[0, 0]) + 1) % self.slots
+        self.header[slot + 1, 0] += 1
+        return slot
+
+    def commit(self, slot, nbytes, tag=0, value=0, timestamp_ns=None):
+        """Finish writing a slot and publish it as the latest"""
+        row = self.header[slot + 1]
+        row[1] = nbytes
+        row[2] = time.monotonic_ns() if timestamp_ns is None else timestamp_ns
+        row[3] = tag
+        row[4] = value
+        row[0] += 1
+        self.header[0, 0] = slot
+        self.header[0, 1] += 1
+
+    def abort(self, slot):
+        """Finish writing a slot without publishing it"""
+        self.header[slot + 1, 0] += 1
+
+    def read_latest(self, out=None, retries=5):
+        """
+        Copy the latest slot
+
+        Args:
+            out (numpy.ndarray): Flat uint8 buffer to copy into; None returns bytes
+            retries (int): Attempts when the writer overwrites the slot mid-copy
+
+        Returns:
+            tuple: (seq, data, timestamp_ns, tag, value), or None if nothing consistent was read;
+                data is `out` (first nbytes filled) or a bytes object
+        """
+        header = self.header
+        for _ in range(retries):
+            slot = int(header[0, 0])
+            seq = int(header[0, 1])
+            if seq == 0:
+                return None
+            row = header[slot + 1]
+            version = int(row[0])
+            if version & 1:
+                time.sleep(0)
+                continue
+            nbytes = int(row[1])
+            timestamp_ns, tag, value = int(row[2]), int(row[3]), int(row[4])
+            if out is None:
+                data = bytes(self.data[slot][:nbytes])
+            else:
+                np.copyto(out[:nbytes], self.data[slot][:nbytes])
+                data = out
+            if int(row[0]) == version:
+                return seq, data, timestamp_ns, tag, value
+        return None
+
+    def close(self):
+        self.header = None
+        self.data = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def draw_crosshair(frame, center=None):
+    """
+    Draw the targeting crosshair in place
+
+    Args:
+        frame (numpy.ndarray): BGR frame
+        center (tuple): (x, y) of the reticle, defaults to the frame centre
+    """
+    import cv2 as cv
+    h, w = frame.shape[:2]
+    center_x, center_y = center if center is not None else (w // 2, h // 2)
+    cv.line(frame, (center_x - 20, center_y), (center_x + 20, center_y), (0, 0, 255), 1)
+    cv.line(frame, (center_x, center_y - 20), (center_x, center_y + 20), (0, 0, 255), 1)
+
+
+def sharpness(frame):
+    """
+    Example vision worker: focus measure (variance of the Laplacian)
+
+    Args:
+        frame (numpy.ndarray): BGR frame
+
+    Returns:
+        dict: {'sharpness': value}, higher is sharper
+    """
+    import cv2 as cv
+    gray = cv.cvtColor(frame, cv.COLOR_BGR2GRAY)
+    return {'sharpness': float(cv.Laplacian(gray, cv.CV_64F).var())}
+
+
+def _capture_process(frames_name, shape, slots, frame_cond, commands, replies, stop_event):
+    """Open camera sources on request and write frames into shared memory"""
+    import cv2 as cv
+    from camera_sources import open_source
+
+    frames = SharedSlots(slots, int(np.prod(shape)), name=frames_name)
+    height, width = shape[:2]
+    nbytes = int(np.prod(shape))
+    source = None
+    raw = None
+    try:
+        while not stop_event.is_set():
+            try:
+                spec = commands.get(timeout=0.05 if source is None else 0)
+            except queue.Empty:
+                pass
+            else:
+                opened = open_source(spec) if spec is not None else None
+                replies.put((spec, opened.describe() if opened is not None else None))
+                # Like the in-process capture, a source that fails to open keeps the current one
+                if opened is not None or spec is None:
+                    if source is not None:
+                        source.release()
+                    source = opened
+                    raw = None
+                if spec is None:
+                    # Show black instead of freezing on the previous camera's last frame
+                    slot = frames.begin()
+                    frames.data[slot][:] = 0
+                    frames.commit(slot, nbytes, tag=FLAG_BLANK)
+                    with frame_cond:
+                        frame_cond.notify_all()
+            if source is None:
+                continue
+
+            slot = frames.begin()
+            target = frames.data[slot].reshape(shape)
+            ret, frame = source.read(target if raw is None else raw)
+            captured = time.monotonic_ns()
+            if ret and frame is not target:
+                # Different camera resolution: keep its buffer and resize into the slot
+                raw = frame
+                cv.resize(raw, (width, height), dst=target)
+            if ret:
+                frames.commit(slot, nbytes, timestamp_ns=captured)
+                with frame_cond:
+                    frame_cond.notify_all()
+            else:
+                frames.abort(slot)
+                frames.header[0, 2] += 1
+            time.sleep(1 / CAPTURE_FPS)
+    finally:
+        if source is not None:
+            source.release()
+        frames.close()
+
+
+def _encoder_process(frames_name, jpegs_name, shape, slots, jpeg_slot_bytes, frame_cond, jpeg_cond, stop_event):
+    """Encode every new frame once, with the crosshair, into the shared JPEG slots"""
+    import cv2 as cv
+
+    frames = SharedSlots(slots, int(np.prod(shape)), name=frames_name)
+    jpegs = SharedSlots(slots, jpeg_slot_bytes, name=jpegs_name)
+    canvas = np.zeros(shape, dtype=np.uint8)
+    flat = canvas.reshape(-1)
+    last_seq = 0
+    try:
+        while not stop_event.is_set():
+            with frame_cond:
+                if not frame_cond.wait_for(lambda: frames.seq > last_seq, timeout=0.5):
+                    continue
+            latest = frames.read_latest(flat)
+            if latest is None:
+                continue
+            seq, _, timestamp_ns, flags, _ = latest
+            last_seq = seq
+            draw_crosshair(canvas)
+            started = time.perf_counter()
+            ret, buffer = cv.imencode('.jpg', canvas)
+            encode_us = int((time.perf_counter() - started) * 1e6)
+            if not ret or buffer.size > jpeg_slot_bytes:
+                continue
+            slot = jpegs.begin()
+            jpegs.data[slot][:buffer.size] = buffer.reshape(-1)
+            # The tag carries the frame sequence number so streams can count skipped frames
+            jpegs.commit(slot, buffer.size, tag=seq if not flags & FLAG_BLANK else -seq,
+                         value=encode_us, timestamp_ns=timestamp_ns)
+            with jpeg_cond:
+                jpeg_cond.notify_all()
+    finally:
+        frames.close()
+        jpegs.close()
+
+
+def _vision_process(target, frames_name, shape, slots, frame_cond, results, stop_event):
+    """Run a vision function on the newest frame whenever the previous call has finished"""
+    module_name, _, function_name = target.partition(':')
+    function = getattr(importlib.import_module(module_name), function_name)
+    frames = SharedSlots(slots, int(np.prod(shape)), name=frames_name)
+    frame = np.zeros(shape, dtype=np.uint8)
+    flat = frame.reshape(-1)
+    last_seq = 0
+    try:
+        while not stop_event.is_set():
+            with frame_cond:
+                if not frame_cond.wait_for(lambda: frames.seq > last_seq, timeout=0.5):
+                    continue
+            latest = frames.read_latest(flat)
+            if latest is None:
+                continue
+            last_seq, _, timestamp_ns, flags, _ = latest
+            if flags & FLAG_BLANK:
+                continue
+            started = time.perf_counter()
+            try:
+                result = function(frame)
+            except Exception as e:
+                result = {'error': str(e)}
+            results.put((target, last_seq, timestamp_ns, time.perf_counter() - started, result))
+    finally:
+        frames.close()
+
+
+class PipelineCamera:
+    """
+    Stand-in for the active camera when capture runs in the pipeline's
+    capture process; it only describes the source opened there
+    """
+
+    def __init__(self, description):
+        self.description = description
+
+    def isOpened(self):
+        return True
+
+    def read(self, image=None):
+        return False, None
+
+    def describe(self):
+        return self.description
+
+    def release(self):
+        # The capture process releases its source when it opens the next one
+        pass
+
+
+class FramePipeline:
+    """
+    Capture, encoding and vision analysis in their own processes, so they
+    use the other cores instead of competing for the GIL with the Flask
+    request handlers.
+
+    The capture process writes frames into shared memory; the encoder
+    process turns each new frame into one JPEG shared by every stream
+    client; vision workers (importable "module:function" callables taking a
+    BGR frame and returning a dict) analyse the newest frame. A bridge
+    thread copies frames into the in-process FrameRing so session images
+    and other in-process consumers work unchanged.
+    """
+
+    def __init__(self, shape=(480, 640, 3), slots=4, vision_workers=()):
+        """
+        Args:
+            shape (tuple): Frame shape (height, width, channels)
+            slots (int): Shared slots for frames and for JPEGs
+            vision_workers (iterable): "module:function" targets, one process each
+        """
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.vision_workers = list(vision_workers)
+        # Spawned children: forking a process that runs server threads is unsafe
+        self._context = multiprocessing.get_context('spawn')
+        self._frames = None
+        self._jpegs = None
+        self._processes = {}
+        self._source_lock = threading.Lock()
+        self._results_lock = threading.Lock()
+        self._vision_results = {}
+        self._threads = []
+        self.source = None
+        self.running = False
+
+    def start(self):
+        """Create the shared memory and start the worker processes"""
+        ctx = self._context
+        frame_bytes = int(np.prod(self.shape))
+        # An encoded frame is far smaller than the raw one; half of it is ample headroom
+        jpeg_bytes = max(frame_bytes // 2, 65536)
+        self._frames = SharedSlots(self.slots, frame_bytes)
+        self._jpegs = SharedSlots(self.slots, jpeg_bytes)
+        self._frame_cond = ctx.Condition()
+        self._jpeg_cond = ctx.Condition()
+        self._stop = ctx.Event()
+        self._commands = ctx.Queue()
+        self._replies = ctx.Queue()
+        self._results = ctx.Queue()
+
+        self._processes['capture'] = ctx.Process(
+            target=_capture_process, name="pipeline-capture", daemon=True,
+            args=(self._frames.name, self.shape, self.slots, self._frame_cond, self._commands,
+                  self._replies, self._stop))
+        self._processes['encoder'] = ctx.Process(
+            target=_encoder_process, name="pipeline-encoder", daemon=True,
+            args=(self._frames.name, self._jpegs.name, self.shape, self.slots, jpeg_bytes,
+                  self._frame_cond, self._jpeg_cond, self._stop))
+        for target in self.vision_workers:
+            self._processes[f'vision:{target}'] = ctx.Process(
+                target=_vision_process, name=f"pipeline-vision-{target}", daemon=True,
+                args=(target, self._frames.name, self.shape, self.slots, self._frame_cond,
+                      self._results, self._stop))
+        for process in self._processes.values():
+            process.start()
+        self.running = True
+        self._start_thread(self._collect_results, "pipeline-results")
+        logger.info(f"Frame pipeline started: {', '.join(self._processes)}")
+        return self
+
+    def _start_thread(self, target, name, args=()):
+        thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def set_source(self, spec, timeout=20.0):
+        """
+        Switch the capture process to another camera source
+
+        Args:
+            spec (int or str): Camera index or source spec, None to close the camera
+            timeout (float): Time to wait for the capture process to open it
+
+        Returns:
+            dict: The opened source's description, or None if it could not be opened
+        """
+        with self._source_lock:
+            self._commands.put(spec)
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                try:
+                    requested, description = self._replies.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if requested == spec:
+                    self.source = description
+                    return description
+            logger.error(f"Capture process did not answer opening {spec}")
+            return None
+
+    def bridge(self, ring, on_frame=None):
+        """
+        Copy every new frame into an in-process FrameRing
+
+        Args:
+            ring (FrameRing): Destination ring, same shape
+            on_frame (callable): Called after each copied frame (metrics)
+        """
+        self._start_thread(self._bridge_frames, "pipeline-bridge", (ring, on_frame))
+
+    def _bridge_frames(self, ring, on_frame):
+        frames = self._frames
+        last_seq = 0
+        while self.running:
+            with self._frame_cond:
+                if not self._frame_cond.wait_for(lambda: frames.seq > last_seq, timeout=0.5):
+                    continue
+            slot = ring.begin_write()
+            if slot is None:
+                last_seq = frames.seq
+                continue
+            latest = frames.read_latest(slot.reshape(-1))
+            if latest is None:
+                ring.abort()
+                continue
+            last_seq, _, timestamp_ns, flags, _ = latest
+            ring.commit(timestamp=timestamp_ns / 1e9, blank=bool(flags & FLAG_BLANK))
+            if on_frame is not None and not flags & FLAG_BLANK:
+                on_frame()
+
+    def wait_jpeg(self, after_seq, timeout=1.0):
+        """
+        Wait for a JPEG encoded after `after_seq`
+
+        Args:
+            after_seq (int): Pipeline JPEG sequence number the caller already has (0 for none)
+            timeout (float): Maximum wait in seconds
+
+        Returns:
+            tuple: (jpeg_seq, frame_seq, jpeg_bytes, encode_seconds), or None on timeout;
+                frame_seq is negative for placeholder (no camera) frames
+        """
+        jpegs = self._jpegs
+        with self._jpeg_cond:
+            if not self._jpeg_cond.wait_for(lambda: jpegs.seq > after_seq, timeout=timeout):
+                return None
+        latest = jpegs.read_latest()
+        if latest is None:
+            return None
+        seq, data, _, frame_seq, encode_us = latest
+        return seq, frame_seq, data, encode_us / 1e6
+
+    def _collect_results(self):
+        while self.running:
+            try:
+                target, seq, timestamp_ns, duration, result = self._results.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            with self._results_lock:
+                self._vision_results[target] = {'frame_seq': seq, 'captured_at': timestamp_ns / 1e9,
+                                                'duration': round(duration, 6), 'result': result}
+
+    def vision_results(self):
+        """
+        Returns:
+            dict: Latest result per vision worker
+        """
+        with self._results_lock:
+            return dict(self._vision_results)
+
+    def stats(self):
+        """
+        Returns:
+            dict: Process liveness, frames captured and encoded, failed reads and the current source
+        """
+        return {
+            'running': self.running,
+            'processes': {name: process.is_alive() for name, process in self._processes.items()},
+            'frames_captured': self._frames.seq if self._frames is not None else 0,
+            'capture_failures': int(self._frames.header[0, 2]) if self._frames is not None else 0,
+            'frames_encoded': self._jpegs.seq if self._jpegs is not None else 0,
+            'source': self.source,
+        }
+
+    def stop(self, timeout=3.0):
+        """Stop the worker processes and free the shared memory"""
+        if not self.running:
+            return
+        self.running = False
+        self._stop.set()
+        for process in self._processes.values():
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._frames.close()
+        self._jpegs.close()
+        logger.info("Frame pipeline stopped")
+
+
+if __name__ == "__main__":
+    # Run the pipeline on a test pattern and report throughput
+    pipeline = FramePipeline(vision_workers=['frame_pipeline:sharpness']).start()
+    print(pipeline.set_source('test:1280x720@30'))
+    seq = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < 3:
+        encoded = pipeline.wait_jpeg(seq)
+        if encoded:
+            seq = encoded[0]
+    print(pipeline.stats())
+    print(pipeline.vision_results())
+    pipeline.stop()
@@ -0,0 +1,205 @@
+"""
+Frame Ring Module for theSmallComparator
+Handles a preallocated ring of frame buffers shared by the capture thread, vision features and video streams
+"""
+
+import logging
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.camera')
+
+
+class FrameView:
+    """
+    Read-only reference to one published frame. The slot is not reused
+    until the view is released, so hold it only as long as needed (use it
+    as a context manager).
+    """
+
+    __slots__ = ('array', 'seq', 'timestamp', 'blank', '_ring', '_slot')
+
+    def __init__(self, ring, slot, array, seq, timestamp, blank):
+        self._ring = ring
+        self._slot = slot
+        self.array = array
+        self.seq = seq
+        self.timestamp = timestamp
+        self.blank = blank
+
+    def release(self):
+        if self._ring is not None:
+            self._ring._release(self._slot)
+            self._ring = None
+            self.array = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class FrameRing:
+    """
+    Fixed set of frame buffers written by one capture thread and read by
+    any number of consumers without copying.
+
+    The writer fills the oldest slot no reader holds (camera.read(image=buf)
+    or cv.resize(..., dst=buf)) and publishes it as the latest frame. Readers
+    take a reference-counted read-only view of the latest frame. The lock
+    only guards the reference counts, so a slow reader (JPEG encode, vision)
+    never blocks capture; if every slot is held the writer skips a frame
+    instead of waiting.
+    """
+
+    def __init__(self, slots=4, shape=(480, 640, 3)):
+        """
+        Args:
+            slots (int): Number of buffers; at least 2 more than concurrent readers avoids overruns
+            shape (tuple): Frame shape (height, width, channels), uint8
+        """
+        if slots < 2:
+            raise ValueError("A frame ring needs at least 2 slots")
+        self.slots = slots
+        self.shape = tuple(shape)
+        self._buffers = None
+        self._views = None
+        self._refcounts = [0] * slots
+        self._seqs = [0] * slots
+        self._timestamps = [0.0] * slots
+        self._blank = [False] * slots
+        self._writing = None
+        self._latest = None
+        self._seq = 0
+        self.overruns = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def _allocate(self):
+        # NumPy is imported on first use so creating the ring stays cheap at startup
+        import numpy as np
+        self._buffers = [np.zeros(self.shape, dtype=np.uint8) for _ in range(self.slots)]
+        self._views = []
+        for buffer in self._buffers:
+            view = buffer.view()
+            view.flags.writeable = False
+            self._views.append(view)
+
+    @property
+    def seq(self):
+        """Sequence number of the latest published frame (0 before the first)"""
+        return self._seq
+
+    def begin_write(self):
+        """
+        Reserve the oldest unreferenced slot for the next frame
+
+        Returns:
+            numpy.ndarray: Writable buffer of `shape`, or None if every slot is held by readers
+        """
+        with self._cond:
+            if self._buffers is None:
+                self._allocate()
+            if self._writing is not None:
+                raise RuntimeError("begin_write() called twice without commit() or abort()")
+            free = [slot for slot in range(self.slots)
+                    if self._refcounts[slot] == 0 and slot != self._latest]
+            if not free:
+                self.overruns += 1
+                return None
+            slot = min(free, key=lambda index: self._seqs[index])
+            self._writing = slot
+            return self._buffers[slot]
+
+    def commit(self, timestamp=None, blank=False):
+        """
+        Publish the reserved slot as the latest frame and wake waiting readers
+
+        Args:
+            timestamp (float): Capture time (time.monotonic()), defaults to now
+            blank (bool): The frame is a placeholder, not camera content
+
+        Returns:
+            int: Sequence number of the published frame
+        """
+        with self._cond:
+            slot = self._writing
+            if slot is None:
+                raise RuntimeError("commit() without begin_write()")
+            self._writing = None
+            self._seq += 1
+            self._seqs[slot] = self._seq
+            self._timestamps[slot] = time.monotonic() if timestamp is None else timestamp
+            self._blank[slot] = blank
+            self._latest = slot
+            self._cond.notify_all()
+            return self._seq
+
+    def abort(self):
+        """Give the reserved slot back without publishing it (failed read)"""
+        with self._cond:
+            self._writing = None
+
+    def _view(self, slot):
+        self._refcounts[slot] += 1
+        return FrameView(self, slot, self._views[slot], self._seqs[slot], self._timestamps[slot], self._blank[slot])
+
+    def latest(self):
+        """
+        Get the latest frame
+
+        Returns:
+            FrameView: Read-only view (release it when done), or None before the first frame
+        """
+        with self._cond:
+            if self._latest is None:
+                return None
+            return self._view(self._latest)
+
+    def wait_newer(self, seq, timeout=None):
+        """
+        Wait for a frame newer than `seq`
+
+        Args:
+            seq (int): Sequence number the caller already has (0 for none)
+            timeout (float): Maximum wait in seconds
+
+        Returns:
+            FrameView: Read-only view (release it when done), or None on timeout
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > seq and self._latest is not None, timeout):
+                return None
+            return self._view(self._latest)
+
+    def _release(self, slot):
+        with self._cond:
+            self._refcounts[slot] -= 1
+
+    def stats(self):
+        """
+        Returns:
+            dict: Slot count, frames published, slots held by readers and writer overruns
+        """
+        with self._cond:
+            return {'slots': self.slots, 'published': self._seq,
+                    'held': sum(1 for count in self._refcounts if count), 'overruns': self.overruns}
+
+
+if __name__ == "__main__":
+    # Test publishing while readers hold views
+    ring = FrameRing(slots=3, shape=(4, 4, 3))
+    for value in range(5):
+        buffer = ring.begin_write()
+        buffer[:] = value
+        ring.commit()
+    held = ring.latest()
+    print(f"Latest frame {held.seq}, value {held.array[0, 0, 0]}, writeable={held.array.flags.writeable}")
+    buffer = ring.begin_write()
+    buffer[:] = 99
+    ring.commit()
+    print(f"Held view still shows {held.array[0, 0, 0]} while frame {ring.seq} is published")
+    held.release()
+    print(ring.stats())
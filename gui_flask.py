@@ -3,26 +3,79 @@ Flask GUI Module for theSmallComparator
 Provides a web interface that works locally and can be accessed from any device on the same network
 """
 
-from flask import Flask, render_template, request, jsonify, Response
-import cv2 as cv
-import numpy as np
-from PIL import Image
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 import threading
 import time
 import logging
-import serial.tools.list_ports
-from camera_manager import find_available_cameras, initialize_camera
 from serial_comm import SerialCommunicator
 from machine_control import MachineController
 from dxf_handler import DXFHandler
 from klipper_manager import KlipperManager
+from exporters import PointExporter, EXPORT_FORMATS
+from session_store import SessionStore
+from app_state import AppState
+from frame_ring import FrameRing
+from stream_encoder import TierEncoder
+import startup_profiler
+import metrics
+import app_logging
+import math
 import os
 import json
 from datetime import datetime
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.web')
 
+# Measurement sessions are persisted next to the application
+SESSION_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'sessions.db')
+
+# Pixel to stage calibration of the stream-size frames (see camera_calibration.py)
+CAMERA_CALIBRATION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'camera_calibration.json')
+
+# Recorded measurement programs, one JSON file each (see measurement_program.py)
+PROGRAMS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'programs')
+
+# Tray job checkpoints and per-part results, one directory per tray job (see tray_job.py)
+TRAYS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'trays')
+
+# Captured frames are resized to this for the stream and vision features
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+FRAME_RING_SLOTS = 8
+# Full-resolution frames kept for region-of-interest streams when the camera is larger
+NATIVE_RING_SLOTS = 3
+
+# Camera source opened at startup when set, e.g. "test" or "replay:/data/run.mp4" (see camera_sources.py)
+CAMERA_SOURCE_ENV = 'COMPARATOR_CAMERA'
+
+# Vision workers run in pipeline mode, e.g. "frame_pipeline:sharpness" (comma-separated)
+VISION_WORKERS_ENV = 'COMPARATOR_VISION_WORKERS'
+
+
+def parse_feed(value):
+    """
+    Feed rate option of a request
+
+    Args:
+        value: The option as sent (number or numeric string), or None
+
+    Returns:
+        float: Feed rate in mm/min, or None if not given
+
+    Raises:
+        ValueError: If it is not a positive number
+    """
+    if value is None or value == '':
+        return None
+    try:
+        feed = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid feed rate {value!r}")
+    if not (math.isfinite(feed) and feed > 0):
+        raise ValueError(f"The feed rate must be positive, not {value!r}")
+    return feed
 
 
 class TheSmallComparatorFlaskGUI:
@@ -30,64 +83,198 @@ class TheSmallComparatorFlaskGUI:
     Flask-based GUI class for the theSmallComparator application
     """
     
-    def __init__(self, camera_manager=None):
+    def __init__(self, camera_manager=None, camera_source=None, pipeline=False):
         self.app = Flask(__name__)
         self.camera_manager = camera_manager
-        self.setup_routes()
+        self.camera_source = camera_source or os.environ.get(CAMERA_SOURCE_ENV) or None
+        with startup_profiler.profile_phase('setup_routes'):
+            self.setup_routes()
         
         # Initialize machine control
-        # Auto-detection logic: Try Klipper first, then GRBL
-        self.mode = "GRBL"  # Default
-        
-        # Try Klipper
+        # The backend (Klipper first, then GRBL) is detected in the background so the
+        # web server is up immediately; until then commands go to the serial communicator.
+        self.mode = "Detecting"
         self.klipper = KlipperManager()
-        if self.klipper.connect():
-            logging.info("Auto-detected Klipper/Moonraker instance. Switching to Klipper mode.")
-            self.mode = "Klipper"
-            self.comm = self.klipper
-            # In Klipper mode, available ports aren't relevant in the same way, but we can list virtual ports or empty
-            self.ports = [] 
-        else:
-            # Fallback to GRBL - check if ports exist
-            logging.info("Klipper not detected. Checking for GRBL Serial ports.")
-            self.comm = SerialCommunicator()
-            self.ports = self.comm.get_available_ports()
-            self.port_names = [str(port) for port in self.ports]
-            
-            if self.ports:
-                self.mode = "GRBL"
-                logging.info(f"GRBL ports found: {self.port_names}")
-            else:
-                self.mode = "Disconnected"
-                logging.info("No GRBL ports found. Mode set to Disconnected.")
-            
+        self.comm = SerialCommunicator()
+        self.ports = []
+        self.port_names = []
         self.controller = MachineController(self.comm)
-        self.dxf_handler = DXFHandler()
+        self.klipper_found = None
+        self.detection_lock = threading.Lock()
         
-        # State variables
-        self.camera = None
-        self.camera_index = None
-        self.prev_point_x = 0.0
-        self.prev_point_y = 0.0
-        self.difference_x = 0.0
-        self.difference_y = 0.0
-        self.difference_distance = 0.0
+        # Shared state (recorded points, differences, session, camera), each part with its own lock
+        self.state = AppState()
         self.data_acq_status = "ready"
         self.jog_distance = 10.0
         
-        # Store recorded points for visualization
-        self.recorded_points = []
-        
-        # Camera thread variables
-        self.camera_thread = None
-        self.current_frame = np.zeros((480, 640, 3), dtype=np.uint8)
-        self.frame_lock = threading.Lock()
-        self.running = False
-        
-        # Initialize camera cache in background
-        logging.info("Starting background camera scan...")
-        threading.Thread(target=find_available_cameras, daemon=True).start()
+        # Captured frames: preallocated buffers filled in place by the capture thread and
+        # shared read-only with streams and vision (no frame until the first capture; the
+        # feed shows black meanwhile)
+        self.frames = FrameRing(slots=FRAME_RING_SLOTS, shape=(FRAME_HEIGHT, FRAME_WIDTH, 3))
+        self.native_frames = None  # Created once the camera's resolution is known
+        # JPEGs shared by stream clients on the same size/quality tier, and the connected clients
+        self.stream_encoder = TierEncoder()
+        self.streams = {}
+        self.streams_lock = threading.Lock()
+        # Newest pipeline JPEG whose encode time was observed (every stream client sees each one)
+        self._observed_jpeg_seq = 0
+        # One automated motion job (autofocus, focus stack, contour trace) at a time
+        self.motion_job_lock = threading.Lock()
+        # Camera pixel to stage mapping, loaded from CAMERA_CALIBRATION_PATH on first use
+        self.pixel_mapping = None
+        self.tracer = None
+        self.fly_scan = None
+        # Measurement program being recorded, and the current or last program run
+        self.program_store = None
+        self.recorder = None
+        self.program_runner = None
+        self.tray = None
+        # Part alignment (datum and the features it was solved from), applied to points and programs
+        self.alignment = None
+        # Pipeline mode: capture, encoding and vision in separate processes (see frame_pipeline.py)
+        self.pipeline = self._start_pipeline() if pipeline else None
+        self.running = True
+        # Set on shutdown so long-lived MJPEG generators end cleanly
+        self.stop_event = threading.Event()
         
+        # Persistent measurement sessions: resume the last unfinished one after a crash/restart
+        with startup_profiler.profile_phase('session_store'):
+            self.session_store = SessionStore(SESSION_DB_PATH)
+            self.session_lock = threading.Lock()
+            latest_session = self.session_store.get_latest_open_session()
+            if latest_session:
+                self.resume_session(latest_session['id'])
+
+        self.start_background_detection()
+        startup_profiler.mark('gui_constructed')
+
+    def start_background_detection(self):
+        """
+        Run the slow startup work concurrently in background threads: probe
+        Moonraker, list serial ports, scan cameras and import OpenCV/NumPy.
+        Progress is reported by /api/startup_status.
+        """
+        phases = {
+            'klipper': self._detect_klipper,
+            'serial_ports': self._detect_serial_ports,
+            'camera_cache': self._scan_cameras,
+            'imports': self._warm_imports,
+        }
+        if self.camera_source:
+            phases['camera_source'] = self._open_camera_source
+        for name in phases:
+            self.state.startup.add_phase(name)
+        logger.info("Starting background backend detection and camera scan...")
+        for name, target in phases.items():
+            threading.Thread(target=self._run_startup_phase, args=(name, target),
+                             name=f"startup-{name}", daemon=True).start()
+
+    def _run_startup_phase(self, name, target):
+        startup = self.state.startup
+        startup.start_phase(name)
+        try:
+            with startup_profiler.profile_phase(name, category='startup'):
+                result = target()
+            startup.finish_phase(name, result)
+        except Exception as e:
+            logger.error(f"Startup phase {name} failed: {e}")
+            startup.finish_phase(name, str(e), failed=True)
+        if name in ('klipper', 'serial_ports'):
+            self._update_mode()
+        if startup.snapshot()['ready']:
+            startup_profiler.finish_profiling()
+
+    def _detect_klipper(self):
+        self.klipper_found = self.klipper.connect()
+        return {'found': self.klipper_found}
+
+    def _detect_serial_ports(self):
+        self.ports = self.comm.get_available_ports()
+        self.port_names = [str(port) for port in self.ports]
+        return {'ports': self.port_names}
+
+    def _scan_cameras(self):
+        from camera_manager import find_available_cameras
+        return {'cameras': find_available_cameras()}
+
+    def _open_camera_source(self):
+        if not self.open_camera(self.camera_source):
+            raise RuntimeError(f"Could not open camera source {self.camera_source}")
+        return {'source': self.state.camera.get()[0].describe()}
+
+    def _start_pipeline(self):
+        from frame_pipeline import FramePipeline
+        workers = [target.strip() for target in os.environ.get(VISION_WORKERS_ENV, '').split(',') if target.strip()]
+        with startup_profiler.profile_phase('frame_pipeline'):
+            pipeline = FramePipeline(shape=(FRAME_HEIGHT, FRAME_WIDTH, 3), vision_workers=workers).start()
+        capture_rate = metrics.RateMeter(metrics.CAPTURE_FPS)
+
+        def on_frame():
+            startup_profiler.mark('first_frame', write=True)
+            metrics.CAPTURE_FRAMES.inc()
+            capture_rate.tick()
+
+        # Session images and other in-process readers keep using the frame ring
+        pipeline.bridge(self.frames, on_frame=on_frame)
+        return pipeline
+
+    def open_camera(self, camera):
+        """
+        Open a camera or virtual source, make it the active one and start capturing
+
+        Args:
+            camera (int or str): Camera index or source spec (see camera_sources.create_source)
+
+        Returns:
+            bool: True if the source delivered a frame
+        """
+        if self.pipeline is not None:
+            return self._open_pipeline_camera(camera)
+        from camera_manager import initialize_camera
+        from camera_sources import source_index
+        with startup_profiler.profile_phase('camera_open'):
+            source = initialize_camera(camera)
+        if source is None:
+            return False
+        self.state.camera.set(source, source_index(source))
+        # Start camera thread if not already running
+        self.state.camera.start_capture(self.update_frames)
+        return True
+
+    def _open_pipeline_camera(self, camera):
+        from frame_pipeline import PipelineCamera
+        with startup_profiler.profile_phase('camera_open'):
+            description = self.pipeline.set_source(camera)
+        if description is None:
+            return False
+        index = int(camera) if str(camera).isdigit() else description['spec']
+        self.state.camera.set(PipelineCamera(description), index)
+        return True
+
+    def _warm_imports(self):
+        # Pay the OpenCV/NumPy import cost here instead of in the first video request
+        import cv2
+        import numpy
+        return {'opencv': cv2.__version__, 'numpy': numpy.__version__}
+
+    def _update_mode(self):
+        """Pick the machine backend once enough detection results are in"""
+        startup = self.state.startup
+        with self.detection_lock:
+            if self.mode != "Detecting":
+                return
+            if self.klipper_found:
+                logger.info("Auto-detected Klipper/Moonraker instance. Switching to Klipper mode.")
+                self.comm = self.klipper
+                self.controller.comm = self.klipper
+                self.mode = "Klipper"
+            elif startup.is_done('klipper') and startup.is_done('serial_ports'):
+                if self.ports:
+                    self.mode = "GRBL"
+                    logger.info(f"Klipper not detected. GRBL ports found: {self.port_names}")
+                else:
+                    self.mode = "Disconnected"
+                    logger.info("Klipper not detected and no GRBL ports found. Mode set to Disconnected.")
     
     def setup_routes(self):
         """Setup Flask routes"""
@@ -97,13 +284,89 @@ class TheSmallComparatorFlaskGUI:
         
         @self.app.route('/video_feed')
         def video_feed():
-            return Response(self.generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+            """
+            MJPEG stream. Optional query parameters: width (320/480/640),
+            quality (30-95), fps (1-30) and adaptive=1 to follow the client's
+            measured throughput, e.g. /video_feed?width=480&adaptive=1.
+            zoom (1.5-8) streams only the region around the reticle (or cx, cy
+            as fractions of the frame) at native sensor resolution.
+            """
+            from stream_encoder import StreamSettings
+            settings = StreamSettings((FRAME_WIDTH, FRAME_HEIGHT),
+                                      width=request.args.get('width', type=int),
+                                      quality=request.args.get('quality', type=int),
+                                      fps=request.args.get('fps', type=float),
+                                      adaptive=request.args.get('adaptive', '').lower() in ('1', 'true', 'yes'),
+                                      zoom=request.args.get('zoom', type=float),
+                                      center_x=request.args.get('cx', 0.5, type=float),
+                                      center_y=request.args.get('cy', 0.5, type=float))
+            return Response(self.generate_frames(settings), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+        @self.app.route('/api/streams')
+        def stream_status():
+            """Connected stream clients and the shared encode tiers"""
+            with self.streams_lock:
+                clients = [settings.describe() for settings in self.streams.values()]
+            return jsonify({'success': True, 'clients': clients, 'tiers': self.stream_encoder.stats()})
         
         @self.app.route('/api/cameras')
         def get_cameras():
-            cameras = find_available_cameras()
+            import camera_manager
+            if self.state.startup.is_done('camera_cache'):
+                cameras = camera_manager.find_available_cameras()
+            else:
+                # The startup scan is still running; don't start a second one
+                cameras = camera_manager.manager.get_cached_cameras()
             return jsonify(cameras)
 
+        @self.app.route('/metrics')
+        def prometheus_metrics():
+            return Response(metrics.REGISTRY.render(), mimetype=metrics.PROMETHEUS_CONTENT_TYPE)
+
+        @self.app.route('/api/logs')
+        def get_logs():
+            """Recent log records from the in-memory ring buffer"""
+            ring = app_logging.get_ring_buffer()
+            if ring is None:
+                return jsonify({'success': False, 'message': 'Log buffer not enabled', 'records': []}), 404
+            records = ring.get_records(since=request.args.get('since', 0, type=int),
+                                       limit=request.args.get('limit', 500, type=int),
+                                       level=request.args.get('level'),
+                                       subsystem=request.args.get('subsystem'))
+            return jsonify({'success': True, 'records': records,
+                            'last_seq': records[-1]['seq'] if records else request.args.get('since', 0, type=int)})
+
+        @self.app.route('/api/logs/levels', methods=['GET', 'POST'])
+        def log_levels():
+            """Get or change per-subsystem log levels"""
+            if request.method == 'POST':
+                data = request.json or {}
+                try:
+                    app_logging.set_level(data.get('subsystem', 'root'), data.get('level', 'INFO'))
+                except ValueError as e:
+                    return jsonify({'success': False, 'message': str(e)}), 400
+            return jsonify({'success': True, 'levels': app_logging.get_levels()})
+
+        @self.app.route('/api/startup_status')
+        def startup_status():
+            return jsonify({**self.state.startup.snapshot(), 'mode': self.mode})
+
+        @self.app.route('/api/startup_profile')
+        def startup_profile():
+            profiler = startup_profiler.get_profiler()
+            if profiler is None:
+                return jsonify({'success': False,
+                                'message': 'Startup profiling is disabled (start with --profile-startup)'}), 404
+            return jsonify(profiler.report())
+
+        @self.app.route('/api/pipeline')
+        def pipeline_status():
+            if self.pipeline is None:
+                return jsonify({'success': False,
+                                'message': 'The frame pipeline is disabled (start with --pipeline)'}), 404
+            return jsonify({'success': True, **self.pipeline.stats(),
+                            'vision': self.pipeline.vision_results()})
+
         @self.app.route('/api/refresh_cameras', methods=['POST'])
         def refresh_cameras():
             """Endpoint to refresh camera detection and find newly connected cameras."""
@@ -115,17 +378,17 @@ class TheSmallComparatorFlaskGUI:
                 data = request.json or {}
                 mode = data.get('mode', 'full') 
                 
-                logging.info(f"Refreshing cameras with mode: {mode}")
+                logger.info(f"Refreshing cameras with mode: {mode}")
                 cameras = refresh_camera_detection(mode=mode)
                 
-                logging.info(f"Camera refresh completed: {cameras}")
+                logger.info(f"Camera refresh completed: {cameras}")
                 return jsonify({
                     'success': True,
                     'cameras': cameras,
                     'message': f'Found {len(cameras)} camera(s) after refresh ({mode} scan)'
                 })
             except Exception as e:
-                logging.error(f"Error refreshing cameras: {e}")
+                logger.error(f"Error refreshing cameras: {e}")
                 return jsonify({
                     'success': False,
                     'error': str(e),
@@ -134,16 +397,10 @@ class TheSmallComparatorFlaskGUI:
         
         @self.app.route('/api/initialize_camera', methods=['POST'])
         def initialize_camera_endpoint():
-            camera_idx = int(request.json.get('camera_index', 0))
-            self.camera = initialize_camera(camera_idx)
-            if self.camera is not None:
-                self.camera_index = camera_idx
-                # Start camera thread if not already running
-                if not self.running:
-                    self.running = True
-                    self.camera_thread = threading.Thread(target=self.update_frames)
-                    self.camera_thread.daemon = True
-                    self.camera_thread.start()
+            data = request.json or {}
+            # A camera index, or a source spec such as "test" or "replay:/path/video.mp4"
+            camera_idx = data.get('camera_source') or int(data.get('camera_index', 0))
+            if self.open_camera(camera_idx):
                 return jsonify({'success': True, 'message': f'Camera {camera_idx} initialized'})
             else:
                 return jsonify({'success': False, 'message': f'Failed to initialize camera {camera_idx}'}), 400
@@ -159,14 +416,14 @@ class TheSmallComparatorFlaskGUI:
                 # Refresh the available ports by calling the serial_comm's method
                 self.ports = self.comm.get_available_ports()
                 self.port_names = [str(port) for port in self.ports]
-                logging.info(f"Port refresh completed: {self.port_names}")
+                logger.info(f"Port refresh completed: {self.port_names}")
                 return jsonify({
                     'success': True,
                     'ports': self.port_names,
                     'message': f'Found {len(self.port_names)} port(s) after refresh'
                 })
             except Exception as e:
-                logging.error(f"Error refreshing ports: {e}")
+                logger.error(f"Error refreshing ports: {e}")
                 return jsonify({
                     'success': False,
                     'error': str(e),
@@ -178,6 +435,8 @@ class TheSmallComparatorFlaskGUI:
             port_name = request.json.get('port_name', '').split(' ')[0]  # Get just the port name
             success = self.comm.connect_to_com(port_name)
             if success:
+                # Read this machine's speed and acceleration limits for move time estimates
+                self.controller.get_motion_model(refresh=True)
                 return jsonify({'success': True, 'message': f'Connected to {port_name}'})
             else:
                 return jsonify({'success': False, 'message': f'Failed to connect to {port_name}'}), 400
@@ -214,6 +473,443 @@ class TheSmallComparatorFlaskGUI:
             
             return jsonify({'success': True})
         
+        @self.app.route('/api/autofocus', methods=['POST'])
+        def autofocus():
+            """Sweep Z, score the sharpness of each frame and move to best focus"""
+            from autofocus import Autofocus
+            options = request.json or {}
+            camera, _ = self.state.camera.get()
+            if camera is None or not self.frames.seq:
+                return jsonify({'success': False, 'error': 'No camera is capturing'}), 400
+            try:
+                sweep_range = float(options.get('range', 2.0))
+                coarse_feed = parse_feed(options.get('coarse_feed', 120.0))
+                fine_feed = parse_feed(options.get('fine_feed', 30.0))
+            except (TypeError, ValueError) as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            if not self.motion_job_lock.acquire(blocking=False):
+                return jsonify({'success': False, 'error': 'Another motion job is running'}), 409
+            try:
+                focus = Autofocus(self.controller, self.frames, method=options.get('method', 'laplacian'))
+                result = focus.run(sweep_range=sweep_range, coarse_feed=coarse_feed or 120.0,
+                                   fine_feed=fine_feed or 30.0)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            finally:
+                self.motion_job_lock.release()
+            if result['success']:
+                # Recorded at the focus found, so a replay measures how far each part's surface differs
+                position = self.controller.get_current_position()
+                if position:
+                    self.record_program_step('autofocus', dict(position, z=result['z']),
+                                             method=options.get('method', 'laplacian'),
+                                             range=sweep_range)
+            return jsonify(result), 200 if result['success'] else 500
+
+        @self.app.route('/api/focus_stack', methods=['POST'])
+        def focus_stack():
+            """Step Z around the current height and store the all-in-focus image and height map in the session"""
+            import cv2 as cv
+            import numpy as np
+            from focus_stack import capture_stack
+            options = request.json or {}
+            camera, _ = self.state.camera.get()
+            if camera is None or not self.frames.seq:
+                return jsonify({'success': False, 'error': 'No camera is capturing'}), 400
+            if not self.motion_job_lock.acquire(blocking=False):
+                return jsonify({'success': False, 'error': 'Another motion job is running'}), 409
+            try:
+                position = self.controller.get_current_position()
+                if position is None:
+                    return jsonify({'success': False, 'error': 'Could not read the machine position'}), 500
+                depth = min(abs(float(options.get('range', 1.0))), 10.0)
+                step = float(options.get('step', 0.05))
+                feed = parse_feed(options.get('feed'))
+                z_start = position['z'] - depth / 2
+                # Full-resolution frames when the camera is larger than the stream
+                frames = self.native_frames or self.frames
+                stacker = capture_stack(self.controller, frames, z_start, z_start + depth, step, feed=feed)
+                self.controller.move_to(z=position['z'])
+            except (TypeError, ValueError) as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            except RuntimeError as e:
+                return jsonify({'success': False, 'error': str(e)}), 500
+            finally:
+                self.motion_job_lock.release()
+
+            session_id = self.ensure_session()
+            image_position = {'x': position['x'], 'y': position['y'], 'z': position['z']}
+            ret, fused = cv.imencode('.jpg', stacker.fused())
+            if ret:
+                self.session_store.add_image(session_id, fused.tobytes(), position=image_position)
+            ret, heights_png = cv.imencode('.png', stacker.height_image())
+            if ret:
+                self.session_store.add_image(session_id, heights_png.tobytes(), mimetype='image/png',
+                                             position=image_position)
+            heights = stacker.height_map()
+            return jsonify({
+                'success': True,
+                'session_id': session_id,
+                'frames': stacker.frames,
+                'z_range': [min(stacker.zs), max(stacker.zs)],
+                'height_map': [[None if np.isnan(z) else round(float(z), 4) for z in row] for row in heights],
+            })
+
+        @self.app.route('/api/camera_calibration', methods=['GET', 'POST'])
+        def camera_calibration():
+            """Get the pixel to stage mapping, or measure it by moving X and Y (POST)"""
+            from camera_calibration import calibrate, save_mapping
+            if request.method == 'GET':
+                mapping = self.get_pixel_mapping()
+                return jsonify({'success': True, 'calibration': mapping.to_dict() if mapping else None})
+            camera, _ = self.state.camera.get()
+            if camera is None or not self.frames.seq:
+                return jsonify({'success': False, 'error': 'No camera is capturing'}), 400
+            if not self.motion_job_lock.acquire(blocking=False):
+                return jsonify({'success': False, 'error': 'Another motion job is running'}), 409
+            try:
+                mapping = calibrate(self.controller, self.frames, float((request.json or {}).get('distance', 0.5)))
+            except RuntimeError as e:
+                return jsonify({'success': False, 'error': str(e)}), 500
+            finally:
+                self.motion_job_lock.release()
+            save_mapping(mapping, CAMERA_CALIBRATION_PATH)
+            self.pixel_mapping = mapping
+            return jsonify({'success': True, 'calibration': mapping.to_dict()})
+
+        @self.app.route('/api/trace', methods=['GET'])
+        def trace_status():
+            """Progress of the current or last contour trace"""
+            if self.tracer is None:
+                return jsonify({'success': True, 'trace': None})
+            return jsonify({'success': True, 'trace': self.tracer.status()})
+
+        @self.app.route('/api/trace/start', methods=['POST'])
+        def start_trace():
+            """Trace the part edge under the crosshair; the contour is added to the DXF as a polyline"""
+            from edge_tracer import ContourTracer
+            options = request.json or {}
+            mapping = self.get_pixel_mapping()
+            if mapping is None:
+                return jsonify({'success': False, 'error': 'Calibrate the camera first'}), 400
+            camera, _ = self.state.camera.get()
+            if camera is None or not self.frames.seq:
+                return jsonify({'success': False, 'error': 'No camera is capturing'}), 400
+            if not self.motion_job_lock.acquire(blocking=False):
+                return jsonify({'success': False, 'error': 'Another motion job is running'}), 409
+            try:
+                self.tracer = ContourTracer(self.controller, self.frames, mapping, step=options.get('step'),
+                                            spacing=float(options.get('spacing', 0.02)),
+                                            feed=parse_feed(options.get('feed')))
+            except (TypeError, ValueError) as e:
+                self.motion_job_lock.release()
+                return jsonify({'success': False, 'error': str(e)}), 400
+            self._start_motion_job(self.tracer.trace, self._trace_finished, 'contour-trace')
+            return jsonify({'success': True})
+
+        @self.app.route('/api/trace/stop', methods=['POST'])
+        def stop_trace():
+            if self.tracer is not None:
+                self.tracer.stop()
+            return jsonify({'success': True})
+
+        @self.app.route('/api/fly_scan', methods=['GET'])
+        def fly_scan_status():
+            """Progress of the current or last fly scan"""
+            if self.fly_scan is None:
+                return jsonify({'success': True, 'scan': None})
+            return jsonify({'success': True, 'scan': self.fly_scan.status()})
+
+        @self.app.route('/api/fly_scan/start', methods=['POST'])
+        def start_fly_scan():
+            """Scan an area without stopping; every frame is stored in the session with its stage position"""
+            from fly_scan import FlyScan, plan_feed
+            options = request.json or {}
+            camera, _ = self.state.camera.get()
+            if camera is None or not self.frames.seq:
+                return jsonify({'success': False, 'error': 'No camera is capturing'}), 400
+            mapping = self.get_pixel_mapping()
+            try:
+                x0, y0, x1, y1 = (float(options[key]) for key in ('x0', 'y0', 'x1', 'y1'))
+                exposure = options.get('exposure')
+                if mapping is not None:
+                    width, height = mapping.frame_size
+                    field_width, field_height = width * mapping.mm_per_pixel, height * mapping.mm_per_pixel
+                    row_pitch = float(options.get('row_pitch', field_height * 0.8))
+                    feed = float(options.get('feed') or plan_feed(mapping.mm_per_pixel, field_width,
+                                                                  metrics.CAPTURE_FPS.labels().value or 15.0))
+                else:
+                    row_pitch, feed = float(options['row_pitch']), float(options['feed'])
+            except KeyError as e:
+                return jsonify({'success': False, 'error': f'Missing {e.args[0]} (row_pitch and feed are required '
+                                                           f'until the camera is calibrated)'}), 400
+            except (TypeError, ValueError) as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            if not self.motion_job_lock.acquire(blocking=False):
+                return jsonify({'success': False, 'error': 'Another motion job is running'}), 409
+            session_id = self.ensure_session()
+
+            def store_frame(jpeg, position):
+                self.session_store.add_image(session_id, jpeg, position=position)
+
+            try:
+                # Full-resolution frames when the camera is larger than the stream
+                self.fly_scan = FlyScan(self.controller, self.native_frames or self.frames, x0, y0, x1, y1,
+                                        row_pitch, feed, camera=camera,
+                                        exposure=float(exposure) if exposure is not None else None,
+                                        on_frame=store_frame)
+            except ValueError as e:
+                self.motion_job_lock.release()
+                return jsonify({'success': False, 'error': str(e)}), 400
+            self._start_motion_job(self.fly_scan.run, lambda status: None, 'fly-scan')
+            return jsonify({'success': True, 'session_id': session_id, 'rows': len(self.fly_scan.rows),
+                            'feed': feed, 'row_pitch': row_pitch})
+
+        @self.app.route('/api/fly_scan/stop', methods=['POST'])
+        def stop_fly_scan():
+            if self.fly_scan is not None:
+                self.fly_scan.stop()
+            return jsonify({'success': True})
+
+        @self.app.route('/api/align', methods=['GET', 'POST', 'DELETE'])
+        def align_part():
+            """
+            Get or clear the part alignment, or align the part (POST) on nominal features in
+            part coordinates ('point' fiducials, or 'edge' points with their normal); the
+            first feature must be under the reticle
+            """
+            from alignment import guess_datum
+            if request.method == 'GET':
+                return jsonify({'success': True, 'alignment': self.alignment})
+            if request.method == 'DELETE':
+                self.alignment = None
+                return jsonify({'success': True})
+            options = request.json or {}
+            features = options.get('features') or []
+            if not features:
+                return jsonify({'success': False, 'error': 'No features to align on'}), 400
+            if self.get_pixel_mapping() is None:
+                return jsonify({'success': False, 'error': 'Calibrate the camera first'}), 400
+            camera, _ = self.state.camera.get()
+            if camera is None or not self.frames.seq:
+                return jsonify({'success': False, 'error': 'No camera is capturing'}), 400
+            position = self.controller.get_current_position()
+            if not position:
+                return jsonify({'success': False, 'error': 'Could not get current position'}), 400
+            if not self.motion_job_lock.acquire(blocking=False):
+                return jsonify({'success': False, 'error': 'Another motion job is running'}), 409
+            try:
+                guess = guess_datum(position, features[0], float(options.get('angle', 0.0)))
+                self.align(features, guess, float(options.get('max_residual', 0.05)))
+            except KeyError as e:
+                return jsonify({'success': False, 'error': f'A feature is missing {e.args[0]}'}), 400
+            except (TypeError, ValueError) as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            except RuntimeError as e:
+                return jsonify({'success': False, 'error': str(e)}), 500
+            finally:
+                self.motion_job_lock.release()
+            return jsonify({'success': True, 'alignment': self.alignment})
+
+        @self.app.route('/api/programs')
+        def list_programs():
+            """Recorded measurement programs, and the one being recorded"""
+            recorder = self.recorder
+            return jsonify({'success': True, 'programs': self.get_program_store().list(),
+                            'recording': {'name': recorder.name, 'steps': len(recorder.steps)} if recorder else None})
+
+        @self.app.route('/api/programs/<name>', methods=['GET', 'DELETE'])
+        def program(name):
+            store = self.get_program_store()
+            try:
+                if request.method == 'DELETE':
+                    return jsonify({'success': store.delete(name)})
+                return jsonify({'success': True, 'program': store.load(name)})
+            except FileNotFoundError:
+                return jsonify({'success': False, 'error': f'No program {name}'}), 404
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+
+        @self.app.route('/api/programs/record/start', methods=['POST'])
+        def start_program_recording():
+            """Record the following point captures, images and autofocus relative to the current position"""
+            from measurement_program import Datum, ProgramRecorder
+            position = self.controller.get_current_position()
+            if not position:
+                return jsonify({'success': False, 'error': 'Could not get current position'}), 400
+            alignment = self.alignment
+            try:
+                if alignment:
+                    # Recorded in the aligned part coordinates; replays align each part the same way
+                    self.recorder = ProgramRecorder((request.json or {}).get('name'), Datum(**alignment['datum']),
+                                                    alignment=alignment['nominal'])
+                else:
+                    self.recorder = ProgramRecorder((request.json or {}).get('name'),
+                                                    Datum(position['x'], position['y'], position['z']))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            return jsonify({'success': True, 'name': self.recorder.name})
+
+        @self.app.route('/api/programs/record/stop', methods=['POST'])
+        def stop_program_recording():
+            """Save the program being recorded"""
+            recorder, self.recorder = self.recorder, None
+            if recorder is None:
+                return jsonify({'success': False, 'error': 'No program is being recorded'}), 400
+            if not recorder.steps:
+                return jsonify({'success': False, 'error': 'Nothing was recorded'}), 400
+            program = recorder.program()
+            self.get_program_store().save(program)
+            return jsonify({'success': True, 'name': program['name'], 'steps': len(program['steps'])})
+
+        @self.app.route('/api/programs/run', methods=['GET'])
+        def program_run_status():
+            """Progress of the current or last program run"""
+            if self.program_runner is None:
+                return jsonify({'success': True, 'run': None})
+            return jsonify({'success': True, 'run': self.program_runner.status()})
+
+        @self.app.route('/api/programs/<name>/run', methods=['POST'])
+        def run_program(name):
+            """
+            Replay a program on the next part: aligned on the program's features when it has
+            them (the first one under the reticle), else on the current part alignment, else
+            with the current position as the datum
+            """
+            from measurement_program import Datum
+            from alignment import guess_datum
+            options = request.json or {}
+            try:
+                program = self.get_program_store().load(name)
+            except FileNotFoundError:
+                return jsonify({'success': False, 'error': f'No program {name}'}), 404
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            try:
+                feed = parse_feed(options.get('feed'))
+                max_residual = float(options.get('max_residual', 0.05))
+                angle = float(options.get('angle', 0.0))
+            except (TypeError, ValueError) as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            if self.recorder is not None:
+                return jsonify({'success': False, 'error': 'Stop recording first'}), 409
+            if program.get('alignment') and self.get_pixel_mapping() is None:
+                return jsonify({'success': False, 'error': 'Calibrate the camera first'}), 400
+            position = self.controller.get_current_position()
+            if not position:
+                return jsonify({'success': False, 'error': 'Could not get current position'}), 400
+            datum = self.get_datum()
+            if program.get('alignment'):
+                datum = guess_datum(position, program['alignment'][0], angle)
+            elif datum is None:
+                datum = Datum(position['x'], position['y'], position['z'], angle)
+            if not self.motion_job_lock.acquire(blocking=False):
+                return jsonify({'success': False, 'error': 'Another motion job is running'}), 409
+            session_id = self.ensure_session()
+            try:
+                self.program_runner = self.make_program_runner(program, datum, session_id, feed=feed,
+                                                               max_residual=max_residual)
+            except (TypeError, ValueError) as e:
+                self.motion_job_lock.release()
+                return jsonify({'success': False, 'error': str(e)}), 400
+            self._start_motion_job(self.program_runner.run, lambda status: None, f'program-{program["name"]}')
+            return jsonify({'success': True, 'session_id': session_id, 'steps': len(program['steps'])})
+
+        @self.app.route('/api/tray', methods=['GET'])
+        def tray_status():
+            """Progress of the current or last tray job"""
+            if self.tray is None:
+                return jsonify({'success': True, 'tray': None})
+            return jsonify({'success': True, 'tray': self.tray.status()})
+
+        @self.app.route('/api/tray/start', methods=['POST'])
+        def start_tray():
+            """
+            Measure every slot of a tray (see tray_job.validate_job for the job); an interrupted
+            run of the same tray resumes at the next unfinished slot unless `restart` is set
+            """
+            from tray_job import TrayScheduler, tray_slots, validate_job
+            options = request.json or {}
+            if self.recorder is not None:
+                return jsonify({'success': False, 'error': 'Stop recording first'}), 409
+            position = self.controller.get_current_position()
+            if not position:
+                return jsonify({'success': False, 'error': 'Could not get current position'}), 400
+            try:
+                job = validate_job(dict({'z': position['z']}, **(options.get('job') or {})))
+                feed = parse_feed(options.get('feed'))
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            # Every program the slots need, so a misspelt name fails now rather than at its slot
+            store = self.get_program_store()
+            programs = {}
+            for name in dict.fromkeys(slot['program'] for slot in tray_slots(job)):
+                try:
+                    programs[name] = store.load(name)
+                except FileNotFoundError:
+                    return jsonify({'success': False, 'error': f'No program {name}'}), 400
+                except ValueError as e:
+                    return jsonify({'success': False, 'error': str(e)}), 400
+
+            def make_runner(name, datum):
+                return self.make_program_runner(programs[name], datum, session_id, feed=feed)
+
+            if not self.motion_job_lock.acquire(blocking=False):
+                return jsonify({'success': False, 'error': 'Another motion job is running'}), 409
+            session_id = self.ensure_session()
+            try:
+                self.tray = TrayScheduler(job, os.path.join(TRAYS_DIR, job['name']), make_runner,
+                                          resume=not options.get('restart'),
+                                          model=self.controller.get_motion_model(),
+                                          start=(position['x'], position['y']))
+            except (OSError, ValueError) as e:
+                self.motion_job_lock.release()
+                return jsonify({'success': False, 'error': str(e)}), 400
+            self._start_motion_job(self.tray.run, lambda status: None, f'tray-{job["name"]}')
+            return jsonify({'success': True, 'session_id': session_id, **self.tray.status()})
+
+        @self.app.route('/api/tray/stop', methods=['POST'])
+        def stop_tray():
+            if self.tray is not None:
+                self.tray.stop()
+            return jsonify({'success': True})
+
+        @self.app.route('/api/programs/run/stop', methods=['POST'])
+        def stop_program_run():
+            if self.program_runner is not None:
+                self.program_runner.stop()
+            return jsonify({'success': True})
+
+        @self.app.route('/api/path/plan', methods=['POST'])
+        def plan_travel_path():
+            """
+            Order waypoints ([x, y] or [x, y, z] lists, or dicts) for the least travel time from
+            the current position, with the machine's axis limits
+            """
+            from path_planner import plan_path, path_time
+            options = request.json or {}
+            try:
+                points = [[float(point[axis]) for axis in ('x', 'y', 'z') if axis in point]
+                          if isinstance(point, dict) else [float(value) for value in point]
+                          for point in options.get('points') or []]
+                if len({len(point) for point in points}) > 1 or any(len(point) not in (2, 3) for point in points):
+                    raise ValueError("Waypoints need the same 2 or 3 coordinates")
+            except (TypeError, ValueError, KeyError) as e:
+                return jsonify({'success': False, 'error': f'Invalid waypoints: {e}'}), 400
+            if not points:
+                return jsonify({'success': False, 'error': 'No waypoints'}), 400
+            position = self.controller.get_current_position()
+            start = [position[axis] for axis in ('x', 'y', 'z')][:len(points[0])] if position else None
+            model = self.controller.get_motion_model()
+            try:
+                feed = parse_feed(options.get('feed'))
+                order = plan_path(points, model, start=start, feed=feed)
+            except ValueError as e:
+                return jsonify({'success': False, 'error': str(e)}), 400
+            return jsonify({'success': True, 'order': order,
+                            'listed_seconds': round(path_time(points, range(len(points)), model, start, feed), 3),
+                            'planned_seconds': round(path_time(points, order, model, start, feed), 3)})
+
         @self.app.route('/api/feed_rate', methods=['POST'])
         def set_feed_rate():
             rate_type = request.json.get('rate_type')
@@ -232,6 +928,8 @@ class TheSmallComparatorFlaskGUI:
                 self.comm.set_feed(2000)
             elif command == 'set_origin':
                 self.comm.set_origin()
+                # The part alignment was measured in the old work coordinates
+                self.alignment = None
             elif command == 'set_relative':
                 self.comm.set_relative_mode()
             elif command == 'send_command':
@@ -240,6 +938,13 @@ class TheSmallComparatorFlaskGUI:
                 if raw_command:
                     response = self.comm.send_command(raw_command)
                     return jsonify({'success': True, 'response': response, 'command_sent': raw_command})
+            elif command in ('feed_hold', 'cycle_start', 'jog_cancel'):
+                # GRBL realtime commands skip the command queue
+                realtime_bytes = {'feed_hold': b'!', 'cycle_start': b'~', 'jog_cancel': b'\x85'}
+                if not hasattr(self.comm, 'send_realtime'):
+                    return jsonify({'success': False, 'message': f'{command} is not supported in {self.mode} mode'}), 400
+                response = self.comm.send_realtime(realtime_bytes[command])
+                return jsonify({'success': response is not None, 'response': response})
             elif command == 'reset_alarm':
                 # Reset alarm state when machine is in alarm condition (like ALARM:2)
                 status = self.comm.reset_alarm_state()
@@ -317,56 +1022,146 @@ class TheSmallComparatorFlaskGUI:
             if pos and 'x' in pos and 'y' in pos:
                 point_x = pos['x']
                 point_y = pos['y']
-                
-                # Calculate differences
-                if self.prev_point_x != 0.0 or self.prev_point_y != 0.0:
-                    self.difference_x = point_x - self.prev_point_x
-                    self.difference_y = point_y - self.prev_point_y
-                    self.difference_distance = ((self.difference_x ** 2) + (self.difference_y ** 2)) ** 0.5
-                else:
-                    self.difference_x = 0.0
-                    self.difference_y = 0.0
-                    self.difference_distance = 0.0
-                
-                # Update previous point
-                self.prev_point_x = point_x
-                self.prev_point_y = point_y
-                
-                # Add to recorded points list
-                self.recorded_points.append({'x': point_x, 'y': point_y})
-                
-                # Add to DXF
-                self.dxf_handler.add_point(point_x, point_y)
+                differences = self.record_measurement_point(point_x, point_y, status=pos)
+                self.record_program_step('point', pos)
+                datum = self.get_datum()
                 
                 return jsonify({
                     'success': True, 
                     'point': {'x': point_x, 'y': point_y},
-                    'differences': {
-                        'x': self.difference_x,
-                        'y': self.difference_y,
-                        'distance': self.difference_distance
-                    }
+                    'part_point': dict(zip(('x', 'y'), datum.to_part(point_x, point_y)[:2])) if datum else None,
+                    'differences': differences
                 })
             else:
                 return jsonify({'success': False, 'message': 'Could not get current position'}), 400
         
         @self.app.route('/api/recorded_points')
         def get_recorded_points():
-            return jsonify(self.recorded_points)
+            return jsonify(self.state.measurement.get_points())
         
         @self.app.route('/api/export_dxf', methods=['POST'])
         def export_dxf():
             filename = request.json.get('filename', 'theSmallComparator.dxf')
-            success = self.dxf_handler.export_dxf(filename)
+            success = self.state.measurement.export_dxf(filename)
             if success:
                 return jsonify({'success': True, 'message': f'DXF exported to {filename}'})
             else:
                 return jsonify({'success': False, 'message': 'Failed to export DXF'}), 400
+
+        @self.app.route('/api/export/<export_format>')
+        def export_points(export_format):
+            """Stream recorded points as a chunked download (csv, jsonl, svg or npz)"""
+            if export_format not in EXPORT_FORMATS:
+                return jsonify({
+                    'success': False,
+                    'message': f'Unsupported export format: {export_format}',
+                    'formats': list(EXPORT_FORMATS)
+                }), 400
+
+            # Snapshot the list so points recorded during the download don't change it
+            points = self.state.measurement.get_points()
+            exporter = PointExporter(points, metadata=self.get_export_metadata(points))
+            mimetype, extension = EXPORT_FORMATS[export_format]
+            filename = f"theSmallComparator_{datetime.now().strftime('%Y%m%d-%H%M%S')}.{extension}"
+            return Response(
+                stream_with_context(exporter.stream(export_format)),
+                mimetype=mimetype,
+                headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+            )
         
+        @self.app.route('/api/sessions', methods=['GET', 'POST'])
+        def sessions():
+            """List sessions (GET, filter by part/since/until) or start a new one (POST)"""
+            if request.method == 'GET':
+                part = request.args.get('part')
+                since = request.args.get('since', type=float)
+                until = request.args.get('until', type=float)
+                limit = request.args.get('limit', 50, type=int)
+                return jsonify({
+                    'success': True,
+                    'current_session_id': self.state.measurement.session_id,
+                    'sessions': self.session_store.list_sessions(part=part, since=since, until=until, limit=limit)
+                })
+
+            data = request.json or {}
+            session_id = self.start_session(name=data.get('name'), part=data.get('part'))
+            return jsonify({'success': True, 'session': self.session_store.get_session(session_id)})
+
+        @self.app.route('/api/sessions/current')
+        def current_session():
+            session_id = self.state.measurement.session_id
+            if session_id is None:
+                return jsonify({'success': True, 'session': None})
+            return jsonify({'success': True, 'session': self.session_store.get_session(session_id)})
+
+        @self.app.route('/api/sessions/<int:session_id>/resume', methods=['POST'])
+        def resume_session(session_id):
+            session = self.resume_session(session_id)
+            if session is None:
+                return jsonify({'success': False, 'message': f'Session {session_id} not found'}), 404
+            return jsonify({'success': True, 'session': session})
+
+        @self.app.route('/api/sessions/<int:session_id>/close', methods=['POST'])
+        def close_session(session_id):
+            with self.session_lock:
+                self.session_store.close_session(session_id)
+                if session_id == self.state.measurement.session_id:
+                    self.state.measurement.reset()
+            return jsonify({'success': True, 'message': f'Session {session_id} closed'})
+
+        @self.app.route('/api/sessions/<int:session_id>/points')
+        def session_points(session_id):
+            """Stream the stored points of any session as JSON Lines"""
+            since = request.args.get('since', type=float)
+            until = request.args.get('until', type=float)
+            points = self.session_store.iter_points(session_id, since=since, until=until)
+            return Response(stream_with_context(json.dumps(p) + '\n' for p in points),
+                            mimetype='application/x-ndjson')
+
+        @self.app.route('/api/sessions/capture_image', methods=['POST'])
+        def capture_session_image():
+            """Store the current camera frame in the current session"""
+            measurement = self.state.measurement
+            session_id = self.ensure_session()
+            import cv2 as cv
+            view = self.frames.latest()
+            if view is None:
+                return jsonify({'success': False, 'message': 'No camera frame available'}), 400
+            with view:
+                captured = view.timestamp
+                ret, buffer = cv.imencode('.jpg', view.array)
+            if not ret:
+                return jsonify({'success': False, 'message': 'Could not encode frame'}), 500
+            # Where the stage was when the frame was captured, once a status report after it is in
+            self.controller.get_machine_status()
+            position = self.controller.position_at(captured)
+            if position is None:
+                position = {'x': measurement.prev_point_x, 'y': measurement.prev_point_y}
+            self.session_store.add_image(session_id, buffer.tobytes(), position=position)
+            if 'z' in position:
+                self.record_program_step('image', position)
+            return jsonify({'success': True, 'session_id': session_id})
+
+        @self.app.route('/api/sessions/<int:session_id>/images')
+        def session_images(session_id):
+            since = request.args.get('since', type=float)
+            until = request.args.get('until', type=float)
+            return jsonify({'success': True,
+                            'images': self.session_store.list_images(session_id, since=since, until=until)})
+
+        @self.app.route('/api/sessions/images/<int:image_id>')
+        def session_image(image_id):
+            image = self.session_store.get_image(image_id)
+            if image is None:
+                return jsonify({'success': False, 'message': f'Image {image_id} not found'}), 404
+            mimetype, data = image
+            return Response(data, mimetype=mimetype)
+
         @self.app.route('/api/test_camera', methods=['POST'])
         def test_camera():
-            camera_index = int(request.json.get('camera_index', -1))
-            if camera_index < 0:
+            data = request.json or {}
+            camera_index = data.get('camera_source') or int(data.get('camera_index', -1))
+            if camera_index == -1:
                 return jsonify({'success': False, 'message': 'No camera index provided'}), 400
             
             # Test the specific camera
@@ -394,11 +1189,15 @@ class TheSmallComparatorFlaskGUI:
                 # For GRBL, check if serial port is open
                 is_connected = self.comm.ser is not None and self.comm.ser.is_open
 
+            differences = self.state.measurement.get_differences()
             return jsonify({
                 'connected': is_connected,
                 'status': status,
                 'mode': self.mode,
-                'klipper_info': klipper_info
+                'klipper_info': klipper_info,
+                'difference_x': differences['x'],
+                'difference_y': differences['y'],
+                'difference_distance': differences['distance']
             })
             
         @self.app.route('/api/klipper/settings', methods=['GET', 'POST'])
@@ -493,6 +1292,7 @@ class TheSmallComparatorFlaskGUI:
                 # Schedule a delayed restart to allow the response to be sent
                 def delayed_restart():
                     time.sleep(1)  # Wait 1 second to ensure response is sent
+                    self.session_store.close()  # Commit pending session writes
                     os.kill(os.getpid(), signal.SIGTERM)  # Terminate the current process
 
                 import threading
@@ -517,6 +1317,7 @@ class TheSmallComparatorFlaskGUI:
                 # Schedule a delayed shutdown to allow the response to be sent
                 def delayed_shutdown():
                     time.sleep(30)  # Wait 30 seconds before shutting down
+                    self.session_store.close()  # Commit pending session writes
                     os.kill(os.getpid(), signal.SIGTERM)  # Terminate the current process
 
                 import threading
@@ -629,57 +1430,487 @@ class TheSmallComparatorFlaskGUI:
             """Route for the calibration/settings page"""
             return render_template('calibration.html')
 
+    def get_pixel_mapping(self):
+        """
+        Returns:
+            PixelMapping: The camera calibration, or None if the camera was never calibrated
+        """
+        if self.pixel_mapping is None:
+            from camera_calibration import load_mapping
+            self.pixel_mapping = load_mapping(CAMERA_CALIBRATION_PATH)
+        return self.pixel_mapping
+
+    def _start_motion_job(self, target, finished, name):
+        """
+        Run a motion job on its own thread; the caller holds motion_job_lock, released when it ends
+
+        Args:
+            target (callable): Runs the job and returns its final status
+            finished (callable): Called with the final status
+            name (str): Thread name
+        """
+        def run():
+            try:
+                status = target()
+            finally:
+                self.motion_job_lock.release()
+            finished(status)
+
+        threading.Thread(target=run, name=name, daemon=True).start()
+
+    def get_program_store(self):
+        """
+        Returns:
+            ProgramStore: Recorded measurement programs, opened on first use
+        """
+        if self.program_store is None:
+            from measurement_program import ProgramStore
+            self.program_store = ProgramStore(PROGRAMS_DIR)
+        return self.program_store
+
+    def make_program_runner(self, program, datum, session_id, feed=None, max_residual=0.05):
+        """
+        Runner for a program on one part: points go to the session and drawing, images to
+        the session, and programs with alignment features align the part from `datum` first
+
+        Returns:
+            ProgramRunner: The runner, not started
+        """
+        from measurement_program import ProgramRunner
+
+        def store_image(jpeg, position):
+            self.session_store.add_image(session_id, jpeg, position=position)
+
+        def refocus(step):
+            from autofocus import Autofocus
+            try:
+                focus = Autofocus(self.controller, self.frames, method=step.get('method', 'laplacian'))
+                result = focus.run(sweep_range=float(step.get('range', 2.0)))
+            except ValueError as e:
+                raise RuntimeError(f"Autofocus step: {e}")
+            if not result['success']:
+                raise RuntimeError(f"Autofocus failed: {result.get('error')}")
+            return result['z']
+
+        align = None
+        if program.get('alignment'):
+            align = lambda: self.align(program['alignment'], datum, float(max_residual))
+        return ProgramRunner(program, self.controller, self.frames, datum, mapping=self.get_pixel_mapping(),
+                             feed=feed, on_point=lambda x, y, status: self.record_measurement_point(x, y, status=status),
+                             on_image=store_image, autofocus=refocus, align=align)
+
+    def get_datum(self):
+        """
+        Returns:
+            Datum: The current part alignment, or None if the part is not aligned
+        """
+        alignment = self.alignment
+        if alignment is None:
+            return None
+        from measurement_program import Datum
+        return Datum(**alignment['datum'])
+
+    def align(self, features, guess, max_residual=0.05):
+        """
+        Locate the features with the camera and make the solved datum the part alignment
+
+        Returns:
+            Datum: The part's datum
+        """
+        from alignment import align_part, validate_features
+        result = align_part(self.controller, self.frames, self.get_pixel_mapping(), features, guess,
+                            max_residual=max_residual)
+        # The nominal features are kept for programs recorded on this alignment
+        self.alignment = dict(result, nominal=validate_features(features))
+        return self.get_datum()
+
+    def record_program_step(self, action, position, **options):
+        """Add an operator action to the program being recorded, if any"""
+        recorder = self.recorder
+        if recorder is not None:
+            recorder.record(action, position, **options)
+
+    def _trace_finished(self, status):
+        """Add a traced contour to the drawing"""
+        points = [(point['x'], point['y']) for point in status['points']]
+        if len(points) >= 2:
+            self.state.measurement.add_polyline(points, closed=status['closed'])
+
+    def get_session_state(self):
+        """Get the application state saved with the current session"""
+        _, camera_index = self.state.camera.get()
+        return {
+            **self.state.measurement.get_state(),
+            'jog_distance': self.controller.jog_distance,
+            'feed_rate': self.controller.current_feed_rate,
+            'camera_index': camera_index,
+            'mode': self.mode,
+        }
+
+    def start_session(self, name=None, part=None):
+        """
+        Close the current session and start recording into a new one
+
+        Args:
+            name (str): Session name
+            part (str): Part identifier
+
+        Returns:
+            int: ID of the new session
+        """
+        with self.session_lock:
+            return self._start_session(name=name, part=part)
+
+    def _start_session(self, name=None, part=None):
+        """Start a new session, the caller holds session_lock"""
+        measurement = self.state.measurement
+        if measurement.session_id is not None:
+            self.session_store.close_session(measurement.session_id)
+
+        measurement.reset()
+        session_id = self.session_store.create_session(name=name, part=part, state=self.get_session_state())
+        measurement.reset(session_id=session_id)
+        return session_id
+
+    def ensure_session(self):
+        """
+        Get the current session, starting one if none is active
+
+        Returns:
+            int: Current session ID
+        """
+        session_id = self.state.measurement.session_id
+        if session_id is not None:
+            return session_id
+        with self.session_lock:
+            # Another request may have started it while we waited for the lock
+            session_id = self.state.measurement.session_id
+            if session_id is None:
+                session_id = self._start_session()
+            return session_id
+
+    def resume_session(self, session_id):
+        """
+        Make a stored session current. Only the session summary is read here,
+        so this returns immediately; points are loaded back in the background.
+
+        Args:
+            session_id (int): Session ID
+
+        Returns:
+            dict: Session summary or None if not found
+        """
+        session = self.session_store.get_session(session_id)
+        if session is None:
+            return None
+
+        state = session['state']
+        state.setdefault('prev_point_x', session['last_x'] or 0.0)
+        state.setdefault('prev_point_y', session['last_y'] or 0.0)
+        with self.session_lock:
+            self.state.measurement.reset(session_id=session_id, point_count=session['point_count'], state=state)
+            self.controller.set_jog_distance(state.get('jog_distance', self.controller.jog_distance))
+            self.controller.current_feed_rate = state.get('feed_rate', self.controller.current_feed_rate)
+
+        threading.Thread(target=self._load_session_points, args=(session_id,), daemon=True).start()
+        logger.info(f"Resumed session {session_id} ({session['point_count']} points)")
+        return session
+
+    def _load_session_points(self, session_id):
+        """Rebuild the in-memory point list and DXF drawing of a resumed session"""
+        points = []
+        dxf_handler = DXFHandler()
+        for point in self.session_store.iter_points(session_id):
+            if self.state.measurement.session_id != session_id:
+                return  # Another session was started or resumed meanwhile
+            points.append({'x': point['x'], 'y': point['y']})
+            dxf_handler.add_point(point['x'], point['y'])
+
+        if self.state.measurement.prepend_loaded_points(session_id, points, dxf_handler):
+            logger.info(f"Loaded {len(points)} points for session {session_id}")
+
+    def record_measurement_point(self, x, y, status=None):
+        """
+        Record a point in the current session, update differences and add it to the DXF
+
+        Returns:
+            dict: Differences to the previous point
+        """
+        self.ensure_session()
+        differences, session_id, seq = self.state.measurement.record_point(x, y)
+        self.persist_point(session_id, seq, x, y, status=status)
+        return differences
+
+    def persist_point(self, session_id, seq, x, y, status=None):
+        """
+        Queue a recorded point and the machine state for a session
+
+        Args:
+            session_id (int): Session the point was recorded in
+            seq (int): Sequence number of the point in the session
+            x (float): X coordinate
+            y (float): Y coordinate
+            status: Raw machine status the point was taken from
+        """
+        if session_id is None:
+            return
+        self.session_store.add_point(session_id, seq, x, y)
+        state = self.get_session_state()
+        self.session_store.add_machine_state(session_id, self.mode, str(status), state=state)
+        self.session_store.update_session_state(session_id, state)
+
+    def get_export_metadata(self, points):
+        """
+        Build the scan metadata attached to exported points
+
+        Args:
+            points (list): Points being exported
+
+        Returns:
+            dict: Metadata dictionary
+        """
+        return {
+            'source': 'theSmallComparator',
+            'exported_at': datetime.now().isoformat(),
+            'mode': self.mode,
+            'camera_index': self.state.camera.get()[1],
+            'feed_rate': self.controller.current_feed_rate,
+            'session_id': self.state.measurement.session_id,
+            'point_count': len(points),
+            'bounds': PointExporter(points).get_bounds(),
+        }
+
     def update_frames(self):
-        """Continuously update frames from camera"""
+        """
+        Continuously capture frames from the camera into the frame ring.
+
+        Frames are read straight into a ring slot when the camera delivers
+        the stream size. A larger camera is read into the native-resolution
+        ring (kept for region-of-interest streams) and resized into the
+        slot, so the loop allocates nothing per frame.
+        """
+        capture_rate = metrics.RateMeter(metrics.CAPTURE_FPS)
+        ring = self.frames
+        blank_published = False
         while self.running:
-            if self.camera is not None and self.camera.isOpened():
-                ret, frame = self.camera.read()
+            camera, _ = self.state.camera.get()
+            slot = ring.begin_write()
+            if slot is None:
+                # Every slot is held by a reader; skip this frame rather than wait
+                metrics.FRAME_RING_OVERRUNS.inc()
+            elif camera is not None and camera.isOpened():
+                ret = self._capture_frame(camera, slot)
                 if ret:
-                    with self.frame_lock:
-                        # Resize frame to desired resolution for performance
-                        if frame.shape[0] != 480 or frame.shape[1] != 640:
-                            frame = cv.resize(frame, (640, 480))
-                        self.current_frame = frame
+                    ring.commit(timestamp=ret)
+                    blank_published = False
+                    startup_profiler.mark('first_frame', write=True)
+                    metrics.CAPTURE_FRAMES.inc()
+                    capture_rate.tick()
+                else:
+                    ring.abort()
+                    if ret is not None:
+                        metrics.CAPTURE_FAILURES.inc()
             else:
-                # Use a dummy frame if no camera is available
-                with self.frame_lock:
-                    self.current_frame = np.zeros((480, 640, 3), dtype=np.uint8)
+                # Show black once the camera is gone instead of freezing on its last frame
+                if not blank_published:
+                    slot.fill(0)
+                    ring.commit(blank=True)
+                    blank_published = True
+                else:
+                    ring.abort()
+                self.native_frames = None
+                metrics.CAPTURE_FPS.set(0)
             time.sleep(1/15)  # 15 FPS
+
+    def _capture_frame(self, camera, slot):
+        """
+        Read one frame into a frame ring slot
+
+        Args:
+            camera: Active camera source
+            slot (numpy.ndarray): Reserved frame ring buffer
+
+        Returns:
+            float: Capture time (time.monotonic(), taken when the read returned) if the slot
+                was filled, False on a failed read, None if the frame was skipped because the
+                native ring was full
+        """
+        import cv2 as cv
+        import numpy as np
+        native = self.native_frames
+        target = slot
+        if native is not None:
+            target = native.begin_write()
+            if target is None:
+                metrics.FRAME_RING_OVERRUNS.inc()
+                return None
+        with metrics.CAPTURE_READ_SECONDS.time():
+            ret, frame = camera.read(target)
+        # Stamp the frame before the resize so its time is as close to the exposure as we can see
+        captured = time.monotonic()
+        if not ret:
+            if native is not None:
+                native.abort()
+            return False
+        if frame is not target:
+            # The camera's resolution differs from the buffer's: keep its full-resolution
+            # frames in their own ring from now on (allocates once per resolution change)
+            if native is not None:
+                native.abort()
+            native = self.native_frames = FrameRing(slots=NATIVE_RING_SLOTS, shape=frame.shape)
+            target = native.begin_write()
+            np.copyto(target, frame)
+        if target is not slot:
+            cv.resize(target, (FRAME_WIDTH, FRAME_HEIGHT), dst=slot)
+            native.commit(timestamp=captured)
+        return captured
     
-    def generate_frames(self):
-        """Generate frames for the video feed"""
-        while True:
-            with self.frame_lock:
-                frame = self.current_frame.copy()
-            
-            # Draw crosshair for target
-            h, w = frame.shape[:2]
-            center_x, center_y = w // 2, h // 2
-            
-            # Draw crosshair
-            cv.line(frame, (center_x - 20, center_y), (center_x + 20, center_y), (0, 0, 255), 1)
-            cv.line(frame, (center_x, center_y - 20), (center_x, center_y + 20), (0, 0, 255), 1)
-            
-            # Encode frame as JPEG
-            ret, buffer = cv.imencode('.jpg', frame)
-            if ret:
-                frame_bytes = buffer.tobytes()
+    def generate_frames(self, settings=None):
+        """
+        Generate frames for the video feed
+
+        Args:
+            settings (StreamSettings): Size, quality, rate and adaptation for this client;
+                defaults to the full-size stream
+        """
+        from stream_encoder import StreamSettings, pace
+        settings = settings or StreamSettings((FRAME_WIDTH, FRAME_HEIGHT))
+        metrics.STREAM_CLIENTS.inc()
+        with self.streams_lock:
+            self.streams[id(settings)] = settings
+        try:
+            if self.pipeline is not None and settings.is_default:
+                jpegs = self._pipeline_jpegs()
+            else:
+                jpegs = self._encode_frames(settings)
+            for frame_bytes, frame_is_live in jpegs:
+                started = time.perf_counter()
+                if frame_is_live:
+                    startup_profiler.mark('first_stream_frame', write=True)
                 yield (b'--frame\r\n'
                        b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-            time.sleep(0.03)  # ~30 FPS cap to prevent overwhelming the client
+                # The generator resumes once the server has written the frame to the client
+                settings.record_write(time.perf_counter() - started, len(frame_bytes))
+                metrics.STREAM_FRAMES_SENT.inc()
+                pace(started, settings.interval)
+        finally:
+            with self.streams_lock:
+                self.streams.pop(id(settings), None)
+            metrics.STREAM_CLIENTS.dec()
+
+    def _encode_frames(self, settings):
+        """
+        JPEGs of frames from the frame ring at the client's current tier,
+        encoded once per tier and shared with other clients on it. Region
+        of interest streams crop the native-resolution frames when the
+        camera is larger than the stream size.
+
+        Yields:
+            tuple: (JPEG bytes, whether the frame came from a camera)
+        """
+        ring = None
+        tier = None
+        last_seq = 0
+        try:
+            while not self.stop_event.is_set():
+                source = self.native_frames if settings.roi is not None else None
+                source = source or self.frames
+                if source is not ring:
+                    ring = source
+                    last_seq = 0
+                current = settings.tier_for(ring.shape)
+                if current != tier:
+                    if tier is not None:
+                        self.stream_encoder.detach(tier)
+                    tier = current
+                    self.stream_encoder.attach(tier)
+                # Wait for a new frame (re-sending the last one now and then keeps the connection
+                # alive); until the first capture, send black without waiting
+                view = ring.wait_newer(last_seq, timeout=1.0 if last_seq else 0) or ring.latest()
+                if view is None:
+                    frame_bytes = self.stream_encoder.encode(tier, None, 0)
+                    frame_is_live = False
+                else:
+                    with view:
+                        frame_bytes = self.stream_encoder.encode(tier, view.array, (view.seq, view.timestamp))
+                    frame_is_live = not view.blank
+                    # Captured frames that were replaced before this client got to them
+                    if last_seq and view.seq - last_seq > 1:
+                        metrics.STREAM_FRAMES_DROPPED.inc(view.seq - last_seq - 1)
+                    last_seq = view.seq
+                if frame_bytes is not None:
+                    yield frame_bytes, frame_is_live
+        finally:
+            if tier is not None:
+                self.stream_encoder.detach(tier)
+
+    def _pipeline_jpegs(self):
+        """
+        JPEGs encoded once per frame by the pipeline's encoder process
+
+        Yields:
+            tuple: (JPEG bytes, whether the frame came from a camera)
+        """
+        import cv2 as cv
+        import numpy as np
+        from frame_pipeline import draw_crosshair
+        placeholder = np.zeros((FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8)
+        draw_crosshair(placeholder)
+        placeholder = cv.imencode('.jpg', placeholder)[1].tobytes()
+        last_seq = 0
+        last_frame_seq = 0
+        latest = None
+        while not self.stop_event.is_set():
+            encoded = self.pipeline.wait_jpeg(last_seq, timeout=1.0 if last_seq else 0)
+            if encoded is not None:
+                last_seq, frame_seq, frame_bytes, encode_seconds = encoded
+                with self.streams_lock:
+                    first = last_seq > self._observed_jpeg_seq
+                    if first:
+                        self._observed_jpeg_seq = last_seq
+                if first:
+                    metrics.FRAME_ENCODE_SECONDS.observe(encode_seconds)
+                if last_frame_seq and abs(frame_seq) - last_frame_seq > 1:
+                    metrics.STREAM_FRAMES_DROPPED.inc(abs(frame_seq) - last_frame_seq - 1)
+                last_frame_seq = abs(frame_seq)
+                latest = (frame_bytes, frame_seq > 0)
+            yield latest if latest is not None else (placeholder, False)
     
-    def run(self, host='0.0.0.0', port=5000, debug=False):
-        """Run the Flask application"""
-        # Run the Flask app
-        self.app.run(host=host, port=port, debug=debug, threaded=True)
+    def shutdown(self):
+        """Stop the video streams and capture thread and commit pending session writes"""
+        self.stop_event.set()
+        self.running = False
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        self.session_store.close()
+
+    def run(self, host='0.0.0.0', port=5000, debug=False, server='development'):
+        """
+        Run the Flask application
+
+        Args:
+            host (str): Interface to bind
+            port (int): Port to bind
+            debug (bool): Flask debug mode (development server only)
+            server (str): 'development' for the Flask server, 'production' for
+                bounded thread pools with video streams isolated from the API
+        """
+        startup_profiler.mark('server_start')
+        if server == 'production':
+            from wsgi_server import serve_production
+            serve_production(self.app, host=host, port=port, on_shutdown=self.shutdown)
+        else:
+            # Run the Flask app
+            self.app.run(host=host, port=port, debug=debug, threaded=True)
 
 
-def main():
+def main(server='development', camera_source=None, pipeline=False):
     """Main function to run the Flask GUI"""
-    gui = TheSmallComparatorFlaskGUI()
-    print("Starting theSmallComparator Flask GUI...")
+    app_logging.setup_logging()
+    gui = TheSmallComparatorFlaskGUI(camera_source=camera_source, pipeline=pipeline)
+    print(f"Starting theSmallComparator Flask GUI ({server} server)...")
     print("Access the interface at: http://localhost:5001 or http://[RPI_IP]:5001")
-    gui.run(host='0.0.0.0', port=5001, debug=False)
+    gui.run(host='0.0.0.0', port=5001, debug=False, server=server)
 
 
 if __name__ == "__main__":
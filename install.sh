@@ -298,7 +298,7 @@ Group=$USER
 WorkingDirectory=$PROJECT_ROOT
 Environment=PATH=/usr/bin
 Environment=PYTHONPATH=$PROJECT_ROOT
-ExecStart=$PROJECT_ROOT/venv/bin/python3 $PROJECT_ROOT/main.py
+ExecStart=$PROJECT_ROOT/venv/bin/python3 $PROJECT_ROOT/main.py --production
 Restart=always
 RestartSec=10
 StandardOutput=journal
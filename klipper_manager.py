@@ -6,20 +6,47 @@ Handles communication with Klipper via Moonraker API
 import requests
 import logging
 import time
+from metrics import MOONRAKER_REQUEST_SECONDS, MOONRAKER_REQUEST_FAILURES
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.klipper')
 
 class KlipperManager:
     """
     Class to handle communication with Klipper via Moonraker API
     """
+
+    backend_name = "Klipper"
     
     def __init__(self, host='localhost', port=7125):
         self.base_url = f"http://{host}:{port}"
         self.connected = False
         self.printer_info = None
 
+    def _request(self, method, path, **kwargs):
+        """
+        Send an HTTP request to Moonraker, recording its latency per endpoint
+
+        Args:
+            method (str): 'GET' or 'POST'
+            path (str): Path with optional query string, e.g. '/printer/info'
+
+        Returns:
+            requests.Response: The response (exceptions are re-raised)
+        """
+        endpoint = path.split('?', 1)[0]
+        started = time.perf_counter()
+        try:
+            response = requests.request(method, f"{self.base_url}{path}", **kwargs)
+        except requests.exceptions.RequestException:
+            MOONRAKER_REQUEST_FAILURES.labels(endpoint).inc()
+            raise
+        MOONRAKER_REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+        if response.status_code != 200:
+            MOONRAKER_REQUEST_FAILURES.labels(endpoint).inc()
+        return response
+
     def connect(self):
         """
         Check connection to Moonraker and get printer info
@@ -28,18 +55,18 @@ class KlipperManager:
             bool: True if connected, False otherwise
         """
         try:
-            logging.info(f"Attempting to connect to Moonraker at {self.base_url}")
-            response = requests.get(f"{self.base_url}/printer/info", timeout=2)
+            logger.info(f"Attempting to connect to Moonraker at {self.base_url}")
+            response = self._request('GET', "/printer/info", timeout=2)
             if response.status_code == 200:
                 self.printer_info = response.json().get('result', {})
                 self.connected = True
-                logging.info(f"Connected to Klipper: {self.printer_info}")
+                logger.info(f"Connected to Klipper: {self.printer_info}")
                 return True
             else:
-                logging.warning(f"Moonraker responded with status {response.status_code}")
+                logger.warning(f"Moonraker responded with status {response.status_code}")
                 return False
         except requests.exceptions.RequestException as e:
-            logging.error(f"Could not connect to Moonraker: {e}")
+            logger.error(f"Could not connect to Moonraker: {e}")
             self.connected = False
             return False
 
@@ -62,21 +89,21 @@ class KlipperManager:
             if not gcode:
                 return None
                 
-            logging.debug(f"Sending G-code to Klipper: {gcode}")
+            logger.debug(f"Sending G-code to Klipper: {gcode}")
             
             # Use printer/gcode/script endpoint
-            response = requests.post(f"{self.base_url}/printer/gcode/script", 
-                                   json={'script': gcode}, 
-                                   timeout=5)
+            response = self._request('POST', "/printer/gcode/script",
+                                     json={'script': gcode},
+                                     timeout=5)
             
             if response.status_code == 200:
                 return "ok"
             else:
-                logging.error(f"Klipper G-code error {response.status_code}: {response.text}")
+                logger.error(f"Klipper G-code error {response.status_code}: {response.text}")
                 return f"Error: {response.text}"
                 
         except Exception as e:
-            logging.error(f"Error sending G-code to Klipper: {e}")
+            logger.error(f"Error sending G-code to Klipper: {e}")
             return None
 
     def get_machine_status(self):
@@ -91,20 +118,25 @@ class KlipperManager:
             return None
             
         try:
-            # Query toolhead position
-            response = requests.get(f"{self.base_url}/printer/objects/query?toolhead", timeout=2)
+            # Query toolhead position, and motion_report for where the toolhead actually is
+            response = self._request('GET', "/printer/objects/query?toolhead&motion_report", timeout=2)
             if response.status_code == 200:
                 data = response.json()
-                toolhead = data.get('result', {}).get('status', {}).get('toolhead', {})
+                objects = data.get('result', {}).get('status', {})
+                toolhead = objects.get('toolhead', {})
+                motion = objects.get('motion_report', {})
                 
-                # Extract position
-                pos = toolhead.get('position', [0, 0, 0, 0])
+                # Extract position: toolhead.position is the end of the queued moves, so
+                # prefer the live position while moving
+                pos = motion.get('live_position') or toolhead.get('position', [0, 0, 0, 0])
                 x, y, z = pos[0], pos[1], pos[2]
                 
                 # Extract state (approximate mapping)
                 status = toolhead.get('status', 'Idle')
                 if status == 'Ready': status = 'Idle'
                 elif status == 'Printing': status = 'Run'
+                if motion.get('live_velocity', 0.0) > 0.001:
+                    status = 'Run'
                 
                 # Format like GRBL: <Status|MPos:X,Y,Z|FS:Feed,Spindle>
                 # Klipper doesn't easily give current feedrate in this query, defaulting to 0
@@ -112,7 +144,7 @@ class KlipperManager:
             
             return None
         except Exception as e:
-            logging.error(f"Error getting Klipper status: {e}")
+            logger.error(f"Error getting Klipper status: {e}")
             return None
 
     def get_rotation_distance(self):
@@ -126,7 +158,7 @@ class KlipperManager:
             return None
             
         try:
-            response = requests.get(f"{self.base_url}/printer/objects/query?configfile", timeout=5)
+            response = self._request('GET', "/printer/objects/query?configfile", timeout=5)
             if response.status_code == 200:
                 config = response.json().get('result', {}).get('status', {}).get('configfile', {}).get('settings', {})
                 
@@ -140,7 +172,28 @@ class KlipperManager:
                 return rot_dist
             return None
         except Exception as e:
-            logging.error(f"Error getting config: {e}")
+            logger.error(f"Error getting config: {e}")
+            return None
+
+    def get_motion_limits(self):
+        """
+        Get the [printer] section of the config (max_velocity, max_accel,
+        max_z_velocity, max_z_accel) for estimating move times
+
+        Returns:
+            dict: The section's settings, or None
+        """
+        if not self.connected:
+            return None
+
+        try:
+            response = self._request('GET', "/printer/objects/query?configfile", timeout=5)
+            if response.status_code == 200:
+                config = response.json().get('result', {}).get('status', {}).get('configfile', {}).get('settings', {})
+                return config.get('printer')
+            return None
+        except Exception as e:
+            logger.error(f"Error getting config: {e}")
             return None
 
     def update_rotation_distance(self, axis, new_value):
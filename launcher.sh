@@ -102,7 +102,8 @@ echo -e "${GREEN}Starting theSmallComparator manually...${NC}"
 echo -e "${YELLOW}Press Ctrl+C to stop.${NC}"
 
 if [ -f "$VENV_PYTHON" ] && [ -f "$APP_ENTRY" ]; then
-    "$VENV_PYTHON" "$APP_ENTRY"
+    # Extra arguments (e.g. --production) are passed on to main.py
+    "$VENV_PYTHON" "$APP_ENTRY" "$@"
 else
     echo -e "${RED}Error: Virtual environment or application entry point not found.${NC}"
     echo -e "Expected python: $VENV_PYTHON"
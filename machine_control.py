@@ -4,11 +4,218 @@ Handles machine control functions like jogging, homing, etc.
 """
 
 from serial_comm import SerialCommunicator
+from metrics import STATUS_POLL_SECONDS, STATUS_POLL_FAILURES
+import bisect
+import threading
 import time
 import logging
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.machine')
+
+
+def parse_status(status):
+    """
+    Parse a GRBL-style status report (Klipper mode reports the same format)
+
+    Args:
+        status (str): Report such as "<Idle|MPos:1.000,2.000,0.500|FS:0,0>"
+
+    Returns:
+        dict: 'state', 'x', 'y', 'z' (machine position), or None if the report has no position
+    """
+    if not status or not isinstance(status, str):
+        return None
+    fields = status.strip().strip('<>').split('|')
+    for field in fields[1:]:
+        name, _, value = field.partition(':')
+        if name == 'MPos':
+            try:
+                x, y, z = (float(v) for v in value.split(',')[:3])
+            except ValueError:
+                return None
+            return {'state': fields[0].split(':')[0], 'x': x, 'y': y, 'z': z}
+    return None
+
+
+class PositionHistory:
+    """
+    Machine positions from status reports, each stamped with time.monotonic()
+    at the middle of its query round trip, the same clock the frame ring
+    stamps frames with. Positions in between reports are interpolated, so
+    any frame can be paired with where the stage was when it was captured.
+
+    Entries are dicts with 'x', 'y', 'z', 'state' and 'timestamp'; the list
+    interface (append, len, indexing) is kept for existing callers.
+    """
+
+    def __init__(self, maxlen=4096):
+        """
+        Args:
+            maxlen (int): Reports kept (about 80 s of history at a 50 Hz poll)
+        """
+        self.maxlen = maxlen
+        self._entries = []
+        self._times = []
+        self._cond = threading.Condition(threading.Lock())
+
+    def append(self, position):
+        """
+        Add a report; late arrivals (out of timestamp order) are inserted in place
+
+        Args:
+            position (dict): 'x', 'y', 'z' and 'timestamp' (time.monotonic()), optionally 'state'
+        """
+        with self._cond:
+            timestamp = position['timestamp']
+            index = bisect.bisect_right(self._times, timestamp)
+            self._times.insert(index, timestamp)
+            self._entries.insert(index, position)
+            if len(self._entries) > 2 * self.maxlen:
+                # Trim in batches so appending stays cheap
+                del self._times[:-self.maxlen]
+                del self._entries[:-self.maxlen]
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return min(len(self._entries), self.maxlen)
+
+    def __getitem__(self, index):
+        with self._cond:
+            return self._entries[-self.maxlen:][index]
+
+    def __iter__(self):
+        with self._cond:
+            return iter(self._entries[-self.maxlen:])
+
+    def latest(self):
+        """
+        Returns:
+            dict: Newest report, or None
+        """
+        with self._cond:
+            return self._entries[-1] if self._entries else None
+
+    def clear(self):
+        with self._cond:
+            self._entries = []
+            self._times = []
+
+    def between(self, start, end):
+        """
+        Returns:
+            list: Reports with start <= timestamp <= end, oldest first
+        """
+        with self._cond:
+            return self._entries[bisect.bisect_left(self._times, start):bisect.bisect_right(self._times, end)]
+
+    def at(self, timestamp, max_gap=1.0):
+        """
+        Stage position at a moment, interpolated linearly between the reports around it
+
+        Args:
+            timestamp (float): time.monotonic() value, e.g. a frame's timestamp
+            max_gap (float): Reports further apart than this (seconds) are only trusted
+                if the stage did not move between them
+
+        Returns:
+            dict: 'x', 'y', 'z' and 'timestamp', or None if no reports bracket the moment
+        """
+        with self._cond:
+            index = bisect.bisect_left(self._times, timestamp)
+            if index < len(self._times) and self._times[index] == timestamp:
+                before = after = self._entries[index]
+            elif 0 < index < len(self._times):
+                before, after = self._entries[index - 1], self._entries[index]
+            else:
+                return None
+        axes = ('x', 'y', 'z')
+        span = after['timestamp'] - before['timestamp']
+        if span <= 0:
+            return {'x': before['x'], 'y': before['y'], 'z': before['z'], 'timestamp': timestamp}
+        if span > max_gap and any(before[axis] != after[axis] for axis in axes):
+            return None
+        fraction = (timestamp - before['timestamp']) / span
+        position = {axis: before[axis] + (after[axis] - before[axis]) * fraction for axis in axes}
+        position['timestamp'] = timestamp
+        return position
+
+    def wait_until(self, timestamp, timeout=1.0):
+        """
+        Wait for a report stamped after `timestamp`, so at() can interpolate up to it
+
+        Returns:
+            bool: True if such a report arrived within the timeout
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._times and self._times[-1] > timestamp, timeout)
+
+
+class StatusPoller:
+    """
+    Polls the machine status on a background thread while a move runs, so
+    the position history is dense enough to place every frame captured
+    during the move. Usable as a context manager.
+    """
+
+    def __init__(self, controller, interval=0.02):
+        """
+        Args:
+            controller (MachineController): Machine to poll
+            interval (float): Pause between status polls in seconds
+        """
+        self.controller = controller
+        self.interval = interval
+        self.position = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._poll, name='status-poller', daemon=True)
+        self._thread.start()
+        return self
+
+    def _poll(self):
+        while not self._stop.is_set():
+            position = self.controller.get_current_position()
+            if position is not None:
+                self.position = position
+            self._stop.wait(self.interval)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def at_rest(self, x=None, y=None, z=None, tolerance=0.005):
+        """
+        Returns:
+            bool: The latest report says Idle (at the given position, if any)
+        """
+        position = self.position
+        return position is not None and position['state'] == 'Idle' and all(
+            target is None or abs(position[axis] - target) <= tolerance
+            for axis, target in (('x', x), ('y', y), ('z', z)))
+
+    def wait_at_rest(self, timeout, **target):
+        """
+        Returns:
+            bool: True once at_rest(**target), False after the timeout
+        """
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.at_rest(**target):
+                return True
+            time.sleep(self.interval)
+        return False
 
 
 class MachineController:
@@ -26,7 +233,13 @@ class MachineController:
         }
         self.current_feed_rate = self.feed_rates['default']
         self.jog_distance = 10.0  # Default jog distance
-        self.position_history = []
+        # Every parsed status report, for pairing frames with stage positions
+        self.position_history = PositionHistory()
+        # (communicator, MotionModel) read from the machine, see get_motion_model()
+        self._motion_model = None
+        # End position of the last commanded move and when (time.monotonic()) it should be reached
+        self._planned_end = None
+        self._planned_at = 0.0
     
     def set_jog_distance(self, distance):
         """
@@ -38,7 +251,7 @@ class MachineController:
         try:
             self.jog_distance = float(distance)
         except ValueError:
-            print(f"Invalid jog distance: {distance}")
+            logger.warning(f"Invalid jog distance: {distance}")
     
     def set_feed_rate(self, rate_type='default'):
         """
@@ -51,104 +264,119 @@ class MachineController:
             self.current_feed_rate = self.feed_rates[rate_type]
             return self.comm.set_feed(self.current_feed_rate)
         else:
-            print(f"Invalid rate type: {rate_type}")
+            logger.warning(f"Invalid rate type: {rate_type}")
             return None
 
     def send_raw_command(self, raw_command):
         """Send a raw command without homing safety checks for advanced users"""
-        print(f"Sending raw command without safety checks: {raw_command}")
+        logger.info(f"Sending raw command without safety checks: {raw_command}")
         if self.comm and hasattr(self.comm, 'send_raw_command'):
             response = self.comm.send_raw_command(raw_command)
             return response
         else:
-            print("No active serial connection")
+            logger.warning("No active serial connection")
             return None
 
     def get_machine_status(self):
-        """Get current machine status"""
-        if self.comm and hasattr(self.comm, 'get_machine_status'):
-            return self.comm.get_machine_status()
-        else:
-            print("No active serial connection")
-            return None
+        """Get current machine status, recording the position it reports in position_history"""
+        return self._poll_status()[0]
+
+    def _poll_status(self):
+        """
+        Query the status report and record its position
+
+        Returns:
+            tuple: (raw report or None, position dict with 'timestamp' or None)
+        """
+        if not (self.comm and hasattr(self.comm, 'get_machine_status')):
+            logger.warning("No active serial connection")
+            return None, None
+        backend = getattr(self.comm, 'backend_name', type(self.comm).__name__)
+        started = time.monotonic()
+        status = self.comm.get_machine_status()
+        finished = time.monotonic()
+        if status is None:
+            STATUS_POLL_FAILURES.labels(backend).inc()
+            return None, None
+        STATUS_POLL_SECONDS.labels(backend).observe(finished - started)
+        position = parse_status(status)
+        if position is not None:
+            # The report was taken somewhere in the round trip; the middle halves the error
+            position['timestamp'] = (started + finished) / 2
+            self.position_history.append(dict(position))
+        return status, position
     
     def jog_x_positive(self):
         """Jog X axis positive by current jog distance using relative moves"""
         distance = self.jog_distance
         # Use relative mode for single axis move to avoid coordinate issues
         command = f"G91G1F{self.current_feed_rate}X{distance}\rG90"  # Move only X, then return to absolute
-        logging.info(f"Jogging X+ by {distance}mm at feed rate {self.current_feed_rate}")
-        print(f"Jogging X+ by {distance}mm at feed rate {self.current_feed_rate}")
+        logger.info(f"Jogging X+ by {distance}mm at feed rate {self.current_feed_rate}")
         result = self.comm.send_command(command)
         # Ensure we wait for the move to complete before next command
         time.sleep(0.1)  # Small delay to ensure command completes
         if result is None:
-            print("X+ jog command sent but no response - check motor power")
+            logger.warning("X+ jog command sent but no response - check motor power")
         return result
 
     def jog_x_negative(self):
         """Jog X axis negative by current jog distance using relative moves"""
         distance = self.jog_distance
         command = f"G91G1F{self.current_feed_rate}X-{distance}\rG90"  # Move only X, then return to absolute
-        logging.info(f"Jogging X- by {distance}mm at feed rate {self.current_feed_rate}")
-        print(f"Jogging X- by {distance}mm at feed rate {self.current_feed_rate}")
+        logger.info(f"Jogging X- by {distance}mm at feed rate {self.current_feed_rate}")
         result = self.comm.send_command(command)
         # Ensure we wait for the move to complete before next command
         time.sleep(0.1)  # Small delay to ensure command completes
         if result is None:
-            print("X- jog command sent but no response - check motor power")
+            logger.warning("X- jog command sent but no response - check motor power")
         return result
 
     def jog_y_positive(self):
         """Jog Y axis positive by current jog distance using relative moves"""
         distance = self.jog_distance
         command = f"G91G1F{self.current_feed_rate}Y{distance}\rG90"  # Move only Y, then return to absolute
-        logging.info(f"Jogging Y+ by {distance}mm at feed rate {self.current_feed_rate}")
-        print(f"Jogging Y+ by {distance}mm at feed rate {self.current_feed_rate}")
+        logger.info(f"Jogging Y+ by {distance}mm at feed rate {self.current_feed_rate}")
         result = self.comm.send_command(command)
         # Ensure we wait for the move to complete before next command
         time.sleep(0.1)  # Small delay to ensure command completes
         if result is None:
-            print("Y+ jog command sent but no response - check motor power")
+            logger.warning("Y+ jog command sent but no response - check motor power")
         return result
 
     def jog_y_negative(self):
         """Jog Y axis negative by current jog distance using relative moves"""
         distance = self.jog_distance
         command = f"G91G1F{self.current_feed_rate}Y-{distance}\rG90"  # Move only Y, then return to absolute
-        logging.info(f"Jogging Y- by {distance}mm at feed rate {self.current_feed_rate}")
-        print(f"Jogging Y- by {distance}mm at feed rate {self.current_feed_rate}")
+        logger.info(f"Jogging Y- by {distance}mm at feed rate {self.current_feed_rate}")
         result = self.comm.send_command(command)
         # Ensure we wait for the move to complete before next command
         time.sleep(0.1)  # Small delay to ensure command completes
         if result is None:
-            print("Y- jog command sent but no response - check motor power")
+            logger.warning("Y- jog command sent but no response - check motor power")
         return result
 
     def jog_z_positive(self):
         """Jog Z axis positive by current jog distance using relative moves"""
         distance = min(self.jog_distance, 10.0)  # Safety limit
         command = f"G91G1F{self.current_feed_rate}Z{distance}\rG90"  # Move only Z, then return to absolute
-        logging.info(f"Jogging Z+ by {distance}mm at feed rate {self.current_feed_rate}")
-        print(f"Jogging Z+ by {distance}mm at feed rate {self.current_feed_rate}")
+        logger.info(f"Jogging Z+ by {distance}mm at feed rate {self.current_feed_rate}")
         result = self.comm.send_command(command)
         # Ensure we wait for the move to complete before next command
         time.sleep(0.1)  # Small delay to ensure command completes
         if result is None:
-            print("Z+ jog command sent but no response - check motor power")
+            logger.warning("Z+ jog command sent but no response - check motor power")
         return result
 
     def jog_z_negative(self):
         """Jog Z axis negative by current jog distance using relative moves"""
         distance = min(self.jog_distance, 10.0)  # Safety limit
         command = f"G91G1F{self.current_feed_rate}Z-{distance}\rG90"  # Move only Z, then return to absolute
-        logging.info(f"Jogging Z- by {distance}mm at feed rate {self.current_feed_rate}")
-        print(f"Jogging Z- by {distance}mm at feed rate {self.current_feed_rate}")
+        logger.info(f"Jogging Z- by {distance}mm at feed rate {self.current_feed_rate}")
         result = self.comm.send_command(command)
         # Ensure we wait for the move to complete before next command
         time.sleep(0.1)  # Small delay to ensure command completes
         if result is None:
-            print("Z- jog command sent but no response - check motor power")
+            logger.warning("Z- jog command sent but no response - check motor power")
         return result
 
     def reset_alarm_state(self):
@@ -162,8 +390,8 @@ class MachineController:
         Returns:
             bool: True if all operations successful, False otherwise
         """
-        print("Starting home and setup sequence...")
-        print("Note: This requires the main power supply (12V/24V) to be connected to the CNC shield")
+        logger.info("Starting home and setup sequence...")
+        logger.warning("Note: This requires the main power supply (12V/24V) to be connected to the CNC shield")
 
         operations = [
             ("Unlocking machine", self.comm.unlock_machine),
@@ -174,16 +402,16 @@ class MachineController:
         ]
 
         for op_name, op_func in operations:
-            print(f"Performing: {op_name}")
+            logger.info(f"Performing: {op_name}")
             result = op_func()
             if result is None:
-                print(f"Warning: {op_name} completed but no confirmation received")
-                print("This may be due to motors not being powered")
+                logger.warning(f"Warning: {op_name} completed but no confirmation received")
+                logger.warning("This may be due to motors not being powered")
             else:
-                print(f"Completed: {op_name}")
+                logger.info(f"Completed: {op_name}")
             time.sleep(1.0)  # Increased pause between operations for better reliability
 
-        print("Home and setup sequence completed")
+        logger.info("Home and setup sequence completed")
         return True
     
     def get_current_position(self):
@@ -191,10 +419,154 @@ class MachineController:
         Get current machine position
         
         Returns:
-            dict: Position information from machine
+            dict: 'state', 'x', 'y', 'z' and 'timestamp' (time.monotonic()) from the status
+                report, or None if unavailable
+        """
+        return self._poll_status()[1]
+
+    def position_at(self, timestamp, max_gap=1.0):
+        """
+        Stage position at a moment (e.g. a frame's timestamp), interpolated from the status history
+
+        Args:
+            timestamp (float): time.monotonic() value
+            max_gap (float): See PositionHistory.at()
+
+        Returns:
+            dict: 'x', 'y', 'z' and 'timestamp', or None if the history does not cover the moment
+        """
+        return self.position_history.at(timestamp, max_gap=max_gap)
+
+    def move_to(self, x=None, y=None, z=None, feed=None):
+        """
+        Linear move to an absolute machine position (axes left as None do not move)
+
+        Args:
+            x (float): Target X
+            y (float): Target Y
+            z (float): Target Z
+            feed (float): Feed rate in mm/min, defaults to the current feed rate
+
+        Returns:
+            Response from the machine, or None
+
+        Raises:
+            ValueError: If the feed rate is not positive
+        """
+        axes = ''.join(f"{axis}{value:.4f}" for axis, value in (('X', x), ('Y', y), ('Z', z))
+                       if value is not None)
+        if not axes:
+            return None
+        feed = feed or self.current_feed_rate
+        if not feed > 0:
+            raise ValueError(f"The feed rate must be positive, not {feed}")
+        logger.info(f"Moving to {axes} at feed rate {feed}")
+        queued_behind = self.expected_idle_at()
+        duration = self._plan_move(x, y, z, feed, queued_behind is not None)
+        response = self.comm.send_command(f"G90G1F{feed:g}{axes}")
+        if duration is not None:
+            # The move starts once the machine has it, or when the moves ahead of it end
+            self._planned_at = max(time.monotonic(), queued_behind or 0.0) + duration
+        return response
+
+    def _plan_move(self, x, y, z, feed, queued):
         """
-        return self.comm.get_machine_status()
+        Record where a new move ends
+
+        Returns:
+            float: Its duration in seconds from the motion model, or None if the start is unknown
+        """
+        if queued:
+            start = self._planned_end
+        else:
+            # Queried fresh: jogs, homing and raw commands move the machine without planning
+            position = self.get_current_position()
+            if position is None:
+                self._planned_end = None
+                self._planned_at = 0.0
+                return None
+            start = (position['x'], position['y'], position['z'])
+        end = tuple(current if target is None else target for current, target in zip(start, (x, y, z)))
+        self._planned_end = end
+        return self.get_motion_model().move_time(start, end, feed)
+
+    def expected_idle_at(self):
+        """
+        Returns:
+            float: time.monotonic() at which the commanded moves should be finished, or None
+                if they should be already
+        """
+        return self._planned_at if self._planned_at > time.monotonic() else None
     
+    def wait_for_idle(self, x=None, y=None, z=None, timeout=10.0, tolerance=0.005, interval=0.05):
+        """
+        Wait until the machine is Idle (and at the given position, if any). After a
+        move_to() the status is only polled from shortly before the motion model
+        expects the moves to end.
+
+        Args:
+            x (float): Expected X, or None to accept any
+            y (float): Expected Y, or None to accept any
+            z (float): Expected Z, or None to accept any
+            timeout (float): Maximum wait in seconds
+            tolerance (float): Accepted position error in mm
+            interval (float): Pause between status polls in seconds
+
+        Returns:
+            dict: The final position, or None on timeout
+        """
+        deadline = time.monotonic() + timeout
+        expected = self.expected_idle_at()
+        if expected is not None:
+            # Sleep through most of the expected remainder of the moves instead of polling for it
+            margin = max(2 * interval, 0.1 * (expected - time.monotonic()))
+            time.sleep(max(0.0, min(expected - margin, deadline) - time.monotonic()))
+        while True:
+            position = self.get_current_position()
+            if position is not None and position['state'] == 'Idle' and all(
+                    target is None or abs(position[axis] - target) <= tolerance
+                    for axis, target in (('x', x), ('y', y), ('z', z))):
+                return position
+            if time.monotonic() >= deadline:
+                logger.warning(f"Machine not idle at the target after {timeout}s: {position}")
+                return None
+            time.sleep(interval)
+
+    def get_motion_model(self, refresh=False):
+        """
+        Kinematic limits of the connected machine, read once from GRBL's `$$`
+        ($110-$112, $120-$122) or Klipper's [printer] configuration
+
+        Args:
+            refresh (bool): Read the settings again (e.g. after connecting)
+
+        Returns:
+            MotionModel: The model (GRBL defaults when the machine does not report its limits)
+        """
+        from motion_model import MotionModel, parse_grbl_settings
+        cached = self._motion_model
+        if cached is not None and cached[0] is self.comm and not refresh:
+            return cached[1]
+        model = None
+        if hasattr(self.comm, 'get_motion_limits'):
+            printer = self.comm.get_motion_limits()
+            try:
+                model = MotionModel.from_klipper_config(printer) if printer else None
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Unusable Klipper motion limits {printer}: {e}")
+        elif hasattr(self.comm, 'get_settings_list'):
+            latest = self.position_history.latest()
+            if self.expected_idle_at() is not None or (latest is not None and latest.get('state') != 'Idle'):
+                # GRBL only answers $$ while idle; read the settings on a later call
+                return cached[1] if cached is not None and cached[0] is self.comm else MotionModel()
+            settings = parse_grbl_settings(self.comm.get_settings_list() or '')
+            model = MotionModel.from_grbl_settings(settings) if settings else None
+        if model is None:
+            logger.warning("Machine limits unavailable; estimating moves with GRBL default limits")
+            model = MotionModel()
+        self._motion_model = (self.comm, model)
+        return model
+
     def record_position(self):
         """
         Record current position in history
@@ -202,16 +574,8 @@ class MachineController:
         Returns:
             dict: Current position or None if unavailable
         """
-        pos = self.get_current_position()
-        if pos and 'x' in pos and 'y' in pos:
-            self.position_history.append({
-                'x': pos['x'],
-                'y': pos['y'],
-                'z': pos['z'],
-                'timestamp': time.time()
-            })
-            return pos
-        return None
+        # Every status query lands in position_history
+        return self.get_current_position()
     
     def get_position_differences(self, pos1, pos2):
         """
@@ -37,8 +37,13 @@ def setup_virtual_environment():
         print("Using system Python installation")
         return False
 
-def main():
+def main(server='development', profile_path=None, camera_source=None, pipeline=False):
     """Main entry point with virtual environment support and auto-start capability."""
+    if profile_path is not None:
+        # Start before any application import so the import timeline is complete
+        from startup_profiler import start_profiling
+        start_profiling(profile_path or None)
+
     # Setup virtual environment if available
     venv_used = setup_virtual_environment()
 
@@ -49,7 +54,9 @@ def main():
 
     # Import the Flask GUI after ensuring proper environment
     try:
-        from gui_flask import main as run_flask_gui
+        from startup_profiler import profile_phase
+        with profile_phase('import_gui'):
+            from gui_flask import main as run_flask_gui
         print("Successfully imported Flask GUI")
     except ImportError as e:
         print(f"Error importing GUI: {e}")
@@ -86,7 +93,7 @@ def main():
         raise e
 
     # Run the Flask GUI
-    run_flask_gui()
+    run_flask_gui(server=server, camera_source=camera_source, pipeline=pipeline)
 
 
 def toggle_autostart_service(enable):
@@ -141,6 +148,36 @@ def toggle_autostart_service(enable):
 
 
 if __name__ == "__main__":
+    # Server selection: the Flask development server unless --production is given
+    server_mode = 'development'
+    if '--production' in sys.argv:
+        server_mode = 'production'
+        sys.argv.remove('--production')
+    if '--dev' in sys.argv:
+        server_mode = 'development'
+        sys.argv.remove('--dev')
+
+    # Startup profiling: --profile-startup[=path.json]
+    profile_path = None
+    for argument in sys.argv[1:]:
+        if argument == '--profile-startup' or argument.startswith('--profile-startup='):
+            profile_path = argument.partition('=')[2]
+            sys.argv.remove(argument)
+            break
+
+    # Frame pipeline: capture, JPEG encoding and vision workers in separate processes
+    pipeline = '--pipeline' in sys.argv
+    if pipeline:
+        sys.argv.remove('--pipeline')
+
+    # Camera source opened at startup: --camera=SPEC (index, test, replay:PATH)
+    camera_source = None
+    for argument in sys.argv[1:]:
+        if argument.startswith('--camera='):
+            camera_source = argument.partition('=')[2]
+            sys.argv.remove(argument)
+            break
+
     # Check if command line arguments were provided for auto-start management
     if len(sys.argv) > 1:
         arg = sys.argv[1].upper()
@@ -153,11 +190,19 @@ if __name__ == "__main__":
             print(message)
             sys.exit(0 if success else 1)
         elif arg in ['-H', '--HELP', 'HELP']:
-            print("Usage: python main.py [ON|OFF|ENABLE|DISABLE]")
+            print("Usage: python main.py [ON|OFF|ENABLE|DISABLE] [--production|--dev] [--profile-startup[=FILE]] [--camera=SPEC] [--pipeline]")
             print("  ON/ENABLE: Enable auto-start on boot")
             print("  OFF/DISABLE: Disable auto-start on boot")
+            print("  --production: Serve with bounded thread pools (used by the service)")
+            print("  --dev: Serve with the Flask development server (default)")
+            print("  --profile-startup: Record import/startup timings to data/startup_profile.json")
+            print("                     (or FILE) and serve them at /api/startup_profile")
+            print("  --camera=SPEC: Open a camera at startup: an index, 'test[:WxH@FPS]' for a generated")
+            print("                 pattern or 'replay:PATH' for a video file or image sequence")
+            print("  --pipeline: Capture, encode and run vision workers ($COMPARATOR_VISION_WORKERS)")
+            print("              in separate processes sharing frames through shared memory")
             print("  No argument: Start the theSmallComparator web interface normally")
             sys.exit(0)
 
     # Normal operation - start the web interface
-    main()
\ No newline at end of file
+    main(server=server_mode, profile_path=profile_path, camera_source=camera_source, pipeline=pipeline)
\ No newline at end of file
@@ -0,0 +1,390 @@
+"""
+Measurement Program Module for theSmallComparator
+Handles recording a measurement sequence once, storing it relative to the part datum, and replaying it on every following part
+"""
+
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.program')
+
+PROGRAM_VERSION = 1
+STEP_TYPES = ('move', 'point', 'image', 'autofocus')
+
+
+class Datum:
+    """
+    Part coordinate system: origin and rotation of the part on the stage.
+    Program positions are stored in part coordinates so a program recorded
+    on one part replays on the next wherever it is placed.
+    """
+
+    def __init__(self, x=0.0, y=0.0, z=0.0, angle=0.0):
+        """
+        Args:
+            x, y, z (float): Machine position of the part origin
+            angle (float): Rotation of the part's X axis from the machine's, in radians
+        """
+        self.x, self.y, self.z = float(x), float(y), float(z)
+        self.angle = float(angle)
+
+    def to_machine(self, x, y, z=0.0):
+        """Part coordinates to machine coordinates"""
+        cos, sin = math.cos(self.angle), math.sin(self.angle)
+        return self.x + cos * x - sin * y, self.y + sin * x + cos * y, self.z + z
+
+    def to_part(self, x, y, z=None):
+        """Machine coordinates to part coordinates"""
+        cos, sin = math.cos(self.angle), math.sin(self.angle)
+        dx, dy = x - self.x, y - self.y
+        return cos * dx + sin * dy, -sin * dx + cos * dy, (z - self.z) if z is not None else 0.0
+
+    def to_dict(self):
+        return {'x': self.x, 'y': self.y, 'z': self.z, 'angle': self.angle}
+
+
+def _clean_name(name):
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', str(name or '').strip()).strip('._')
+    if not name:
+        raise ValueError("A program needs a name")
+    return name[:80]
+
+
+class ProgramStore:
+    """Programs as JSON files, one per program, in a directory next to the session database"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{_clean_name(name)}.json")
+
+    def list(self):
+        """
+        Returns:
+            list: Name, step count and creation time of every program, by name
+        """
+        programs = []
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                program = self.load(filename[:-5])
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable program {filename}: {e}")
+                continue
+            programs.append({'name': program['name'], 'steps': len(program['steps']),
+                             'created_at': program.get('created_at')})
+        return programs
+
+    def load(self, name):
+        """
+        Returns:
+            dict: The program
+
+        Raises:
+            FileNotFoundError: If there is no such program
+            ValueError: If the file is not a valid program
+        """
+        with open(self._path(name)) as f:
+            program = json.load(f)
+        validate_program(program)
+        return program
+
+    def save(self, program):
+        """Write a program (replacing one with the same name) atomically"""
+        validate_program(program)
+        path = self._path(program['name'])
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(program, f, indent=2)
+        os.replace(temporary, path)
+
+    def delete(self, name):
+        """
+        Returns:
+            bool: True if the program existed
+        """
+        try:
+            os.remove(self._path(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def validate_program(program):
+    """
+    Raises:
+        ValueError: If the program is malformed
+    """
+    if not isinstance(program, dict) or not isinstance(program.get('steps'), list):
+        raise ValueError("A program is an object with a list of steps")
+    if not isinstance(program.get('alignment', []), list):
+        raise ValueError("The alignment of a program is a list of features")
+    program['name'] = _clean_name(program.get('name'))
+    for index, step in enumerate(program['steps']):
+        if step.get('type') not in STEP_TYPES:
+            raise ValueError(f"Step {index + 1}: unknown type {step.get('type')!r}")
+        if step['type'] == 'move' and not all(isinstance(step.get(axis), (int, float)) for axis in ('x', 'y', 'z')):
+            raise ValueError(f"Step {index + 1}: a move needs numeric x, y and z")
+
+
+class ProgramRecorder:
+    """
+    Builds a program from what the operator does: each point capture,
+    session image or autofocus becomes a move to the current position (in
+    part coordinates) followed by that action. The jogs in between are not
+    recorded, only where they ended up.
+    """
+
+    def __init__(self, name, datum, alignment=None):
+        """
+        Args:
+            name (str): Program name
+            datum (Datum): Part coordinate system, usually the position recording started at
+                or the part alignment
+            alignment (list): Features the datum was aligned on (see alignment.py), run
+                again on every part before replaying
+        """
+        self.name = _clean_name(name)
+        self.datum = datum
+        self.alignment = alignment
+        self.steps = []
+
+    def record(self, action, position, **options):
+        """
+        Args:
+            action (str): 'point', 'image' or 'autofocus'
+            position (dict): Machine position the action was taken at
+            options: Extra step settings (e.g. detect='edge', range=2.0)
+        """
+        x, y, z = self.datum.to_part(position['x'], position['y'], position.get('z'))
+        last_move = next((step for step in reversed(self.steps) if step['type'] == 'move'), None)
+        move = {'type': 'move', 'x': round(x, 4), 'y': round(y, 4), 'z': round(z, 4)}
+        if last_move is None or any(last_move[axis] != move[axis] for axis in ('x', 'y', 'z')):
+            self.steps.append(move)
+        self.steps.append(dict(options, type=action))
+        logger.info(f"Program {self.name}: recorded {action} at ({x:.3f}, {y:.3f}, {z:.3f})")
+
+    def program(self):
+        """
+        Returns:
+            dict: The recorded program, ready for ProgramStore.save()
+        """
+        program = {'name': self.name, 'version': PROGRAM_VERSION, 'created_at': datetime.now().isoformat(),
+                   'steps': list(self.steps)}
+        if self.alignment:
+            program['alignment'] = list(self.alignment)
+        return program
+
+
+class ProgramRunner:
+    """
+    Replays a program relative to a datum.
+
+    Consecutive moves are sent back to back into the controller's planner;
+    the stage only has to come to rest where a frame is needed. The frame
+    is then taken at rest, the moves up to the next capture are sent at
+    once, and the frame is analysed while the stage travels.
+    """
+
+    def __init__(self, program, controller, frames, datum, mapping=None, feed=None,
+                 on_point=None, on_image=None, autofocus=None, align=None):
+        """
+        Args:
+            program (dict): Program to run
+            controller (MachineController): Machine to move
+            frames (FrameRing): Ring the capture thread publishes frames to
+            datum (Datum): Where the part is (or roughly, with `align`)
+            mapping (PixelMapping): Camera calibration, needed for edge-detected points
+            feed (float): Feed rate for the moves in mm/min, defaults to the controller's fastest
+            on_point (callable): Called as on_point(x, y, position) for every measured point
+            on_image (callable): Called as on_image(jpeg_bytes, position) for every image step
+            autofocus (callable): Called as autofocus(step) at autofocus steps; returns the Z focus
+                was found at (later moves follow the part surface), or None
+            align (callable): Called before the first move; returns the Datum of this part
+        """
+        validate_program(program)
+        self.program = program
+        self.controller = controller
+        self.frames = frames
+        self.datum = datum
+        self.mapping = mapping
+        self.feed = feed or controller.feed_rates['faster']
+        self.on_point = on_point
+        self.on_image = on_image
+        self.autofocus = autofocus
+        self.align = align
+        self.results = []
+        self.step = 0
+        self.running = False
+        self.completed = False
+        self.error = None
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._target = None
+        # First step not sent to the machine yet
+        self._next = 0
+        # Time spent at rest taking frames, measuring and focusing, for the ETA
+        self._action_time = 0.0
+        self._actions = 0
+        # Difference between this part's surface and the recorded one, from the last autofocus
+        self._z_offset = 0.0
+
+    def stop(self):
+        """Ask a running program to end after the current step"""
+        self._stop.set()
+
+    def status(self):
+        return {'program': self.program['name'], 'running': self.running, 'completed': self.completed,
+                'step': self.step, 'steps': len(self.program['steps']), 'results': list(self.results),
+                'datum': self.datum.to_dict(), 'error': self.error, 'duration': round(self.duration, 3),
+                'eta': round(self.eta(), 1) if self.running else 0.0}
+
+    def eta(self):
+        """
+        Estimated time left: the moves still in the machine's planner, the
+        unsent moves from the motion model, and the remaining actions at the
+        mean time the actions so far have taken
+
+        Returns:
+            float: Seconds
+        """
+        steps = self.program['steps']
+        expected = self.controller.expected_idle_at()
+        seconds = max(0.0, expected - time.monotonic()) if expected is not None else 0.0
+        path = [self._target] if self._target is not None else []
+        path += [self.datum.to_machine(step['x'], step['y'], step['z'] + self._z_offset)
+                 for step in steps[self._next:] if step['type'] == 'move']
+        seconds += self.controller.get_motion_model().path_time(path, self.feed)
+        if self._actions:
+            remaining = sum(1 for step in steps[self.step:] if step['type'] != 'move')
+            seconds += remaining * self._action_time / self._actions
+        return seconds
+
+    def _send_moves(self, index):
+        """Send the moves starting at `index` up to the next action; returns the index of that action"""
+        steps = self.program['steps']
+        while index < len(steps) and steps[index]['type'] == 'move':
+            step = steps[index]
+            x, y, z = self.datum.to_machine(step['x'], step['y'], step['z'] + self._z_offset)
+            self.controller.move_to(x=x, y=y, z=z, feed=self.feed)
+            self._target = (x, y, z)
+            index += 1
+        self._next = index
+        return index
+
+    def _count_action(self, arrived):
+        self._action_time += time.monotonic() - arrived
+        self._actions += 1
+
+    def _at_rest(self, need_frame=True):
+        """
+        Wait for the stage to reach the target
+
+        Returns:
+            tuple: (copy of the first frame captured after arriving, or None if not needed, position)
+        """
+        x, y, z = self._target if self._target else (None, None, None)
+        position = self.controller.wait_for_idle(x=x, y=y, z=z, timeout=30.0)
+        if position is None:
+            raise RuntimeError(f"Machine did not reach step {self.step + 1}")
+        if not need_frame:
+            return None, position
+        view = self.frames.wait_newer(self.frames.seq, timeout=2.0)
+        if view is None:
+            raise RuntimeError("No camera frame")
+        with view:
+            return view.array.copy(), position
+
+    def _measure(self, step, frame, position):
+        """Point measurement from a frame taken at rest (runs while the stage moves on)"""
+        x, y = position['x'], position['y']
+        if step.get('detect') == 'edge':
+            import numpy as np
+            from edge_tracer import find_edges
+            if self.mapping is None:
+                raise RuntimeError("Edge-detected points need the camera calibration")
+            edges = find_edges(frame)
+            if not edges:
+                raise RuntimeError(f"No edge found at step {self.step + 1}")
+            width, height = self.mapping.frame_size
+            points = np.concatenate(edges)
+            nearest = points[np.argmin(np.hypot(points[:, 0] - (width - 1) / 2, points[:, 1] - (height - 1) / 2))]
+            x, y = self.mapping.to_stage(nearest[np.newaxis], x, y)[0]
+        part_x, part_y, _ = self.datum.to_part(x, y)
+        if self.on_point is not None:
+            self.on_point(float(x), float(y), position)
+        self.results.append({'step': self.step + 1, 'x': round(float(x), 4), 'y': round(float(y), 4),
+                             'part_x': round(part_x, 4), 'part_y': round(part_y, 4)})
+
+    def run(self):
+        """
+        Run every step
+
+        Returns:
+            dict: Final status with the measured points
+        """
+        import cv2 as cv
+        self.running = True
+        started = time.monotonic()
+        steps = self.program['steps']
+        try:
+            if self.align is not None:
+                self.datum = self.align()
+            index = self._send_moves(0)
+            while index < len(steps) and not self._stop.is_set():
+                self.step = index
+                step = steps[index]
+                if step['type'] == 'autofocus':
+                    self._at_rest(need_frame=False)
+                    arrived = time.monotonic()
+                    focus_z = self.autofocus(step) if self.autofocus is not None else None
+                    if focus_z is not None and self._target is not None:
+                        self._z_offset += focus_z - self._target[2]
+                    index = self._send_moves(index + 1)
+                    self._count_action(arrived)
+                    continue
+                need_frame = step['type'] == 'image' or step.get('detect') == 'edge'
+                frame, position = self._at_rest(need_frame)
+                arrived = time.monotonic()
+                # Start travelling to the next capture before analysing this frame
+                index = self._send_moves(index + 1)
+                if step['type'] == 'point':
+                    self._measure(step, frame, position)
+                elif step['type'] == 'image' and self.on_image is not None:
+                    ret, jpeg = cv.imencode('.jpg', frame)
+                    if ret:
+                        self.on_image(jpeg.tobytes(), position)
+                self._count_action(arrived)
+            self.completed = index >= len(steps)
+        except (RuntimeError, ValueError) as e:
+            self.error = str(e)
+            logger.error(f"Program {self.program['name']} failed: {e}")
+        finally:
+            self.duration = time.monotonic() - started
+            self.running = False
+        logger.info(f"Program {self.program['name']}: {len(self.results)} points in {self.duration:.1f}s")
+        return self.status()
+
+
+if __name__ == "__main__":
+    # Record two points on a part at (10, 5) and replay them on a part rotated by 90 degrees at (50, 50)
+    recorder = ProgramRecorder('demo', Datum(10.0, 5.0))
+    recorder.record('point', {'x': 12.0, 'y': 5.0, 'z': 0.0})
+    recorder.record('point', {'x': 12.0, 'y': 8.0, 'z': 0.0}, detect='edge')
+    program = recorder.program()
+    print(json.dumps(program['steps']))
+    rotated = Datum(50.0, 50.0, angle=math.pi / 2)
+    for step in program['steps']:
+        if step['type'] == 'move':
+            print([round(value, 3) for value in rotated.to_machine(step['x'], step['y'], step['z'])])
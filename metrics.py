@@ -0,0 +1,359 @@
+"""
+Metrics Module for theSmallComparator
+Lightweight counters, gauges and histograms exported in the Prometheus text format
+"""
+
+import bisect
+import contextlib
+import logging
+import math
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FRAME_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.033, 0.05, 0.1, 0.25)
+SCAN_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape_label(extra[1])}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class _Metric:
+    """
+    Base class for a metric family. Each distinct set of label values gets
+    its own child holding the actual value; children are created on first use.
+    """
+
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._new_child()
+            self._children[()] = self._default
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """
+        Get the child for the given label values (in labelnames order)
+
+        Returns:
+            Child with the metric's inc/set/observe methods
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _samples(self):
+        """Yield (suffix, label string, value) for every child"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.metric_type}']
+        lines += [f'{self.name}{suffix}{labels} {_format_value(value)}' for suffix, labels, value in self._samples()]
+        return '\n'.join(lines)
+
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self):
+        return self._value
+
+
+class Counter(_Metric):
+    """Monotonically increasing count (requests, frames, failures)"""
+
+    metric_type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1.0):
+        self._default.inc(amount)
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            yield '', _format_labels(self.labelnames, key), child.value
+
+
+class _GaugeChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._value = float(value)
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1.0):
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self):
+        return self._value
+
+
+class Gauge(_Metric):
+    """Value that can go up and down (connected clients, frame rate)"""
+
+    metric_type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        self._default.set(value)
+
+    def inc(self, amount=1.0):
+        self._default.inc(amount)
+
+    def dec(self, amount=1.0):
+        self._default.dec(amount)
+
+    def _samples(self):
+        for key, child in list(self._children.items()):
+            yield '', _format_labels(self.labelnames, key), child.value
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # Last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        """Observe the duration of the enclosed block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def snapshot(self):
+        """
+        Returns:
+            tuple: (cumulative bucket counts including +Inf, sum)
+        """
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (latencies, durations) in fixed buckets"""
+
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def time(self):
+        return self._default.time()
+
+    def _samples(self):
+        bounds = self.buckets + (math.inf,)
+        for key, child in list(self._children.items()):
+            cumulative, total = child.snapshot()
+            for bound, count in zip(bounds, cumulative):
+                yield '_bucket', _format_labels(self.labelnames, key, ('le', _format_value(float(bound)))), count
+            yield '_sum', _format_labels(self.labelnames, key), total
+            yield '_count', _format_labels(self.labelnames, key), cumulative[-1]
+
+
+class MetricsRegistry:
+    """
+    Class to hold the application's metrics and render them for /metrics
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format
+
+        Returns:
+            str: Exposition text
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+PROCESS_START_TIME = REGISTRY.gauge(
+    'comparator_process_start_time_seconds', 'Start time of the process since the Unix epoch')
+PROCESS_START_TIME.set(time.time())
+
+# Serial / GRBL
+SERIAL_COMMAND_SECONDS = REGISTRY.histogram(
+    'comparator_serial_command_seconds', 'Serial command round-trip time, write to final response',
+    ['command_type'])
+SERIAL_COMMAND_FAILURES = REGISTRY.counter(
+    'comparator_serial_command_failures_total', 'Serial commands without a response (timeout or error)',
+    ['command_type'])
+ARBITER_QUEUE_SECONDS = REGISTRY.histogram(
+    'comparator_arbiter_queue_wait_seconds', 'Time a job waited in the command arbiter queue', ['arbiter'])
+STATUS_POLL_SECONDS = REGISTRY.histogram(
+    'comparator_status_poll_seconds', 'Machine status poll latency as seen by the caller', ['backend'])
+STATUS_POLL_FAILURES = REGISTRY.counter(
+    'comparator_status_poll_failures_total', 'Machine status polls that returned no status', ['backend'])
+
+# Klipper / Moonraker
+MOONRAKER_REQUEST_SECONDS = REGISTRY.histogram(
+    'comparator_moonraker_request_seconds', 'Moonraker HTTP request latency', ['endpoint'])
+MOONRAKER_REQUEST_FAILURES = REGISTRY.counter(
+    'comparator_moonraker_request_failures_total', 'Moonraker requests that failed or returned an error status',
+    ['endpoint'])
+
+# Camera
+CAMERA_SCAN_SECONDS = REGISTRY.histogram(
+    'comparator_camera_scan_seconds', 'Camera detection scan duration', ['mode'], buckets=SCAN_BUCKETS)
+CAPTURE_FRAMES = REGISTRY.counter(
+    'comparator_capture_frames_total', 'Frames read from the camera')
+CAPTURE_FAILURES = REGISTRY.counter(
+    'comparator_capture_failures_total', 'Failed camera reads')
+CAPTURE_FPS = REGISTRY.gauge(
+    'comparator_capture_fps', 'Camera capture rate, exponentially averaged')
+CAPTURE_READ_SECONDS = REGISTRY.histogram(
+    'comparator_capture_read_seconds', 'Time spent in a single camera read', buckets=FRAME_BUCKETS)
+FRAME_RING_OVERRUNS = REGISTRY.counter(
+    'comparator_frame_ring_overruns_total', 'Captures skipped because every frame buffer was held by a reader')
+
+# Video streaming
+FRAME_ENCODE_SECONDS = REGISTRY.histogram(
+    'comparator_frame_encode_seconds', 'JPEG encode time per streamed frame', buckets=FRAME_BUCKETS)
+STREAM_CLIENTS = REGISTRY.gauge(
+    'comparator_stream_clients', 'Connected MJPEG clients')
+STREAM_FRAMES_SENT = REGISTRY.counter(
+    'comparator_stream_frames_sent_total', 'Frames sent to MJPEG clients')
+STREAM_TIER_CLIENTS = REGISTRY.gauge(
+    'comparator_stream_tier_clients', 'MJPEG clients per encode tier (size and quality, or region of interest zoom and quality)', ['tier'])
+STREAM_FRAMES_DROPPED = REGISTRY.counter(
+    'comparator_stream_frames_dropped_total', 'Captured frames a client never received because it fell behind')
+
+
+class RateMeter:
+    """
+    Exponentially averaged event rate, e.g. frames per second
+
+    Args:
+        gauge (Gauge): Gauge updated with the current rate
+        smoothing (float): Weight of the newest interval (0-1)
+    """
+
+    def __init__(self, gauge, smoothing=0.1):
+        self.gauge = gauge
+        self.smoothing = smoothing
+        self._last = None
+        self._interval = None
+
+    def tick(self):
+        now = time.perf_counter()
+        if self._last is not None:
+            interval = now - self._last
+            if self._interval is None:
+                self._interval = interval
+            else:
+                self._interval += self.smoothing * (interval - self._interval)
+            if self._interval > 0:
+                self.gauge.set(1.0 / self._interval)
+        self._last = now
+
+
+if __name__ == "__main__":
+    # Test the metrics rendering
+    for seconds in (0.003, 0.02, 0.4):
+        SERIAL_COMMAND_SECONDS.labels('gcode').observe(seconds)
+    SERIAL_COMMAND_FAILURES.labels('status_report').inc()
+    STREAM_CLIENTS.inc()
+    print(REGISTRY.render())
@@ -0,0 +1,144 @@
+"""
+Motion Model Module for theSmallComparator
+Handles the machine's kinematic limits (from GRBL's `$$` or Klipper's configuration) and estimates how long moves take, so callers know when the stage will arrive without polling for it
+"""
+
+import logging
+import re
+
+import numpy as np
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.motion')
+
+# GRBL defaults, used when the machine's settings are unknown
+DEFAULT_MAX_RATES = (500.0, 500.0, 500.0)   # $110-$112, mm/min
+DEFAULT_ACCELERATIONS = (10.0, 10.0, 10.0)  # $120-$122, mm/s^2
+
+_SETTING_PATTERN = re.compile(r'^\$(\d+)=(-?\d*\.?\d+)', re.MULTILINE)
+
+
+def parse_grbl_settings(text):
+    """
+    Settings from a `$$` response
+
+    Args:
+        text (str): Lines like "$110=3000.000"
+
+    Returns:
+        dict: Setting number to value
+    """
+    return {int(key): float(value) for key, value in _SETTING_PATTERN.findall(text or '')}
+
+
+class MotionModel:
+    """
+    Per-axis maximum rates and accelerations. A straight move is limited
+    like GRBL's planner does it: the path speed and acceleration are capped
+    so that no axis exceeds its own maximum, and the move follows a
+    trapezoidal profile from rest to rest. Consecutive queued moves are
+    estimated the same way, one after the other, which slightly
+    overestimates paths the planner blends through corners.
+    """
+
+    def __init__(self, max_rates=DEFAULT_MAX_RATES, accelerations=DEFAULT_ACCELERATIONS, source='defaults'):
+        """
+        Args:
+            max_rates (sequence): X, Y, Z maximum rates in mm/min
+            accelerations (sequence): X, Y, Z accelerations in mm/s^2
+            source (str): Where the limits came from ('grbl', 'klipper' or 'defaults')
+        """
+        self.max_rates = np.asarray(max_rates, dtype=np.float64)
+        self.accelerations = np.asarray(accelerations, dtype=np.float64)
+        self.source = source
+
+    @classmethod
+    def from_grbl_settings(cls, settings):
+        """
+        Args:
+            settings (dict or str): Parsed settings or the raw `$$` response
+
+        Returns:
+            MotionModel: Limits from $110-$112 and $120-$122 (defaults for missing ones)
+        """
+        if isinstance(settings, str):
+            settings = parse_grbl_settings(settings)
+        return cls([settings.get(110 + axis, DEFAULT_MAX_RATES[axis]) for axis in range(3)],
+                   [settings.get(120 + axis, DEFAULT_ACCELERATIONS[axis]) for axis in range(3)],
+                   source='grbl' if settings else 'defaults')
+
+    @classmethod
+    def from_klipper_config(cls, printer):
+        """
+        Args:
+            printer (dict): The [printer] section of Klipper's configuration (max_velocity and
+                max_accel in mm/s and mm/s^2, optional max_z_velocity and max_z_accel)
+
+        Returns:
+            MotionModel: Limits for a cartesian machine (X and Y share the printer limits)
+        """
+        velocity = float(printer['max_velocity'])
+        accel = float(printer['max_accel'])
+        z_velocity = float(printer.get('max_z_velocity', velocity))
+        z_accel = float(printer.get('max_z_accel', accel))
+        return cls([velocity * 60.0, velocity * 60.0, z_velocity * 60.0], [accel, accel, z_accel],
+                   source='klipper')
+
+    def to_dict(self):
+        return {'max_rates': self.max_rates.tolist(), 'accelerations': self.accelerations.tolist(),
+                'source': self.source}
+
+    def move_times(self, deltas, feed=None):
+        """
+        Durations of straight moves
+
+        Args:
+            deltas (array): (..., 2 or 3) axis displacements in mm
+            feed (float): Requested feed rate in mm/min, capped by the axis limits
+
+        Returns:
+            numpy.ndarray: Move times in seconds, shape deltas.shape[:-1]
+        """
+        deltas = np.abs(np.asarray(deltas, dtype=np.float64))
+        axes = deltas.shape[-1]
+        distance = np.sqrt(np.sum(deltas ** 2, axis=-1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            share = deltas / distance[..., np.newaxis]
+            # Path speed and acceleration at which the most loaded axis is at its limit
+            speed = np.min(np.where(share > 0, self.max_rates[:axes] / 60.0 / share, np.inf), axis=-1)
+            accel = np.min(np.where(share > 0, self.accelerations[:axes] / share, np.inf), axis=-1)
+            if feed:
+                speed = np.minimum(speed, feed / 60.0)
+            cruise = distance >= speed * speed / accel
+            times = np.where(cruise, distance / speed + speed / accel, 2.0 * np.sqrt(distance / accel))
+        return np.where(distance > 0, times, 0.0)
+
+    def move_time(self, start, end, feed=None):
+        """Duration of one straight move between two points"""
+        return float(self.move_times(np.subtract(end, start), feed))
+
+    def path_time(self, positions, feed=None):
+        """
+        Duration of moves through a sequence of positions, stopping at each
+
+        Args:
+            positions (array): (N, 2 or 3) positions, the first one where the machine starts
+            feed (float): Feed rate in mm/min
+
+        Returns:
+            float: Seconds
+        """
+        positions = np.asarray(positions, dtype=np.float64)
+        return float(np.sum(self.move_times(np.diff(positions, axis=0), feed))) if len(positions) > 1 else 0.0
+
+
+if __name__ == "__main__":
+    # The GRBL simulator's limits: a 30 mm X move, a 5 mm Z move and a short diagonal hop
+    model = MotionModel.from_grbl_settings("$110=3000.000\n$111=3000.000\n$112=500.000\n"
+                                           "$120=100.000\n$121=100.000\n$122=50.000\nok\n")
+    print(model.to_dict())
+    print(f"X30: {model.move_time((0, 0, 0), (30, 0, 0)):.3f}s, Z5: {model.move_time((0, 0, 0), (0, 0, 5)):.3f}s, "
+          f"XY(1,1): {model.move_time((0, 0), (1, 1)):.3f}s")
+    klipper = MotionModel.from_klipper_config({'max_velocity': '300', 'max_accel': '3000', 'max_z_velocity': '5'})
+    print(f"Klipper X30: {klipper.move_time((0, 0, 0), (30, 0, 0)):.3f}s")
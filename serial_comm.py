@@ -7,15 +7,23 @@ import serial
 import serial.tools.list_ports
 import time
 import logging
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from command_arbiter import (CommandArbiter, classify_command, command_type, normalize_command,
+                             FIRE_AND_FORGET_COMMANDS, PRIORITY_REALTIME, PRIORITY_GCODE)
+from metrics import SERIAL_COMMAND_SECONDS, SERIAL_COMMAND_FAILURES
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.serial')
 
 
 class SerialCommunicator:
     """
     Class to handle serial communication with the CNC machine
     """
+
+    backend_name = "GRBL"
     
     def __init__(self):
         self.ser = None
@@ -26,6 +34,12 @@ class SerialCommunicator:
         self.timeout = 2  # Set a reasonable timeout to avoid hanging
         self.xonxoff = 0  # Disable software flow control to reduce potential issues
         self.rtscts = 0   # Disable hardware flow control
+        # Single writer: every command/response exchange runs on the arbiter's
+        # worker thread, otherwise concurrent requests read each other's responses
+        self.arbiter = CommandArbiter(name="SerialArbiter")
+        # Guards raw writes, since realtime bytes are injected from the caller's thread
+        self.write_lock = threading.Lock()
+        self.command_timeout = 30.0  # Maximum wait including time spent queued
     
     def connect_to_com(self, com_port):
         """
@@ -37,14 +51,17 @@ class SerialCommunicator:
         Returns:
             bool: True if connection successful, False otherwise
         """
+        return self.arbiter.call(self._connect_to_com, com_port, priority=PRIORITY_GCODE)
+
+    def _connect_to_com(self, com_port):
+        """Open the port and check for a GRBL response (runs on the arbiter worker)"""
         try:
-            logging.info(f"Attempting to connect to: {com_port}")
-            print(f"Trying to connect to: {com_port}")
+            logger.info(f"Attempting to connect to: {com_port}")
 
             # Close any existing connection first
             if self.ser and self.ser.is_open:
                 self.ser.close()
-                logging.info("Closed existing serial connection")
+                logger.info("Closed existing serial connection")
 
             self.ser = serial.Serial(
                 com_port,
@@ -63,8 +80,9 @@ class SerialCommunicator:
             # Try to get status from GRBL - this is the key test to see if it's responsive
             if self.ser.is_open:
                 # Send the status query command
-                self.ser.write(b'?\r')
-                self.ser.flush()
+                with self.write_lock:
+                    self.ser.write(b'?\r')
+                    self.ser.flush()
 
                 # Wait briefly for response
                 time.sleep(0.5)
@@ -73,56 +91,53 @@ class SerialCommunicator:
                 if self.ser.in_waiting > 0:
                     ser_in = self.ser.readline()
                     response_str = ser_in.decode('utf-8', errors='ignore').strip()
-                    print(f"Connection response: {response_str}")
-                    logging.info(f"Connection response: {response_str}")
+                    logger.info(f"Connection response: {response_str}")
 
                     # Check if the response is from GRBL
                     if 'grbl' in response_str.lower() or response_str.startswith('<'):
-                        logging.info(f"Successfully connected to GRBL controller on {com_port}")
+                        logger.info(f"Successfully connected to GRBL controller on {com_port}")
                         return True
                     else:
                         # If we get a response but it's not GRBL-like, it might be an unpowered device
-                        print(f"Connected to device but may not be an active GRBL controller: {response_str}")
-                        print("Possible issue: Main power supply (12V/24V) may not be connected to the CNC shield")
+                        logger.warning(f"Connected to device but may not be an active GRBL controller: {response_str}")
+                        logger.warning("Possible issue: Main power supply (12V/24V) may not be connected to the CNC shield")
                 else:
                     # No response received - device may be present but not responding (unpowered)
-                    print("Device detected but no response received - check main power supply (12V/24V) connection")
-                    print("GRBL controller typically requires main power to be fully operational")
+                    logger.warning("Device detected but no response received - check main power supply (12V/24V) connection")
+                    logger.warning("GRBL controller typically requires main power to be fully operational")
 
-            logging.info(f"Successfully opened serial port {com_port} but device may not be responsive")
+            logger.info(f"Successfully opened serial port {com_port} but device may not be responsive")
             return True  # Return True even if not fully responsive so user can try other operations
         except serial.SerialException as e:
-            logging.error(f"Serial connection error to {com_port}: {e}")
+            logger.error(f"Serial connection error to {com_port}: {e}")
             if "permission" in str(e).lower():
-                print(f"Permission error: Make sure you have access to {com_port}")
-                print("Try: sudo usermod -a -G dialout $USER")
-                print("Then log out and log back in, or run with sudo")
+                logger.error(f"Permission error: Make sure you have access to {com_port}")
+                logger.error("Try: sudo usermod -a -G dialout $USER")
+                logger.error("Then log out and log back in, or run with sudo")
             elif "access" in str(e).lower() or "busy" in str(e).lower():
-                print(f"Port in use or access denied: {com_port}")
-                print("Make sure no other program is using this serial port")
-            else:
-                print(f"Serial connection error to {com_port}: {e}")
+                logger.error(f"Port in use or access denied: {com_port}")
+                logger.error("Make sure no other program is using this serial port")
             return False
         except Exception as e:
-            logging.error(f"Unexpected error connecting to {com_port}: {e}")
-            print(f"Error connecting to {com_port}: {e}")
+            logger.error(f"Unexpected error connecting to {com_port}: {e}")
             return False
     
     def disconnect(self):
         """
         Close the serial connection
         """
+        self.arbiter.call(self._disconnect, priority=PRIORITY_GCODE)
+
+    def _disconnect(self):
+        """Close the port (runs on the arbiter worker)"""
         if self.ser and self.ser.is_open:
             try:
                 self.ser.close()
-                logging.info("Serial connection closed")
-                print("Serial connection closed")
+                logger.info("Serial connection closed")
             except Exception as e:
-                logging.error(f"Error closing serial connection: {e}")
-                print(f"Error closing serial connection: {e}")
+                logger.error(f"Error closing serial connection: {e}")
         else:
-            logging.info("No open serial connection to close")
-            print("No open serial connection to close")
+            logger.info("No open serial connection to close")
     
     def send_command(self, command_string, multi_line_response=False):
         """
@@ -135,9 +150,58 @@ class SerialCommunicator:
         Returns:
             str: Response from the machine, or None if error
         """
+        bare_command = normalize_command(command_string)
+        if bare_command in FIRE_AND_FORGET_COMMANDS:
+            return self.send_realtime(bare_command)
+
+        try:
+            return self.arbiter.call(self._send_command, command_string, multi_line_response,
+                                     priority=classify_command(command_string),
+                                     timeout=self.command_timeout)
+        except FutureTimeoutError:
+            logger.warning(f"Command {command_string!r} still queued after {self.command_timeout}s")
+            return None
+
+    def send_realtime(self, command_byte):
+        """
+        Write a GRBL realtime command (feed hold, cycle start, jog cancel, soft reset)
+        immediately, ahead of anything queued or running. GRBL picks these bytes out
+        of the stream at any point, so they need no exclusive exchange.
+
+        Args:
+            command_byte (bytes): Single realtime command byte
+
+        Returns:
+            str: 'ok' once written, or None if not connected
+        """
         if not self.ser or not self.ser.is_open:
-            logging.warning("No active serial connection")
-            print("No active serial connection")
+            logger.warning("No active serial connection")
+            return None
+        try:
+            with SERIAL_COMMAND_SECONDS.labels('realtime').time():
+                with self.write_lock:
+                    self.ser.write(command_byte)
+                    self.ser.flush()
+            return 'ok'
+        except serial.SerialException as e:
+            logger.error(f"Serial error sending realtime command {command_byte!r}: {e}")
+            return None
+
+    def _send_command(self, command_string, multi_line_response=False):
+        """Send a command and read its response, recording the round-trip time (runs on the arbiter worker)"""
+        label = command_type(command_string)
+        started = time.perf_counter()
+        response = self._exchange(command_string, multi_line_response)
+        if response is None:
+            SERIAL_COMMAND_FAILURES.labels(label).inc()
+        else:
+            SERIAL_COMMAND_SECONDS.labels(label).observe(time.perf_counter() - started)
+        return response
+
+    def _exchange(self, command_string, multi_line_response=False):
+        """Write a command and collect its response lines"""
+        if not self.ser or not self.ser.is_open:
+            logger.warning("No active serial connection")
             return None
 
         try:
@@ -148,16 +212,18 @@ class SerialCommunicator:
             else:
                 command_bytes = command_string
 
-            logging.debug(f"Sending command: {command_string}")
+            logger.debug(f"Sending command: {command_string}")
 
-            # Clear input buffer to start fresh (get rid of any backlog from previous operations)
+            # Clear input buffer to start fresh (get rid of any backlog from previous operations).
+            # Only the arbiter worker reads the port, so this can't drop another caller's response.
             if self.ser.in_waiting > 0:
                 self.ser.reset_input_buffer()
                 time.sleep(0.05)  # Brief pause after clearing buffer
 
             # Send the command
-            bytes_written = self.ser.write(command_bytes)
-            self.ser.flush()  # Ensure data is sent
+            with self.write_lock:
+                bytes_written = self.ser.write(command_bytes)
+                self.ser.flush()  # Ensure data is sent
 
             # Read response with timeout
             start_time = time.time()
@@ -180,8 +246,7 @@ class SerialCommunicator:
                         response_str = response.decode('utf-8', errors='ignore').strip()
                         if response_str:
                             responses.append(response_str)
-                            logging.debug(f"Received response: {response_str}")
-                            print(f"Response: {response_str}")
+                            logger.debug(f"Received response: {response_str}")
 
                             # Check if it's the final 'ok' response for multi-line commands
                             # For $$ and $# commands, GRBL ends with 'ok'
@@ -217,8 +282,7 @@ class SerialCommunicator:
                         if char == '\n' or char == '\r':  # End of line
                             if response_str.strip():  # Only add non-empty responses
                                 response_buffer.append(response_str.strip())
-                                logging.debug(f"Received response: {response_str.strip()}")
-                                print(f"Response: {response_str.strip()}")
+                                logger.debug(f"Received response: {response_str.strip()}")
                                 response_str = ""
                         else:
                             response_str += char  # Accumulate character
@@ -254,25 +318,19 @@ class SerialCommunicator:
                     return 'ok'
 
             # If we timed out without getting a proper response
-            logging.warning(f"Timeout waiting for response to command: {command_string}")
-            print(f"Timeout waiting for response to command: {command_string}")
-            print("Possible issues:")
-            print("  - Main power supply (12V/24V) is not connected to the CNC shield")
-            print("  - Motors or drivers are not receiving power")
-            print("  - GRBL controller is not fully operational without main power")
+            logger.warning(f"Timeout waiting for response to command: {command_string}")
+            logger.warning("Possible issues: main power supply (12V/24V) not connected to the CNC shield, "
+                           "motors or drivers not receiving power, GRBL not fully operational without main power")
             return None
 
         except serial.SerialException as e:
-            logging.error(f"Serial communication error when sending command '{command_string}': {e}")
+            logger.error(f"Serial communication error when sending command '{command_string}': {e}")
             if "write" in str(e).lower() or "output" in str(e).lower():
-                print(f"Cannot send command - device may not be properly powered: {e}")
-                print("Check that main power supply (12V/24V) is connected to the CNC shield")
-            else:
-                print(f"Serial error sending command: {e}")
+                logger.error(f"Cannot send command - device may not be properly powered: {e}")
+                logger.warning("Check that main power supply (12V/24V) is connected to the CNC shield")
             return None
         except Exception as e:
-            logging.error(f"Unexpected error sending command '{command_string}': {e}")
-            print(f"Error sending command: {e}")
+            logger.error(f"Unexpected error sending command '{command_string}': {e}")
             return None
     
     def get_available_ports(self):
@@ -347,35 +405,40 @@ class SerialCommunicator:
         
         if not filtered_ports:
             # If no filtered ports are found, return all ports as backup
-            logging.info("No GRBL-specific ports found, returning all available ports")
+            logger.info("No GRBL-specific ports found, returning all available ports")
             filtered_ports = list(all_ports)
         
         # Log what we found
         port_info = [(port.device, port.description) for port in filtered_ports]
-        logging.info(f"Filtered ports for GRBL devices: {port_info}")
+        logger.info(f"Filtered ports for GRBL devices: {port_info}")
         
         return filtered_ports
     
     def home_machine(self):
         """Send home command to the machine ($H)"""
-        print("Sending home command ($H) to machine...")
+        logger.info("Sending home command ($H) to machine...")
         result = self.send_command(b'$H\r')
         if result is None:
-            print("Home command sent but no confirmation received")
-            print("Check power connections to motors and drivers")
+            logger.warning("Home command sent but no confirmation received")
+            logger.warning("Check power connections to motors and drivers")
         return result
 
     def unlock_machine(self):
         """Send unlock command to the machine ($X)"""
-        print("Sending unlock command ($X) to machine...")
+        logger.info("Sending unlock command ($X) to machine...")
         result = self.send_command(b'$X\r')
         if result is None:
-            print("Unlock command sent but no confirmation received")
+            logger.warning("Unlock command sent but no confirmation received")
         return result
 
     def reset_alarm_state(self):
         """Send multiple commands to reset alarm state - for limit alarms like ALARM:2"""
-        print("Resetting alarm state...")
+        # Run the whole sequence as one job so no other command lands in the middle
+        return self.arbiter.call(self._reset_alarm_state, priority=PRIORITY_REALTIME)
+
+    def _reset_alarm_state(self):
+        """Unlock, soft reset, unlock again and report status (runs on the arbiter worker)"""
+        logger.info("Resetting alarm state...")
 
         # First try the regular unlock
         self.send_command(b'$X\r')
@@ -389,33 +452,33 @@ class SerialCommunicator:
 
         # Check status
         status = self.send_command(b'?\r')
-        print(f"Status after alarm reset attempt: {status}")
+        logger.info(f"Status after alarm reset attempt: {status}")
 
         return status
 
     def set_feed(self, feed_rate=2000):
         """Set feed rate (default 2000)"""
         command = f'F{feed_rate}\r'
-        print(f"Setting feed rate to {feed_rate}...")
+        logger.info(f"Setting feed rate to {feed_rate}...")
         result = self.send_command(command)
         if result is None:
-            print(f"Feed rate command sent but no confirmation received")
+            logger.warning(f"Feed rate command sent but no confirmation received")
         return result
 
     def set_origin(self):
         """Set work coordinate system origin (G92X0Y0)"""
-        print("Setting work coordinate system origin (G92X0Y0)...")
+        logger.info("Setting work coordinate system origin (G92X0Y0)...")
         result = self.send_command(b'G92X0Y0\r')
         if result is None:
-            print("Origin setting command sent but no confirmation received")
+            logger.warning("Origin setting command sent but no confirmation received")
         return result
 
     def set_relative_mode(self):
         """Set machine to relative coordinate mode (G91)"""
-        print("Setting machine to relative coordinate mode (G91)...")
+        logger.info("Setting machine to relative coordinate mode (G91)...")
         result = self.send_command(b'G91\r')
         if result is None:
-            print("Relative mode command sent but no confirmation received")
+            logger.warning("Relative mode command sent but no confirmation received")
         return result
 
     def jog_axis(self, x=0, y=0, z=0):
@@ -428,11 +491,11 @@ class SerialCommunicator:
             z (float): Z-axis movement distance
         """
         command = f'G1X{x}Y{y}Z{z}\r'
-        print(f"Sending jog command: {command.strip()}")
+        logger.info(f"Sending jog command: {command.strip()}")
         result = self.send_command(command)
         if result is None:
-            print("Jog command sent but no confirmation received")
-            print("Check that motors and drivers are properly powered")
+            logger.warning("Jog command sent but no confirmation received")
+            logger.warning("Check that motors and drivers are properly powered")
         return result
     
     def get_machine_status(self):
@@ -442,19 +505,29 @@ class SerialCommunicator:
         Returns:
             dict: Dictionary with status and position info
         """
+        try:
+            return self.arbiter.call(self._get_machine_status, priority=PRIORITY_REALTIME,
+                                     timeout=self.command_timeout)
+        except FutureTimeoutError:
+            logger.warning(f"Status query still queued after {self.command_timeout}s")
+            return None
+
+    def _get_machine_status(self):
+        """Query the status report (runs on the arbiter worker)"""
         if not self.ser or not self.ser.is_open:
-            logging.warning("No active serial connection")
-            print("No active serial connection")
+            logger.warning("No active serial connection")
             return None
 
         try:
             # Send the status query command '?'
+            started = time.perf_counter()
             command_bytes = b'?\r'
-            logging.debug(f"Sending status query command: {command_bytes}")
+            logger.debug(f"Sending status query command: {command_bytes}")
 
             # Send the command
-            bytes_written = self.ser.write(command_bytes)
-            self.ser.flush()  # Ensure data is sent
+            with self.write_lock:
+                bytes_written = self.ser.write(command_bytes)
+                self.ser.flush()  # Ensure data is sent
 
             # Read response with timeout
             response = None
@@ -465,18 +538,21 @@ class SerialCommunicator:
                 if self.ser.in_waiting > 0:
                     response = self.ser.readline()
                     response_str = response.decode('utf-8', errors='ignore').strip()
-                    logging.debug(f"Received status response: {response_str}")
-                    print(f"Status response: {response_str}")
+                    if not response_str.startswith('<'):
+                        # A leftover 'ok' or message from an earlier exchange, not the report
+                        logger.debug(f"Skipping non-status line: {response_str}")
+                        continue
+                    logger.debug(f"Received status response: {response_str}")
+                    SERIAL_COMMAND_SECONDS.labels('status_report').observe(time.perf_counter() - started)
                     return response_str
                 time.sleep(0.05)
 
-            logging.warning("Timeout waiting for status response")
-            print("Timeout waiting for status response")
+            SERIAL_COMMAND_FAILURES.labels('status_report').inc()
+            logger.warning("Timeout waiting for status response")
             return None
 
         except Exception as e:
-            logging.error(f"Error getting machine status: {e}")
-            print(f"Error getting machine status: {e}")
+            logger.error(f"Error getting machine status: {e}")
             return None
 
     def send_raw_command(self, raw_command):
@@ -493,7 +569,7 @@ class SerialCommunicator:
         if not raw_command.endswith('\r'):
             raw_command += '\r'
 
-        print(f"Sending raw command: {raw_command}")
+        logger.debug(f"Sending raw command: {raw_command!r}")
         return self.send_command(raw_command)
 
     def get_settings_list(self):
@@ -504,7 +580,7 @@ class SerialCommunicator:
             str: Response from the machine with all settings, or None if error
         """
         # Use the main send_command method which already handles multi-line responses for $$
-        logging.info("Requesting GRBL settings list ($$)")
+        logger.info("Requesting GRBL settings list ($$)")
         return self.send_command('$$')
 
     def get_parameters_list(self):
@@ -515,7 +591,7 @@ class SerialCommunicator:
             str: Response from the machine with all parameters, or None if error
         """
         # Use the main send_command method which already handles multi-line responses for $#
-        logging.info("Requesting GRBL parameters list ($#)")
+        logger.info("Requesting GRBL parameters list ($#)")
         return self.send_command('$#')
 
 
@@ -0,0 +1,503 @@
+"""
+Session Store Module for theSmallComparator
+Persists measurement sessions (points, images and machine state) in SQLite
+"""
+
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.session')
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    part TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    closed_at REAL,
+    point_count INTEGER NOT NULL DEFAULT 0,
+    last_x REAL,
+    last_y REAL,
+    state TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_part ON sessions (part, created_at);
+CREATE INDEX IF NOT EXISTS idx_sessions_created ON sessions (created_at);
+
+CREATE TABLE IF NOT EXISTS points (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    seq INTEGER NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    z REAL,
+    recorded_at REAL NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_points_session_seq ON points (session_id, seq);
+CREATE INDEX IF NOT EXISTS idx_points_session_time ON points (session_id, recorded_at);
+
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    captured_at REAL NOT NULL,
+    x REAL,
+    y REAL,
+    z REAL,
+    mimetype TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_images_session_time ON images (session_id, captured_at);
+
+CREATE TABLE IF NOT EXISTS machine_state (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id INTEGER NOT NULL REFERENCES sessions (id),
+    recorded_at REAL NOT NULL,
+    mode TEXT,
+    status TEXT,
+    state TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_machine_state_session_time ON machine_state (session_id, recorded_at);
+"""
+
+INSERT_POINT = "INSERT OR REPLACE INTO points (session_id, seq, x, y, z, recorded_at) VALUES (?, ?, ?, ?, ?, ?)"
+INSERT_IMAGE = "INSERT INTO images (session_id, captured_at, x, y, z, mimetype, data) VALUES (?, ?, ?, ?, ?, ?, ?)"
+INSERT_MACHINE_STATE = "INSERT INTO machine_state (session_id, recorded_at, mode, status, state) VALUES (?, ?, ?, ?, ?)"
+
+
+class SessionStore:
+    """
+    Class to persist measurement sessions in a SQLite database in WAL mode.
+
+    All writes go through a single background writer thread that batches
+    them into one transaction per flush; reads use a per-thread connection
+    and never wait on the writer.
+    """
+
+    def __init__(self, db_path, batch_size=200, flush_interval=0.25):
+        """
+        Open (or create) the session database and start the writer thread
+
+        Args:
+            db_path (str): Path of the SQLite database file
+            batch_size (int): Number of queued writes that triggers a flush
+            flush_interval (float): Maximum time in seconds a write stays queued
+        """
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._queue = queue.Queue()
+        self._closed = False
+
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.commit()
+        conn.close()
+
+        self._writer_thread = threading.Thread(target=self._writer_loop, name="SessionStoreWriter", daemon=True)
+        self._writer_thread.start()
+        logger.info(f"Session store opened at {db_path}")
+
+    def _connect(self):
+        """Open a new connection with the pragmas used by every connection"""
+        conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _reader(self):
+        """Get the read connection of the calling thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    # --- Writer thread ---
+
+    def _writer_loop(self):
+        """Drain the write queue, committing batches of statements in one transaction"""
+        conn = self._connect()
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            # Flush requests must not wait for the rest of the interval
+            while len(batch) < self.batch_size and not isinstance(batch[-1], threading.Event):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._write_batch(conn, batch)
+            if stop:
+                break
+        conn.close()
+
+    def _write_batch(self, conn, batch):
+        """
+        Write one batch of queued operations in a single transaction. If the
+        transaction fails, the operations are retried one at a time so only
+        the failing ones are lost.
+        """
+        events = [item for item in batch if isinstance(item, threading.Event)]
+        statements = [item for item in batch if not isinstance(item, threading.Event)]
+        try:
+            self._write_statements(conn, statements)
+        except Exception as e:
+            logger.warning(f"Error writing {len(statements)} session store operations ({e}), retrying one by one")
+            for statement in statements:
+                try:
+                    self._write_statements(conn, [statement])
+                except Exception as e:
+                    logger.error(f"Dropping session store operation {statement[0].split('(')[0].strip()}: {e}")
+        finally:
+            for event in events:
+                event.set()
+
+    def _write_statements(self, conn, statements):
+        """Execute operations and their session summary updates in one transaction"""
+        with conn:
+            # Group consecutive operations on the same statement for executemany
+            index = 0
+            while index < len(statements):
+                sql, _ = statements[index]
+                end = index
+                while end < len(statements) and statements[end][0] == sql:
+                    end += 1
+                conn.executemany(sql, [params for _, params in statements[index:end]])
+                index = end
+            self._update_point_summaries(conn, statements)
+
+    def _update_point_summaries(self, conn, statements):
+        """Keep the per-session point count and last point current, so resuming needs a single row"""
+        last_points = {}
+        for sql, params in statements:
+            if sql == INSERT_POINT:
+                last_points[params[0]] = params
+        for session_id, (_, seq, x, y, _, recorded_at) in last_points.items():
+            conn.execute(
+                "UPDATE sessions SET point_count = MAX(point_count, ?), last_x = ?, last_y = ?, updated_at = ? "
+                "WHERE id = ?",
+                (seq + 1, x, y, recorded_at, session_id)
+            )
+
+    def _enqueue(self, sql, params):
+        if self._closed:
+            logger.warning("Session store is closed, dropping write")
+            return
+        self._queue.put((sql, params))
+
+    def flush(self, timeout=5.0):
+        """
+        Block until every write queued so far is committed
+
+        Args:
+            timeout (float): Maximum time to wait in seconds
+
+        Returns:
+            bool: True if the queue was flushed in time
+        """
+        if self._closed:
+            return True
+        event = threading.Event()
+        self._queue.put(event)
+        return event.wait(timeout)
+
+    def close(self):
+        """Flush pending writes and stop the writer thread"""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._writer_thread.join(timeout=5.0)
+        logger.info("Session store closed")
+
+    # --- Sessions ---
+
+    def create_session(self, name=None, part=None, state=None):
+        """
+        Create a new measurement session
+
+        Args:
+            name (str): Session name (defaults to a timestamp)
+            part (str): Part identifier used for indexed lookups
+            state (dict): Initial application state
+
+        Returns:
+            int: ID of the new session
+        """
+        now = time.time()
+        name = name or time.strftime('Session %Y-%m-%d %H:%M:%S')
+        # Session rows are written synchronously since the caller needs the ID
+        self.flush()
+        conn = self._connect()
+        try:
+            with conn:
+                cursor = conn.execute(
+                    "INSERT INTO sessions (name, part, created_at, updated_at, state) VALUES (?, ?, ?, ?, ?)",
+                    (name, part, now, now, json.dumps(state or {}))
+                )
+            session_id = cursor.lastrowid
+        finally:
+            conn.close()
+        logger.info(f"Created session {session_id} ({name}, part={part})")
+        return session_id
+
+    def close_session(self, session_id):
+        """Mark a session as closed so it is not resumed automatically"""
+        self.flush()
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute("UPDATE sessions SET closed_at = ? WHERE id = ?", (time.time(), session_id))
+        finally:
+            conn.close()
+
+    def update_session_state(self, session_id, state):
+        """
+        Save the application state (feed rate, jog distance, differences...) of a session
+
+        Args:
+            session_id (int): Session ID
+            state (dict): JSON-serializable state
+        """
+        self._enqueue("UPDATE sessions SET state = ?, updated_at = ? WHERE id = ?",
+                      (json.dumps(state), time.time(), session_id))
+
+    def get_session(self, session_id):
+        """
+        Get the summary row of a session (no points are loaded)
+
+        Returns:
+            dict: Session summary or None if not found
+        """
+        row = self._reader().execute("SELECT * FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return _session_to_dict(row) if row else None
+
+    def get_latest_open_session(self):
+        """
+        Get the most recently updated session that was not closed
+
+        Returns:
+            dict: Session summary or None
+        """
+        row = self._reader().execute(
+            "SELECT * FROM sessions WHERE closed_at IS NULL ORDER BY updated_at DESC LIMIT 1"
+        ).fetchone()
+        return _session_to_dict(row) if row else None
+
+    def list_sessions(self, part=None, since=None, until=None, limit=50):
+        """
+        List sessions, newest first
+
+        Args:
+            part (str): Only sessions for this part
+            since (float): Only sessions created at or after this UNIX time
+            until (float): Only sessions created before this UNIX time
+            limit (int): Maximum number of sessions
+
+        Returns:
+            list: Session summaries
+        """
+        clauses, params = [], []
+        if part is not None:
+            clauses.append("part = ?")
+            params.append(part)
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._reader().execute(
+            f"SELECT * FROM sessions {where} ORDER BY created_at DESC LIMIT ?", params + [limit]
+        ).fetchall()
+        return [_session_to_dict(row) for row in rows]
+
+    # --- Points ---
+
+    def add_point(self, session_id, seq, x, y, z=None, recorded_at=None):
+        """
+        Queue a point for insertion
+
+        Args:
+            session_id (int): Session ID
+            seq (int): Index of the point in the session
+            x (float): X coordinate
+            y (float): Y coordinate
+            z (float): Z coordinate if known
+            recorded_at (float): UNIX time of the measurement (defaults to now)
+        """
+        self._enqueue(INSERT_POINT, (session_id, seq, x, y, z, recorded_at or time.time()))
+
+    def iter_points(self, session_id, since=None, until=None, batch_size=5000):
+        """
+        Iterate over the points of a session in recording order without loading them all
+
+        Args:
+            session_id (int): Session ID
+            since (float): Only points recorded at or after this UNIX time
+            until (float): Only points recorded before this UNIX time
+            batch_size (int): Number of rows fetched per round trip
+
+        Yields:
+            dict: Point dictionaries with x, y, z and recorded_at
+        """
+        sql = "SELECT seq, x, y, z, recorded_at FROM points WHERE session_id = ?"
+        params = [session_id]
+        if since is not None:
+            sql += " AND recorded_at >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND recorded_at < ?"
+            params.append(until)
+        sql += " ORDER BY seq"
+
+        # A dedicated connection keeps the cursor valid while the caller yields
+        conn = self._connect()
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    point = {'x': row['x'], 'y': row['y']}
+                    if row['z'] is not None:
+                        point['z'] = row['z']
+                    point['recorded_at'] = row['recorded_at']
+                    yield point
+        finally:
+            conn.close()
+
+    # --- Images ---
+
+    def add_image(self, session_id, data, mimetype='image/jpeg', position=None, captured_at=None):
+        """
+        Queue an encoded image for insertion
+
+        Args:
+            session_id (int): Session ID
+            data (bytes): Encoded image
+            mimetype (str): Image mimetype
+            position (dict): Stage position ('x', 'y', 'z') when the image was taken
+            captured_at (float): UNIX time of capture (defaults to now)
+        """
+        position = position or {}
+        self._enqueue(INSERT_IMAGE, (session_id, captured_at or time.time(), position.get('x'),
+                                     position.get('y'), position.get('z'), mimetype, sqlite3.Binary(data)))
+
+    def list_images(self, session_id, since=None, until=None, limit=500):
+        """
+        List image metadata (without the image data) for a session
+
+        Returns:
+            list: Image metadata dictionaries
+        """
+        sql = "SELECT id, captured_at, x, y, z, mimetype, LENGTH(data) AS size FROM images WHERE session_id = ?"
+        params = [session_id]
+        if since is not None:
+            sql += " AND captured_at >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND captured_at < ?"
+            params.append(until)
+        sql += " ORDER BY captured_at LIMIT ?"
+        rows = self._reader().execute(sql, params + [limit]).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_image(self, image_id):
+        """
+        Get an image
+
+        Returns:
+            tuple: (mimetype, bytes) or None if not found
+        """
+        row = self._reader().execute("SELECT mimetype, data FROM images WHERE id = ?", (image_id,)).fetchone()
+        return (row['mimetype'], bytes(row['data'])) if row else None
+
+    # --- Machine state ---
+
+    def add_machine_state(self, session_id, mode, status, state=None, recorded_at=None):
+        """
+        Queue a machine state snapshot for insertion
+
+        Args:
+            session_id (int): Session ID
+            mode (str): Controller mode (GRBL, Klipper...)
+            status (str): Raw status report
+            state (dict): Additional JSON-serializable state
+            recorded_at (float): UNIX time (defaults to now)
+        """
+        self._enqueue(INSERT_MACHINE_STATE, (session_id, recorded_at or time.time(), mode, status,
+                                             json.dumps(state or {})))
+
+    def get_machine_states(self, session_id, since=None, until=None, limit=500):
+        """
+        Get machine state snapshots for a session in time order
+
+        Returns:
+            list: Machine state dictionaries
+        """
+        sql = "SELECT recorded_at, mode, status, state FROM machine_state WHERE session_id = ?"
+        params = [session_id]
+        if since is not None:
+            sql += " AND recorded_at >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND recorded_at < ?"
+            params.append(until)
+        sql += " ORDER BY recorded_at LIMIT ?"
+        rows = self._reader().execute(sql, params + [limit]).fetchall()
+        return [{**dict(row), 'state': json.loads(row['state'] or '{}')} for row in rows]
+
+
+def _session_to_dict(row):
+    """Convert a sessions row to a dictionary with the state decoded"""
+    session = dict(row)
+    session['state'] = json.loads(session['state'] or '{}')
+    return session
+
+
+if __name__ == "__main__":
+    # Test the SessionStore class with a temporary database
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SessionStore(os.path.join(tmp, "sessions.db"))
+        session_id = store.create_session(part="TEST-PART")
+        for i in range(10000):
+            store.add_point(session_id, i, i * 0.1, i * 0.2)
+        store.flush()
+        start = time.perf_counter()
+        print(f"Summary: {store.get_session(session_id)}")
+        print(f"Summary lookup took {(time.perf_counter() - start) * 1000:.2f} ms")
+        print(f"Points read back: {sum(1 for _ in store.iter_points(session_id))}")
+        store.close()
@@ -0,0 +1,327 @@
+"""
+Startup Profiler Module for theSmallComparator
+Records a timeline of module imports, startup phases and first-frame latency
+"""
+
+import contextlib
+import importlib.abc
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.startup')
+
+
+# Profile written next to the session database unless another path is given
+DEFAULT_PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'startup_profile.json')
+
+# Number of slowest imports listed in the report summary
+TOP_IMPORTS = 25
+
+_active_profiler = None
+
+
+class _TimedLoader:
+    """
+    Loader wrapper that times exec_module of the wrapped loader. Everything
+    else (create_module, get_resource_reader, ...) is delegated unchanged.
+    """
+
+    def __init__(self, loader, profiler, fullname):
+        self._loader = loader
+        self._profiler = profiler
+        self._fullname = fullname
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        profiler = self._profiler
+        stack = profiler._import_stack()
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            end = time.perf_counter()
+            children = stack.pop()
+            cumulative = end - start
+            if stack:
+                stack[-1] += cumulative
+            profiler.record(self._fullname, start, end, category='import',
+                            self_time=cumulative - children, depth=len(stack))
+
+
+class _ImportTimingFinder(importlib.abc.MetaPathFinder):
+    """Meta path finder that lets the normal finders locate a module, then wraps its loader"""
+
+    def __init__(self, profiler):
+        self._profiler = profiler
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path, target=None):
+        searching = getattr(self._local, 'searching', None)
+        if searching is None:
+            searching = self._local.searching = set()
+        if fullname in searching:
+            return None
+
+        searching.add(fullname)
+        try:
+            spec = None
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+        finally:
+            searching.discard(fullname)
+
+        if spec is None or spec.loader is None or not hasattr(spec.loader, 'exec_module'):
+            return spec
+        spec.loader = _TimedLoader(spec.loader, self._profiler, fullname)
+        return spec
+
+
+class StartupProfiler:
+    """
+    Class to collect timed startup events relative to profiler creation.
+
+    Events are imports (via a meta path hook), phases (context manager or
+    explicit start/end times) and marks (single points in time such as the
+    first captured frame).
+    """
+
+    def __init__(self, output_path=DEFAULT_PROFILE_PATH):
+        """
+        Initialize the profiler
+
+        Args:
+            output_path (str): JSON file written by write_report()
+        """
+        self.output_path = output_path
+        self.started_at = time.time()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._events = []
+        self._marks = {}
+        self._local = threading.local()
+        self._finder = None
+
+    def _import_stack(self):
+        stack = getattr(self._local, 'import_stack', None)
+        if stack is None:
+            stack = self._local.import_stack = []
+        return stack
+
+    def install_import_hook(self):
+        """Start timing every module imported from now on"""
+        if self._finder is None:
+            self._finder = _ImportTimingFinder(self)
+            sys.meta_path.insert(0, self._finder)
+
+    def remove_import_hook(self):
+        if self._finder is not None:
+            try:
+                sys.meta_path.remove(self._finder)
+            except ValueError:
+                pass
+            self._finder = None
+
+    def record(self, name, start, end, category='phase', **extra):
+        """
+        Record a finished event
+
+        Args:
+            name (str): Event name (module name for imports)
+            start (float): time.perf_counter() at the start
+            end (float): time.perf_counter() at the end
+            category (str): 'import', 'phase', 'startup'...
+        """
+        event = {
+            'name': name,
+            'category': category,
+            'start': round(start - self._t0, 6),
+            'duration': round(end - start, 6),
+            'thread': threading.current_thread().name,
+        }
+        for key, value in extra.items():
+            event[key] = round(value, 6) if isinstance(value, float) else value
+        with self._lock:
+            self._events.append(event)
+
+    @contextlib.contextmanager
+    def phase(self, name, category='phase'):
+        """Time the enclosed block as a named phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter(), category=category)
+
+    def mark(self, name):
+        """
+        Record the first time a named point is reached
+
+        Returns:
+            bool: True if this call set the mark, False if it already existed
+        """
+        now = round(time.perf_counter() - self._t0, 6)
+        with self._lock:
+            if name in self._marks:
+                return False
+            self._marks[name] = now
+        logger.info(f"Startup mark {name} at {now:.3f}s")
+        return True
+
+    def report(self):
+        """
+        Build the profile report
+
+        Returns:
+            dict: Timeline, marks and the slowest imports
+        """
+        with self._lock:
+            events = sorted(self._events, key=lambda event: event['start'])
+            marks = dict(self._marks)
+
+        imports = [event for event in events if event['category'] == 'import']
+        slowest = sorted(imports, key=lambda event: event['self_time'], reverse=True)[:TOP_IMPORTS]
+        return {
+            'started_at': self.started_at,
+            'process_age_at_start': _process_age(self.started_at),
+            'elapsed': round(time.perf_counter() - self._t0, 6),
+            'python': sys.version.split()[0],
+            'marks': marks,
+            'import_count': len(imports),
+            'import_time': round(sum(event['self_time'] for event in imports), 6),
+            'slowest_imports': [{'name': event['name'], 'self_time': event['self_time'],
+                                 'cumulative': event['duration']} for event in slowest],
+            'timeline': events,
+        }
+
+    def write_report(self, path=None):
+        """
+        Write the report as JSON
+
+        Args:
+            path (str): Output file, defaults to output_path
+
+        Returns:
+            str: Path written, or None on error
+        """
+        path = path or self.output_path
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            temp_path = f"{path}.tmp"
+            with open(temp_path, 'w') as f:
+                json.dump(self.report(), f, indent=2)
+            os.replace(temp_path, path)
+            logger.info(f"Startup profile written to {path}")
+            return path
+        except OSError as e:
+            logger.error(f"Could not write startup profile: {e}")
+            return None
+
+
+def _process_age(at_time):
+    """Seconds between process creation and at_time (Linux only, None elsewhere)"""
+    try:
+        with open('/proc/self/stat') as f:
+            # Fields after the parenthesized command name; starttime is field 22
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        boot_time = time.time() - uptime
+        return round(at_time - (boot_time + start_ticks / os.sysconf('SC_CLK_TCK')), 3)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def start_profiling(output_path=None):
+    """
+    Create the process-wide profiler and start timing imports.
+    Call before importing the rest of the application.
+
+    Args:
+        output_path (str): JSON output file, defaults to DEFAULT_PROFILE_PATH
+
+    Returns:
+        StartupProfiler: The active profiler
+    """
+    global _active_profiler
+    if _active_profiler is None:
+        _active_profiler = StartupProfiler(output_path or DEFAULT_PROFILE_PATH)
+        _active_profiler.install_import_hook()
+        logger.info("Startup profiling enabled")
+    return _active_profiler
+
+
+def get_profiler():
+    """Get the active profiler, or None if profiling is disabled"""
+    return _active_profiler
+
+
+def profile_phase(name, category='phase'):
+    """Time a block if profiling is enabled; a no-op context otherwise"""
+    if _active_profiler is None:
+        return contextlib.nullcontext()
+    return _active_profiler.phase(name, category=category)
+
+
+def mark(name, write=False):
+    """
+    Record a mark if profiling is enabled
+
+    Args:
+        name (str): Mark name
+        write (bool): Rewrite the JSON report when the mark is new (for
+            events that happen after startup, such as the first frame)
+
+    Returns:
+        bool: True if the mark was recorded by this call
+    """
+    profiler = _active_profiler
+    if profiler is None or not profiler.mark(name):
+        return False
+    if write:
+        profiler.write_report()
+    return True
+
+
+def finish_profiling():
+    """
+    Mark startup as complete, stop timing imports and write the report once
+
+    Returns:
+        bool: True if this call finished profiling
+    """
+    profiler = _active_profiler
+    if profiler is None or not profiler.mark('startup_ready'):
+        return False
+    profiler.remove_import_hook()
+    profiler.write_report()
+    return True
+
+
+if __name__ == "__main__":
+    # Test the StartupProfiler by timing a few imports
+    profiler = start_profiling(output_path=os.path.join('/tmp', 'startup_profile_test.json'))
+    with profile_phase('import_numeric_modules'):
+        import decimal
+        import fractions
+    mark('first_frame')
+    finish_profiling()
+    summary = profiler.report()
+    print(f"Imports: {summary['import_count']} in {summary['import_time']:.3f}s")
+    for entry in summary['slowest_imports'][:5]:
+        print(f"  {entry['name']}: {entry['self_time'] * 1000:.1f} ms")
@@ -0,0 +1,372 @@
+"""
+Stream Encoder Module for theSmallComparator
+Handles per-client MJPEG stream settings, shared JPEG encode tiers and adaptation to client throughput
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple
+
+import metrics
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.web')
+
+
+# Requested sizes and qualities snap to these so clients share a few encode tiers
+STREAM_WIDTHS = (320, 480, 640)
+QUALITY_STEP = 10
+MIN_QUALITY = 30
+MAX_QUALITY = 95
+DEFAULT_QUALITY = 95  # OpenCV's default, what the stream always used
+DEFAULT_FPS = 30
+MAX_FPS = 30
+
+# Adaptive streams step down this ladder (width, quality) when the client can't keep up
+ADAPTIVE_LADDER = ((640, 80), (640, 70), (480, 60), (320, 50), (320, 40))
+
+# Region-of-interest streams: zoom factors relative to the full field of view, and the
+# qualities an adaptive ROI stream steps through (its size is fixed by the zoom)
+ZOOM_LEVELS = (1.5, 2, 3, 4, 6, 8)
+ROI_QUALITY_LADDER = (80, 70, 60, 50, 40)
+MAX_ROI_WIDTH = 960
+
+
+# roi is None for the whole frame, else (zoom, center_x, center_y) with the centre as a
+# fraction of the frame size (0.5, 0.5 is the reticle)
+StreamTier = namedtuple('StreamTier', ['width', 'height', 'quality', 'roi'], defaults=(None,))
+
+
+def make_tier(width, quality, frame_size):
+    """
+    Snap a requested size and quality to a shared tier
+
+    Args:
+        width (int): Requested width in pixels
+        quality (int): Requested JPEG quality (1-100)
+        frame_size (tuple): (width, height) of captured frames
+
+    Returns:
+        StreamTier: The tier, never larger than the captured frame
+    """
+    frame_width, frame_height = frame_size
+    widths = [w for w in STREAM_WIDTHS if w <= frame_width] or [frame_width]
+    width = min(widths, key=lambda w: abs(w - width))
+    quality = int(round(quality / QUALITY_STEP) * QUALITY_STEP) if quality != DEFAULT_QUALITY else quality
+    quality = max(MIN_QUALITY, min(MAX_QUALITY, quality))
+    return StreamTier(width, width * frame_height // frame_width, quality)
+
+
+def snap_zoom(zoom):
+    """Nearest zoom level, or None for the whole frame"""
+    if not zoom or zoom <= 1:
+        return None
+    return min(ZOOM_LEVELS, key=lambda level: abs(level - zoom))
+
+
+def roi_rect(frame_shape, roi):
+    """
+    Crop rectangle of a region of interest
+
+    Args:
+        frame_shape (tuple): Shape of the source frame
+        roi (tuple): (zoom, center_x, center_y)
+
+    Returns:
+        tuple: (x, y, width, height) in source pixels, inside the frame
+    """
+    height, width = frame_shape[:2]
+    zoom, center_x, center_y = roi
+    crop_width = max(2, int(round(width / zoom)))
+    crop_height = max(2, int(round(height / zoom)))
+    x = min(max(0, int(round(center_x * width - crop_width / 2))), width - crop_width)
+    y = min(max(0, int(round(center_y * height - crop_height / 2))), height - crop_height)
+    return x, y, crop_width, crop_height
+
+
+def make_roi_tier(template, frame_shape):
+    """
+    Resolve an ROI tier for a source frame size: the crop is encoded at
+    native resolution (one sensor pixel per output pixel) unless it is
+    wider than the template's width, in which case it is scaled down
+
+    Args:
+        template (StreamTier): Tier with the maximum width, the quality and the ROI
+        frame_shape (tuple): Shape of the source frame
+
+    Returns:
+        StreamTier: Tier with the output size filled in
+    """
+    _, _, crop_width, crop_height = roi_rect(frame_shape, template.roi)
+    scale = min(1.0, template.width / crop_width)
+    return template._replace(width=max(2, int(crop_width * scale)), height=max(2, int(crop_height * scale)))
+
+
+class StreamSettings:
+    """
+    What one /video_feed client asked for, and for adaptive clients the
+    tier it currently gets.
+
+    Adaptive clients start at the top of ADAPTIVE_LADDER (capped by any
+    requested size/quality). The time the server takes to write each frame
+    to the client is compared with the frame interval: a client that needs
+    most of the interval is stepped down a tier, one that stays well under
+    it for a while is stepped back up.
+    """
+
+    DOWNGRADE_RATIO = 0.8   # Write time / frame interval that counts as falling behind
+    UPGRADE_RATIO = 0.25    # Write time / frame interval that counts as having headroom
+    UPGRADE_AFTER = 45      # Frames of headroom before stepping up
+    SMOOTHING = 0.2
+
+    def __init__(self, frame_size, width=None, quality=None, fps=None, adaptive=False,
+                 zoom=None, center_x=0.5, center_y=0.5):
+        """
+        Args:
+            frame_size (tuple): (width, height) of captured frames
+            width (int): Requested width, defaults to the frame width
+            quality (int): Requested JPEG quality
+            fps (float): Maximum frames per second for this client
+            adaptive (bool): Adapt the tier to the measured client throughput
+            zoom (float): Stream only the region of interest, this many times magnified
+            center_x (float): ROI centre as a fraction of the frame width (0.5 = reticle)
+            center_y (float): ROI centre as a fraction of the frame height
+        """
+        self.frame_size = frame_size
+        self.fps = max(1.0, min(float(fps or DEFAULT_FPS), MAX_FPS))
+        self.adaptive = adaptive
+        zoom = snap_zoom(zoom)
+        self.roi = None
+        if zoom:
+            self.roi = (zoom, round(min(max(center_x, 0.0), 1.0), 2), round(min(max(center_y, 0.0), 1.0), 2))
+        top = make_tier(width or frame_size[0], quality or DEFAULT_QUALITY, frame_size)
+        if self.roi:
+            # Templates resolved against the source frame size by tier_for()
+            quality = top.quality
+            qualities = [quality] + [q for q in ROI_QUALITY_LADDER if q < quality] if adaptive else [quality]
+            self.ladder = [StreamTier(min(width or MAX_ROI_WIDTH, MAX_ROI_WIDTH), 0, q, self.roi) for q in qualities]
+        elif adaptive:
+            ladder = [make_tier(w, q, frame_size) for w, q in ADAPTIVE_LADDER]
+            # Only tiers no bigger and no better than what the client asked for
+            self.ladder = [tier for tier in ladder
+                           if tier.width <= top.width and tier.quality <= top.quality] or [top]
+        else:
+            self.ladder = [top]
+        self.level = 0
+        self._write_ratio = None
+        self._headroom_frames = 0
+        self.bytes_per_second = None
+
+    @property
+    def tier(self):
+        return self.ladder[self.level]
+
+    def tier_for(self, frame_shape):
+        """
+        The tier to encode frames of this shape at
+
+        Args:
+            frame_shape (tuple): Shape of the frames the stream is fed (native frames for ROI streams)
+
+        Returns:
+            StreamTier: Current tier
+        """
+        if self.roi:
+            return make_roi_tier(self.tier, frame_shape)
+        return self.tier
+
+    @property
+    def interval(self):
+        return 1.0 / self.fps
+
+    @property
+    def is_default(self):
+        """True if this is the plain full-size stream the pipeline encoder produces"""
+        return (not self.adaptive and self.fps == DEFAULT_FPS and self.roi is None
+                and self.tier == make_tier(self.frame_size[0], DEFAULT_QUALITY, self.frame_size))
+
+    def record_write(self, seconds, nbytes):
+        """
+        Account for one frame written to the client
+
+        Args:
+            seconds (float): Time the server took to write it
+            nbytes (int): Frame size in bytes
+        """
+        if seconds > 0:
+            rate = nbytes / seconds
+            self.bytes_per_second = rate if self.bytes_per_second is None else (
+                self.bytes_per_second + self.SMOOTHING * (rate - self.bytes_per_second))
+        if not self.adaptive:
+            return
+        ratio = seconds / self.interval
+        if self._write_ratio is None:
+            self._write_ratio = ratio
+        else:
+            self._write_ratio += self.SMOOTHING * (ratio - self._write_ratio)
+
+        if self._write_ratio > self.DOWNGRADE_RATIO and self.level < len(self.ladder) - 1:
+            self._change_level(self.level + 1)
+        elif self._write_ratio < self.UPGRADE_RATIO and self.level > 0:
+            self._headroom_frames += 1
+            if self._headroom_frames >= self.UPGRADE_AFTER:
+                self._change_level(self.level - 1)
+        else:
+            self._headroom_frames = 0
+
+    def _change_level(self, level):
+        logger.debug(f"Stream tier {self.tier} -> {self.ladder[level]} (write/interval {self._write_ratio:.2f})")
+        self.level = level
+        # Measure the new tier from scratch
+        self._write_ratio = None
+        self._headroom_frames = 0
+
+    def describe(self):
+        tier = self.tier
+        return {'width': tier.width, 'height': tier.height, 'quality': tier.quality, 'fps': self.fps,
+                'adaptive': self.adaptive, 'level': self.level, 'roi': self.roi,
+                'bytes_per_second': round(self.bytes_per_second) if self.bytes_per_second else None}
+
+
+class _TierEntry:
+    __slots__ = ('lock', 'seq', 'jpeg', 'canvas', 'clients', 'encodes', 'hits')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = None
+        self.jpeg = None
+        self.canvas = None
+        self.clients = 0
+        self.encodes = 0
+        self.hits = 0
+
+
+class TierEncoder:
+    """
+    JPEG encoder shared by all stream clients: each frame is encoded once
+    per tier, and clients on the same tier reuse the result. Every tier has
+    its own lock and preallocated resize buffer, so tiers encode in
+    parallel and nothing is allocated per frame except the JPEG itself.
+    A tier (and its buffer) lives while clients are attached to it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tiers = {}
+
+    def _entry(self, tier):
+        with self._lock:
+            entry = self._tiers.get(tier)
+            if entry is None:
+                entry = self._tiers[tier] = _TierEntry()
+            return entry
+
+    def attach(self, tier):
+        """Count a client on a tier (for stats)"""
+        entry = self._entry(tier)
+        with self._lock:
+            entry.clients += 1
+        metrics.STREAM_TIER_CLIENTS.labels(_tier_label(tier)).inc()
+
+    def detach(self, tier):
+        """Uncount a client; a tier without clients is dropped with its buffers"""
+        entry = self._entry(tier)
+        with self._lock:
+            entry.clients -= 1
+            if entry.clients <= 0 and self._tiers.get(tier) is entry:
+                # Region of interest centres are free parameters, so unused tiers must not pile up
+                del self._tiers[tier]
+        metrics.STREAM_TIER_CLIENTS.labels(_tier_label(tier)).dec()
+
+    def encode(self, tier, frame, seq):
+        """
+        Get the JPEG of a frame at a tier, encoding it only if no other client has
+
+        Args:
+            tier (StreamTier): Output size and quality
+            frame (numpy.ndarray): BGR frame (not modified), or None for black
+            seq: Value identifying the frame (sequence number and capture time)
+
+        Returns:
+            bytes: JPEG data, or None if encoding failed
+        """
+        import cv2 as cv
+        import numpy as np
+        from frame_pipeline import draw_crosshair
+
+        entry = self._entry(tier)
+        with entry.lock:
+            if entry.seq == seq and entry.jpeg is not None:
+                entry.hits += 1
+                return entry.jpeg
+            if entry.canvas is None:
+                entry.canvas = np.zeros((tier.height, tier.width, 3), dtype=np.uint8)
+            canvas = entry.canvas
+            reticle = None
+            if frame is not None and tier.roi is not None:
+                # Crop is a view into the source frame; only the region is resized/encoded
+                source_height, source_width = frame.shape[:2]
+                x, y, crop_width, crop_height = roi_rect(frame.shape, tier.roi)
+                frame = frame[y:y + crop_height, x:x + crop_width]
+                # Where the frame centre (the reticle) falls in the output
+                scale = tier.width / crop_width
+                reticle = (int((source_width / 2 - x) * scale), int((source_height / 2 - y) * scale))
+            if frame is None:
+                canvas.fill(0)
+            elif frame.shape[:2] == canvas.shape[:2]:
+                np.copyto(canvas, frame)
+            else:
+                cv.resize(frame, (tier.width, tier.height), dst=canvas, interpolation=cv.INTER_AREA)
+            draw_crosshair(canvas, reticle)
+            with metrics.FRAME_ENCODE_SECONDS.time():
+                ret, buffer = cv.imencode('.jpg', canvas, [cv.IMWRITE_JPEG_QUALITY, tier.quality])
+            if not ret:
+                return None
+            entry.seq = seq
+            entry.jpeg = buffer.tobytes()
+            entry.encodes += 1
+            return entry.jpeg
+
+    def stats(self):
+        """
+        Returns:
+            list: Per tier: size, quality, region of interest, clients, encodes and cache hits
+        """
+        with self._lock:
+            items = list(self._tiers.items())
+        return [{'width': tier.width, 'height': tier.height, 'quality': tier.quality, 'roi': tier.roi,
+                 'clients': entry.clients, 'encodes': entry.encodes, 'shared': entry.hits}
+                for tier, entry in items]
+
+
+def _tier_label(tier):
+    """
+    Metric label of a tier. Region of interest tiers are labelled by zoom (one
+    of ZOOM_LEVELS) and quality only: their centre and width are free request
+    parameters and would make the number of series unbounded.
+    """
+    if tier.roi is not None:
+        return f"roi{tier.roi[0]:g}q{tier.quality}"
+    return f"{tier.width}x{tier.height}q{tier.quality}"
+
+
+def pace(started, interval):
+    """Sleep for the rest of a frame interval that began at `started` (perf_counter)"""
+    remaining = interval - (time.perf_counter() - started)
+    if remaining > 0:
+        time.sleep(remaining)
+
+
+if __name__ == "__main__":
+    # Show how an adaptive client steps down on a slow link and back up
+    settings = StreamSettings((640, 480), adaptive=True, fps=15)
+    print(f"Ladder: {[tuple(tier) for tier in settings.ladder]}")
+    for _ in range(20):
+        settings.record_write(0.06, 40000)  # Slower than the 66 ms frame interval allows
+    print(f"Slow link: {settings.describe()}")
+    for _ in range(200):
+        settings.record_write(0.005, 20000)
+    print(f"Fast link: {settings.describe()}")
+    print(make_tier(600, 73, (640, 480)), StreamSettings((640, 480)).is_default)
@@ -0,0 +1,310 @@
+"""
+Tray Job Module for theSmallComparator
+Handles measuring a tray of parts: runs a measurement program in every slot of a grid, checkpointing each finished slot so an interrupted tray resumes where it stopped
+"""
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime
+
+from measurement_program import Datum, _clean_name
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.tray')
+
+# Most slots accepted for one tray
+MAX_TRAY_SLOTS = 2000
+CHECKPOINT_FILE = 'checkpoint.json'
+
+
+def slot_key(row, col):
+    return f"{row},{col}"
+
+
+def validate_job(job):
+    """
+    Check and normalise a tray job definition:
+    'name', 'program' (run in every slot), 'x', 'y' (machine position of the
+    datum of slot 0,0), 'pitch_x', 'pitch_y', 'rows', 'cols', optional 'z'
+    (height of the slot datums), 'angle' (tray rotation in radians) and
+    'slot_programs' ({"row,col": program name, or None for an empty slot})
+
+    Returns:
+        dict: The normalised job
+
+    Raises:
+        ValueError: If the job is malformed
+    """
+    try:
+        cleaned = {'name': _clean_name(job.get('name')), 'program': job.get('program'),
+                   'x': float(job['x']), 'y': float(job['y']), 'z': float(job.get('z', 0.0)),
+                   'pitch_x': float(job['pitch_x']), 'pitch_y': float(job['pitch_y']),
+                   'rows': int(job['rows']), 'cols': int(job['cols']),
+                   'angle': float(job.get('angle', 0.0)),
+                   'slot_programs': dict(job.get('slot_programs') or {})}
+    except KeyError as e:
+        raise ValueError(f"A tray job needs {e.args[0]}")
+    except (TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid tray job: {e}")
+    if cleaned['rows'] < 1 or cleaned['cols'] < 1:
+        raise ValueError("A tray needs at least one row and one column")
+    if cleaned['rows'] * cleaned['cols'] > MAX_TRAY_SLOTS:
+        raise ValueError(f"{cleaned['rows'] * cleaned['cols']} slots exceed the limit of {MAX_TRAY_SLOTS}")
+    if not cleaned['program'] and not any(cleaned['slot_programs'].values()):
+        raise ValueError("A tray job needs a program")
+    return cleaned
+
+
+def tray_slots(job):
+    """
+    Slots of a tray that have a program to run
+
+    Returns:
+        list: Dicts with 'row', 'col', machine 'x', 'y' of the slot datum and 'program'
+    """
+    cos, sin = math.cos(job['angle']), math.sin(job['angle'])
+    slots = []
+    for row in range(job['rows']):
+        for col in range(job['cols']):
+            program = job['slot_programs'].get(slot_key(row, col), job['program'])
+            if not program:
+                continue
+            dx, dy = col * job['pitch_x'], row * job['pitch_y']
+            slots.append({'row': row, 'col': col, 'program': program,
+                          'x': job['x'] + cos * dx - sin * dy, 'y': job['y'] + sin * dx + cos * dy})
+    return slots
+
+
+def _same_tray(saved, job):
+    """True if a checkpointed job is the same tray (the Z it was started at may differ)"""
+    return saved is not None and {k: v for k, v in saved.items() if k != 'z'} == \
+        {k: v for k, v in job.items() if k != 'z'}
+
+
+def order_slots(slots, model=None, start=None):
+    """
+    Slots in the order with the least travel time (see path_planner.plan_path)
+
+    Args:
+        slots (list): Slots from tray_slots()
+        model (MotionModel): Machine limits, GRBL defaults if None
+        start (sequence): Machine position the tray starts from
+
+    Returns:
+        list: The slots in visiting order
+    """
+    from path_planner import plan_path
+    order = plan_path([(slot['x'], slot['y']) for slot in slots], model, start=start)
+    return [slots[index] for index in order]
+
+
+class TrayCheckpoint:
+    """
+    Progress of a tray job in a JSON file, rewritten atomically after every
+    slot: the job definition and the result of each finished slot.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.job = None
+        self.slots = {}
+        self.started_at = None
+
+    def load(self):
+        """
+        Returns:
+            bool: True if a checkpoint was read
+        """
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return False
+        except ValueError as e:
+            logger.error(f"Ignoring unreadable tray checkpoint {self.path}: {e}")
+            return False
+        self.job, self.slots, self.started_at = data['job'], data['slots'], data.get('started_at')
+        return True
+
+    def start(self, job):
+        """Begin a new run of a job, forgetting any earlier progress"""
+        self.job = job
+        self.slots = {}
+        self.started_at = datetime.now().isoformat()
+        self.save()
+
+    def finish_slot(self, slot, status):
+        """Record a finished (or failed) slot and write the checkpoint"""
+        self.slots[slot_key(slot['row'], slot['col'])] = dict(status, finished_at=datetime.now().isoformat())
+        self.save()
+
+    def is_done(self, slot):
+        return slot_key(slot['row'], slot['col']) in self.slots
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump({'job': self.job, 'started_at': self.started_at, 'slots': self.slots}, f, indent=2)
+        os.replace(temporary, self.path)
+
+
+def write_part_results(directory, slot, results):
+    """
+    Write the points measured in one slot as a DXF and a CSV (part coordinates)
+
+    Args:
+        directory (str): Tray output directory
+        slot (dict): The slot
+        results (list): Points as reported by ProgramRunner
+
+    Returns:
+        list: Paths of the files written
+    """
+    from dxf_handler import DXFHandler
+    from exporters import PointExporter
+    base = os.path.join(directory, f"part_r{slot['row'] + 1}_c{slot['col'] + 1}")
+    drawing = DXFHandler()
+    drawing.add_points_from_list([(point['part_x'], point['part_y']) for point in results])
+    paths = []
+    if drawing.export_dxf(f"{base}.dxf"):
+        paths.append(f"{base}.dxf")
+    exporter = PointExporter(results, metadata={'row': slot['row'], 'col': slot['col']})
+    with open(f"{base}.csv", 'wb') as f:
+        for chunk in exporter.stream('csv'):
+            f.write(chunk)
+    paths.append(f"{base}.csv")
+    return paths
+
+
+class TrayScheduler:
+    """
+    Runs a tray job slot by slot, in the order with the least travel time
+    from where the machine is. Each slot is one program run with the slot
+    position as the part datum (programs with alignment features align the
+    part from there). A slot that fails is recorded and the tray moves on;
+    after an interruption the finished slots are skipped.
+    """
+
+    def __init__(self, job, directory, make_runner, resume=True, model=None, start=None):
+        """
+        Args:
+            job (dict): Tray job definition, see validate_job()
+            directory (str): Where the checkpoint and per-part results are written
+            make_runner (callable): Called as make_runner(program_name, datum) for every
+                slot; returns the ProgramRunner for it
+            resume (bool): Continue the checkpointed run of the same job, if there is one
+            model (MotionModel): Machine limits for ordering the slots
+            start (sequence): Machine position the tray starts from
+        """
+        self.job = validate_job(job)
+        self.directory = directory
+        self.make_runner = make_runner
+        self.checkpoint = TrayCheckpoint(os.path.join(directory, CHECKPOINT_FILE))
+        self.resumed = resume and self.checkpoint.load() and _same_tray(self.checkpoint.job, self.job)
+        if self.resumed:
+            self.job = self.checkpoint.job
+        else:
+            self.checkpoint.start(self.job)
+        self.slots = order_slots(tray_slots(self.job), model, start)
+        self.slot = None
+        self.running = False
+        self.error = None
+        self.duration = 0.0
+        self._runner = None
+        self._stop = threading.Event()
+        # Durations of the slots measured in this run, for the ETA
+        self._slot_times = []
+        self._slot_started = 0.0
+
+    def stop(self):
+        """Ask a running tray to end; the slot being measured is run again on resume"""
+        self._stop.set()
+        runner = self._runner
+        if runner is not None:
+            runner.stop()
+
+    def status(self):
+        done = self.checkpoint.slots
+        return {'job': self.job['name'], 'running': self.running, 'resumed': self.resumed,
+                'slot': self.slot, 'slots': len(self.slots), 'done': len(done),
+                'failed': sum(1 for result in done.values() if result.get('error')),
+                'error': self.error, 'duration': round(self.duration, 3),
+                'eta_seconds': round(self.eta(), 1) if self.running else 0.0}
+
+    def eta(self):
+        """
+        Estimated time left: the current slot's program ETA plus the slots not
+        started yet at the mean time of the slots measured in this run (or, before
+        the first one finishes, at the current slot's elapsed time plus its ETA)
+
+        Returns:
+            float: Seconds
+        """
+        runner = self._runner
+        current = runner.eta() if runner is not None and runner.running else 0.0
+        waiting = sum(1 for slot in self.slots if not self.checkpoint.is_done(slot)) - (runner is not None)
+        if self._slot_times:
+            per_slot = sum(self._slot_times) / len(self._slot_times)
+        elif runner is not None and runner.running:
+            per_slot = time.monotonic() - self._slot_started + current
+        else:
+            return current
+        return current + max(0, waiting) * per_slot
+
+    def run(self):
+        """
+        Measure every slot not finished yet
+
+        Returns:
+            dict: Final status
+        """
+        self.running = True
+        started = time.monotonic()
+        try:
+            for slot in self.slots:
+                if self._stop.is_set():
+                    break
+                if self.checkpoint.is_done(slot):
+                    continue
+                self.slot = {'row': slot['row'], 'col': slot['col']}
+                self._run_slot(slot)
+        except (OSError, RuntimeError, ValueError) as e:
+            self.error = str(e)
+            logger.error(f"Tray {self.job['name']} stopped: {e}")
+        finally:
+            self.duration = time.monotonic() - started
+            self.running = False
+        logger.info(f"Tray {self.job['name']}: {len(self.checkpoint.slots)}/{len(self.slots)} slots "
+                    f"in {self.duration:.1f}s")
+        return self.status()
+
+    def _run_slot(self, slot):
+        datum = Datum(slot['x'], slot['y'], self.job['z'], self.job['angle'])
+        self._slot_started = time.monotonic()
+        self._runner = self.make_runner(slot['program'], datum)
+        status = self._runner.run()
+        self._runner = None
+        if status['error'] is None and not status['completed']:
+            return  # Interrupted: measured again on resume
+        self._slot_times.append(time.monotonic() - self._slot_started)
+        result = {'program': slot['program'], 'results': status['results'], 'datum': status['datum'],
+                  'error': status['error']}
+        if status['results']:
+            result['files'] = write_part_results(self.directory, slot, status['results'])
+        self.checkpoint.finish_slot(slot, result)
+        logger.info(f"Tray {self.job['name']}: slot {slot['row'] + 1},{slot['col'] + 1} "
+                    f"{'failed: ' + status['error'] if status['error'] else 'done'}")
+
+
+if __name__ == "__main__":
+    # A 3 x 4 tray with an empty slot, in travel order from the machine origin
+    job = validate_job({'name': 'demo', 'program': 'bracket', 'x': 10.0, 'y': 10.0, 'pitch_x': 15.0,
+                        'pitch_y': 12.0, 'rows': 3, 'cols': 4, 'slot_programs': {'1,2': None}})
+    for slot in order_slots(tray_slots(job), start=(0.0, 0.0)):
+        print(slot['row'], slot['col'], round(slot['x'], 3), round(slot['y'], 3))
@@ -0,0 +1,201 @@
+"""
+Production WSGI Server Module for theSmallComparator
+Serves the Flask app from bounded thread pools, with streaming endpoints isolated from the API
+"""
+
+import logging
+import queue
+import selectors
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import BaseWSGIServer
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger('comparator.web')
+
+
+# Long-lived responses that must not occupy API worker threads
+STREAM_PATH_PREFIXES = (b'/video_feed',)
+
+DEFAULT_API_THREADS = 8
+DEFAULT_STREAM_THREADS = 4
+# Seconds a new connection may stay silent before its request line arrives
+REQUEST_HEAD_TIMEOUT = 10.0
+# Socket read timeout for API requests, so an idle client cannot hold a worker
+API_READ_TIMEOUT = 30.0
+
+STREAM_BUSY_RESPONSE = (
+    b"HTTP/1.0 503 Service Unavailable\r\n"
+    b"Content-Type: text/plain\r\n"
+    b"Retry-After: 5\r\n"
+    b"Connection: close\r\n\r\n"
+    b"Too many video streams open\r\n"
+)
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Werkzeug server that hands each connection to one of two bounded thread pools.
+
+    API requests queue for a fixed number of workers instead of spawning a
+    thread each. Streaming requests (MJPEG) get their own pool and a fixed
+    number of slots, so open video feeds can never starve jog/status requests;
+    clients beyond the limit get a 503 right away.
+
+    Which pool a connection goes to depends on its request line, so new
+    connections wait in a selector on a dispatcher thread until the line
+    arrives; neither the accepting thread nor a worker waits on a silent
+    client, and connections silent for REQUEST_HEAD_TIMEOUT are closed.
+    """
+
+    def __init__(self, host, port, app, api_threads=DEFAULT_API_THREADS, stream_threads=DEFAULT_STREAM_THREADS):
+        super().__init__(host, port, app)
+        self.api_pool = ThreadPoolExecutor(max_workers=api_threads, thread_name_prefix="api")
+        self.stream_pool = ThreadPoolExecutor(max_workers=stream_threads, thread_name_prefix="stream")
+        self.stream_slots = threading.BoundedSemaphore(stream_threads)
+        # Accepted connections handed to the dispatcher, and the socket that wakes it up
+        self._accepted = queue.SimpleQueue()
+        self._wakeup_receive, self._wakeup_send = socket.socketpair()
+        self._wakeup_send.setblocking(False)
+        self._closing = False
+        self._dispatcher = threading.Thread(target=self._dispatch_loop, name="dispatch", daemon=True)
+        self._dispatcher.start()
+
+    def process_request(self, request, client_address):
+        self._accepted.put((request, client_address))
+        try:
+            self._wakeup_send.send(b'\0')
+        except BlockingIOError:
+            pass  # A wakeup is pending already
+
+    def _dispatch_loop(self):
+        """Wait for the request line of new connections and hand each to its pool"""
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_receive, selectors.EVENT_READ)
+        waiting = {}  # socket: (client address, deadline)
+        try:
+            while not self._closing:
+                now = time.monotonic()
+                timeout = min((deadline for _, deadline in waiting.values()), default=now + 1.0) - now
+                for key, _ in selector.select(timeout=max(timeout, 0.0)):
+                    if key.fileobj is self._wakeup_receive:
+                        try:
+                            self._wakeup_receive.recv(4096)
+                        except OSError:
+                            pass
+                        while True:
+                            try:
+                                request, client_address = self._accepted.get_nowait()
+                            except queue.Empty:
+                                break
+                            waiting[request] = (client_address, time.monotonic() + REQUEST_HEAD_TIMEOUT)
+                            selector.register(request, selectors.EVENT_READ)
+                    else:
+                        client_address, _ = waiting.pop(key.fileobj)
+                        selector.unregister(key.fileobj)
+                        try:
+                            self._dispatch(key.fileobj, client_address)
+                        except Exception:
+                            self.handle_error(key.fileobj, client_address)
+                            self.shutdown_request(key.fileobj)
+                now = time.monotonic()
+                for request in [request for request, (_, deadline) in waiting.items() if deadline <= now]:
+                    selector.unregister(request)
+                    del waiting[request]
+                    self.shutdown_request(request)
+        finally:
+            for request in waiting:
+                self.shutdown_request(request)
+            selector.close()
+
+    def _is_stream_request(self, request):
+        """Peek at the request line, without consuming it, to find the target path"""
+        try:
+            request.settimeout(0)
+            head = request.recv(512, socket.MSG_PEEK)
+        except OSError:
+            return False
+        parts = head.split(b' ', 2)
+        return len(parts) > 1 and parts[1].startswith(STREAM_PATH_PREFIXES)
+
+    def _dispatch(self, request, client_address):
+        if self._is_stream_request(request):
+            request.settimeout(None)
+            if not self.stream_slots.acquire(blocking=False):
+                try:
+                    request.sendall(STREAM_BUSY_RESPONSE)
+                except OSError:
+                    pass
+                self.shutdown_request(request)
+                return
+            self.stream_pool.submit(self._handle, request, client_address, self.stream_slots)
+        else:
+            request.settimeout(API_READ_TIMEOUT)
+            self.api_pool.submit(self._handle, request, client_address, None)
+
+    def _handle(self, request, client_address, slots):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            if slots is not None:
+                slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._closing = True
+        try:
+            self._wakeup_send.send(b'\0')
+        except OSError:
+            pass
+        self._dispatcher.join(timeout=5.0)
+        self._wakeup_send.close()
+        self._wakeup_receive.close()
+
+    def close_pools(self):
+        """Wait for running requests to finish and drop queued ones"""
+        self.api_pool.shutdown(wait=True, cancel_futures=True)
+        self.stream_pool.shutdown(wait=True, cancel_futures=True)
+
+
+def serve_production(app, host='0.0.0.0', port=5001, api_threads=DEFAULT_API_THREADS,
+                     stream_threads=DEFAULT_STREAM_THREADS, on_shutdown=None):
+    """
+    Serve a WSGI app until SIGTERM/SIGINT, then shut down cleanly
+
+    Args:
+        app: WSGI application
+        host (str): Interface to bind
+        port (int): Port to bind
+        api_threads (int): Worker threads for API and page requests
+        stream_threads (int): Maximum number of concurrent streaming clients
+        on_shutdown (callable): Called after the server stops accepting requests,
+            before waiting for the pools (e.g. to end MJPEG generators)
+    """
+    server = PooledWSGIServer(host, port, app, api_threads=api_threads, stream_threads=stream_threads)
+
+    def request_shutdown(signum, frame):
+        logger.info(f"Received signal {signum}, shutting down server")
+        # shutdown() waits for serve_forever to return, so it can't run on the serving thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, request_shutdown)
+    signal.signal(signal.SIGINT, request_shutdown)
+
+    logger.info(f"Production server on {host}:{port} "
+                 f"({api_threads} API threads, {stream_threads} stream slots)")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if on_shutdown is not None:
+            on_shutdown()
+        server.close_pools()
+        logger.info("Server stopped")